@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""Measure the accuracy and the speed of the score-based beam pruning
+
+Decodes noisy synthetic emissions spelling random label sequences with
+different ``beam_threshold``, and reports the decoding time, the number of
+prefixes expanded per frame, the label error rate of the top beam against
+the reference, and the fraction of the top beams identical to the ones of
+the search without the threshold.
+
+With ``--emission``, a saved emission (``[batch, num_frames, num_labels]``
+or ``[num_frames, num_labels]`` logits) is decoded instead, and only the
+agreement is reported.
+"""
+import time
+import argparse
+
+import torch
+import simple_ctc
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--emission', help='Path to a Tensor saved with `torch.save`.')
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--num-tokens', type=int, default=100)
+    parser.add_argument('--num-labels', type=int, default=32)
+    parser.add_argument('--noise', type=float, default=1.5)
+    parser.add_argument('--beam-size', type=int, default=100)
+    parser.add_argument('--beam-thresholds', type=float, nargs='+',
+                        default=[30, 20, 15, 10, 5])
+    parser.add_argument('--num-processes', type=int, default=4)
+    parser.add_argument('--num-repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+
+def _generate_emission(args):
+    generator = torch.Generator().manual_seed(args.seed)
+    references = torch.randint(
+        1, args.num_labels, (args.batch_size, args.num_tokens), generator=generator)
+    # each label followed by blank, so that repeated labels are distinct
+    num_frames = 2 * args.num_tokens
+    logits = args.noise * torch.randn(
+        args.batch_size, num_frames, args.num_labels, generator=generator)
+    frames = torch.arange(0, num_frames, 2)
+    for i in range(args.batch_size):
+        logits[i, frames, references[i]] += 5
+        logits[i, frames + 1, 0] += 5
+    return logits.log_softmax(dim=-1), references.tolist()
+
+
+def _load_emission(path):
+    emission = torch.load(path).detach()
+    if emission.dim() == 2:
+        emission = emission.unsqueeze(0)
+    return emission.log_softmax(dim=-1), None
+
+
+def _edit_distance(ref, hyp):
+    dist = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, 1):
+        prev, dist[0] = dist[0], i
+        for j, h in enumerate(hyp, 1):
+            prev, dist[j] = dist[j], min(dist[j] + 1, dist[j - 1] + 1, prev + (r != h))
+    return dist[-1]
+
+
+def _decode(args, emission, beam_threshold):
+    decoder = simple_ctc.BeamSearchDecoder(
+        [str(i) for i in range(emission.size(-1))], beam_size=args.beam_size,
+        blank_id=0, is_nll=True, num_processes=args.num_processes, nbest=1,
+        beam_threshold=beam_threshold, collect_stats=True)
+    elapsed = []
+    for _ in range(args.num_repeats):
+        t0 = time.monotonic()
+        tokens, offsets, _, _ = decoder.forward_ragged(emission)
+        elapsed.append(time.monotonic() - t0)
+    stats = decoder.get_stats()
+    hyps = [tokens[offsets[i]:offsets[i + 1]].tolist() for i in range(emission.size(0))]
+    return hyps, min(elapsed), stats['prefixes_expanded'] / stats['frames']
+
+
+def _main():
+    args = _parse_args()
+    if args.emission is None:
+        emission, references = _generate_emission(args)
+    else:
+        emission, references = _load_emission(args.emission)
+    print(f'# {emission.size(0)} items, {emission.size(1)} frames, beam_size {args.beam_size}')
+
+    print('beam_threshold,time [sec],speedup,expanded / frame,LER,agreement')
+    baseline, baseline_time = None, None
+    for beam_threshold in [None] + args.beam_thresholds:
+        hyps, elapsed, expanded = _decode(args, emission, beam_threshold)
+        baseline = baseline or hyps
+        baseline_time = baseline_time or elapsed
+        agreement = sum(h == b for h, b in zip(hyps, baseline)) / len(hyps)
+        ler = '-'
+        if references is not None:
+            errors = sum(_edit_distance(r, h) for r, h in zip(references, hyps))
+            ler = f'{errors / sum(len(r) for r in references):.4f}'
+        print(f'{"-" if beam_threshold is None else beam_threshold},{elapsed:.4f},'
+              f'{baseline_time / elapsed:.2f},{expanded:.1f},{ler},{agreement:.3f}')
+
+
+if __name__ == '__main__':
+    _main()
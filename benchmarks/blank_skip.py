@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""Measure the effect of blank frame skipping on the wav2vec2 sample
+
+Decodes the emission bundled with the tests with different values of
+``blank_skip_threshold``, and reports the number of frames searched, the
+decoding time and the word error rate against the reference transcript.
+"""
+import os
+import sys
+import time
+import argparse
+
+import torch
+import simple_ctc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'tests'))
+from test_decode import WAV2VEC2_ENGLISH_LABEL  # noqa: E402
+
+SAMPLE_PATH = os.path.join(
+    os.path.dirname(__file__), '..', 'tests',
+    'librispeech-test-clean-121-121726-0000-with-wav2vec_small_960h.pt')
+REFERENCE = (
+    'ALSO A POPULAR CONTRIVANCE WHEREBY LOVE MAKING MAY BE SUSPENDED '
+    'BUT NOT STOPPED DURING THE PICNIC SEASON')
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--thresholds', type=float, nargs='+', default=[0.9999, 0.999, 0.99, 0.9])
+    parser.add_argument('--beam-size', type=int, default=100)
+    parser.add_argument('--num-repeats', type=int, default=20)
+    return parser.parse_args()
+
+
+def _edit_distance(ref, hyp):
+    dist = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, 1):
+        prev, dist[0] = dist[0], i
+        for j, h in enumerate(hyp, 1):
+            prev, dist[j] = dist[j], min(dist[j] + 1, dist[j - 1] + 1, prev + (r != h))
+    return dist[-1]
+
+
+def _main():
+    args = _parse_args()
+    emission = torch.load(SAMPLE_PATH).detach()
+    reference = REFERENCE.split()
+
+    print('threshold,frames searched,time [sec],WER')
+    for threshold in [None] + args.thresholds:
+        decoder = simple_ctc.BeamSearchDecoder(
+            WAV2VEC2_ENGLISH_LABEL, beam_size=args.beam_size, blank_id=0,
+            is_nll=True, num_processes=1, blank_skip_threshold=threshold)
+        elapsed = []
+        for _ in range(args.num_repeats):
+            t0 = time.monotonic()
+            result = decoder.decode(emission)
+            elapsed.append(time.monotonic() - t0)
+        stream = decoder.stream()
+        stream.next(emission[0])
+        num_searched = emission.size(1) - stream.stats()['frames_skipped']
+        hypothesis = ''.join(result.label_sequences[0][0]).split('|')
+        hypothesis = [word for word in hypothesis if word]
+        wer = _edit_distance(reference, hypothesis) / len(reference)
+        print(f'{"" if threshold is None else threshold},'
+              f'{num_searched}/{emission.size(1)},{min(elapsed):.4f},{wer:.4f}')
+
+
+if __name__ == '__main__':
+    _main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""Measure the load time and the memory usage of language models
+
+Generates a synthetic 4-gram model in ARPA format, converts it to the binary
+format, then loads each of them in a fresh process, and reports the time to
+load and the increase of the resident set size.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--vocab-size', type=int, default=50000)
+    parser.add_argument(
+        '--num-ngrams', type=int, default=1000000,
+        help='The number of the highest order n-grams.')
+    parser.add_argument('--num-repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--load', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def _rss_kb():
+    with open('/proc/self/status') as file_:
+        for line in file_:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+def _generate_arpa(path, vocab_size, num_ngrams, seed):
+    rng = random.Random(seed)
+    words = [f'w{i}' for i in range(vocab_size)]
+    ngrams = [set() for _ in range(4)]
+    while len(ngrams[3]) < num_ngrams:
+        ngram = tuple(rng.choice(words) for _ in range(4))
+        # lower order n-grams are the prefixes, so that every context exists
+        for order in range(2, 5):
+            ngrams[order - 1].add(ngram[:order])
+    ngrams[0] = [('<s>',), ('</s>',), ('<unk>',)] + [(w,) for w in words]
+
+    with open(path, 'w') as file_:
+        file_.write('\\data\\\n')
+        for order, entries in enumerate(ngrams, 1):
+            file_.write(f'ngram {order}={len(entries)}\n')
+        for order, entries in enumerate(ngrams, 1):
+            file_.write(f'\n\\{order}-grams:\n')
+            for ngram in entries:
+                prob = -rng.uniform(0.1, 5.0)
+                if order < 4:
+                    backoff = -rng.uniform(0.0, 1.0)
+                    file_.write(f'{prob:.6f}\t{" ".join(ngram)}\t{backoff:.6f}\n')
+                else:
+                    file_.write(f'{prob:.6f}\t{" ".join(ngram)}\n')
+        file_.write('\n\\end\\\n')
+
+
+def _load(path):
+    import torch
+    import simple_ctc  # noqa: F401
+
+    rss = _rss_kb()
+    t0 = time.monotonic()
+    model = torch.classes.simple_ctc.LanguageModel(path)
+    elapsed = time.monotonic() - t0
+    print(f'{elapsed},{_rss_kb() - rss},{model.size()}')
+
+
+def _measure(path, num_repeats):
+    results = []
+    for _ in range(num_repeats):
+        output = subprocess.run(
+            [sys.executable, __file__, '--load', path],
+            check=True, capture_output=True, text=True).stdout
+        elapsed, rss, size = output.strip().split(',')
+        results.append((float(elapsed), int(rss), int(size)))
+    return min(results)
+
+
+def _main():
+    args = _parse_args()
+    if args.load is not None:
+        _load(args.load)
+        return
+
+    import simple_ctc
+
+    with tempfile.TemporaryDirectory() as dir_:
+        arpa_path = os.path.join(dir_, 'model.arpa')
+        bin_path = os.path.join(dir_, 'model.bin')
+        _generate_arpa(arpa_path, args.vocab_size, args.num_ngrams, args.seed)
+
+        t0 = time.monotonic()
+        simple_ctc.compile_language_model(arpa_path, bin_path)
+        compile_time = time.monotonic() - t0
+
+        print('format,file_size [MB],model_size [MB],load_time [sec],rss_increase [MB]')
+        for name, path in [('arpa', arpa_path), ('binary', bin_path)]:
+            elapsed, rss, size = _measure(path, args.num_repeats)
+            print(f'{name},{os.path.getsize(path) / 2**20:.1f},{size / 2**20:.1f},'
+                  f'{elapsed:.4f},{rss / 2**10:.1f}')
+        print(f'# compile time: {compile_time:.2f} [sec]', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    _main()
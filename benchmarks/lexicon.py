@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""Measure lexicon compilation, loading and constrained decoding
+
+Compiles a synthetic lexicon, loads it, and decodes noisy synthetic
+emissions spelling random sentences of its words, with and without the
+lexicon. Reports the decoding time and the word error rate of the top beam.
+"""
+import os
+import time
+import random
+import argparse
+import tempfile
+
+import torch
+import simple_ctc
+
+LABELS = ['<b>', ' '] + [chr(ord('a') + i) for i in range(26)]
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--num-words', type=int, default=200000)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--sentence-length', type=int, default=30)
+    parser.add_argument('--noise', type=float, default=1.5)
+    parser.add_argument('--beam-size', type=int, default=100)
+    parser.add_argument('--num-processes', type=int, default=4)
+    parser.add_argument('--num-repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+
+def _generate_words(rng, num_words):
+    words = set()
+    while len(words) < num_words:
+        words.add(''.join(rng.choice(LABELS[2:]) for _ in range(rng.randint(2, 9))))
+    return sorted(words)
+
+
+def _generate_emission(rng, words, batch_size, sentence_length, noise):
+    generator = torch.Generator().manual_seed(rng.randint(0, 2**31))
+    sentences, sequences = [], []
+    for _ in range(batch_size):
+        sentence = rng.sample(words, sentence_length)
+        labels = []
+        for char in ' '.join(sentence):
+            labels += [LABELS.index(char), 0]
+        sentences.append(sentence)
+        sequences.append(labels)
+    num_frames = max(len(s) for s in sequences)
+    logits = noise * torch.randn(batch_size, num_frames, len(LABELS), generator=generator)
+    for i, labels in enumerate(sequences):
+        logits[i, torch.arange(len(labels)), labels] += 5
+    seq_lens = torch.tensor([len(s) for s in sequences], dtype=torch.int32)
+    return logits.log_softmax(dim=-1), seq_lens, sentences
+
+
+def _edit_distance(ref, hyp):
+    dist = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, 1):
+        prev, dist[0] = dist[0], i
+        for j, h in enumerate(hyp, 1):
+            prev, dist[j] = dist[j], min(dist[j] + 1, dist[j - 1] + 1, prev + (r != h))
+    return dist[-1]
+
+
+def _main():
+    args = _parse_args()
+    rng = random.Random(args.seed)
+    words = _generate_words(rng, args.num_words)
+    emission, seq_lens, sentences = _generate_emission(
+        rng, words, args.batch_size, args.sentence_length, args.noise)
+
+    with tempfile.TemporaryDirectory() as dir_:
+        path = os.path.join(dir_, 'lexicon.bin')
+        t0 = time.monotonic()
+        simple_ctc.compile_lexicon(words, LABELS, path)
+        compile_time = time.monotonic() - t0
+        t0 = time.monotonic()
+        lexicon = torch.classes.simple_ctc.Lexicon(path)
+        load_time = time.monotonic() - t0
+        print(f'# {lexicon.num_words()} words, {lexicon.num_states()} states, '
+              f'{os.path.getsize(path) / 2**20:.1f} MB, '
+              f'compile {compile_time:.2f} [sec], load {load_time:.5f} [sec]')
+
+        print('lexicon,time [sec],WER')
+        for lexicon_path in [None, path]:
+            decoder = simple_ctc.BeamSearchDecoder(
+                LABELS, beam_size=args.beam_size, blank_id=0, is_nll=True,
+                num_processes=args.num_processes, lexicon_path=lexicon_path)
+            elapsed = []
+            for _ in range(args.num_repeats):
+                t0 = time.monotonic()
+                result = decoder.decode(emission, seq_lens)
+                elapsed.append(time.monotonic() - t0)
+            errors = sum(
+                _edit_distance(ref, ''.join(labels[0]).split())
+                for ref, labels in zip(sentences, result.label_sequences))
+            num_words = sum(len(ref) for ref in sentences)
+            print(f'{"no" if lexicon_path is None else "yes"},'
+                  f'{min(elapsed):.4f},{errors / num_words:.4f}')
+
+
+if __name__ == '__main__':
+    _main()
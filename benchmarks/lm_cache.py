@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""Measure the decoding time with the language model score cache
+
+Decodes synthetic emissions spelling random sentences, without a language
+model, and with a language model with and without the score cache.
+"""
+import os
+import time
+import random
+import argparse
+import tempfile
+
+import torch
+import simple_ctc
+
+LABELS = ['<b>', ' '] + [chr(ord('a') + i) for i in range(26)]
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--vocab-size', type=int, default=5000)
+    parser.add_argument('--num-ngrams', type=int, default=200000)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--num-words', type=int, default=60)
+    parser.add_argument('--beam-size', type=int, default=100)
+    parser.add_argument('--num-processes', type=int, default=4)
+    parser.add_argument('--cache-size', type=int, default=65536)
+    parser.add_argument('--num-repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+
+def _generate_words(rng, vocab_size):
+    words = set()
+    while len(words) < vocab_size:
+        words.add(''.join(rng.choice(LABELS[2:]) for _ in range(rng.randint(2, 7))))
+    return sorted(words)
+
+
+def _generate_arpa(path, rng, words, num_ngrams):
+    ngrams = [[(w,) for w in ['<s>', '</s>', '<unk>'] + words], set(), set()]
+    while len(ngrams[2]) < num_ngrams:
+        ngram = tuple(rng.choice(words) for _ in range(3))
+        ngrams[1].add(ngram[:2])
+        ngrams[2].add(ngram)
+    with open(path, 'w') as file_:
+        file_.write('\\data\\\n')
+        for order, entries in enumerate(ngrams, 1):
+            file_.write(f'ngram {order}={len(entries)}\n')
+        for order, entries in enumerate(ngrams, 1):
+            file_.write(f'\n\\{order}-grams:\n')
+            for ngram in entries:
+                line = f'{-rng.uniform(0.1, 5.0):.6f}\t{" ".join(ngram)}'
+                if order < 3:
+                    line += f'\t{-rng.uniform(0.0, 1.0):.6f}'
+                file_.write(line + '\n')
+        file_.write('\n\\end\\\n')
+
+
+def _generate_emission(rng, words, batch_size, num_words):
+    generator = torch.Generator().manual_seed(rng.randint(0, 2**31))
+    sequences = []
+    for _ in range(batch_size):
+        labels = []
+        for word in rng.sample(words, num_words):
+            for char in word + ' ':
+                labels += [LABELS.index(char), 0]
+        sequences.append(labels)
+    num_frames = max(len(s) for s in sequences)
+    logits = 2 * torch.randn(batch_size, num_frames, len(LABELS), generator=generator)
+    for i, labels in enumerate(sequences):
+        logits[i, torch.arange(len(labels)), labels] += 5
+    return logits.log_softmax(dim=-1)
+
+
+def _time(decoder, emission, num_repeats):
+    elapsed = []
+    for _ in range(num_repeats):
+        t0 = time.monotonic()
+        decoder(emission)
+        elapsed.append(time.monotonic() - t0)
+    return min(elapsed)
+
+
+def _main():
+    args = _parse_args()
+    rng = random.Random(args.seed)
+    words = _generate_words(rng, args.vocab_size)
+    emission = _generate_emission(rng, words, args.batch_size, args.num_words)
+    config = dict(
+        beam_size=args.beam_size, blank_id=0, is_nll=True,
+        num_processes=args.num_processes, word_delimiter=' ')
+
+    with tempfile.TemporaryDirectory() as dir_:
+        lm_path = os.path.join(dir_, 'model.arpa')
+        _generate_arpa(lm_path, rng, words, args.num_ngrams)
+
+        print('language_model,cache_size,time [sec],hits,misses')
+        decoder = simple_ctc.BeamSearchDecoder(LABELS, **config)
+        print(f'no,0,{_time(decoder, emission, args.num_repeats):.4f},,')
+        for cache_size in [0, args.cache_size]:
+            decoder = simple_ctc.BeamSearchDecoder(
+                LABELS, model_path=lm_path, lm_cache_size=cache_size, **config)
+            elapsed = _time(decoder, emission, args.num_repeats)
+            stats = {} if decoder.lm_cache is None else decoder.lm_cache.stats()
+            print(f'yes,{cache_size},{elapsed:.4f},'
+                  f'{stats.get("hits", "")},{stats.get("misses", "")}')
+
+
+if __name__ == '__main__':
+    _main()
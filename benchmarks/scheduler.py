@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""Measure the batch decoding time over the number of threads
+
+Decodes a batch of synthetic emissions of skewed lengths with different
+``num_processes``, and reports the wall time and the speedup over one thread.
+
+The load balance is also reported independently of the number of cores
+available: each item is timed alone, and the completion time is computed
+for the static split into contiguous chunks (``at::parallel_for`` with
+``grain_size=batch_size / num_processes``) and for the longest-first dynamic
+scheduling.
+"""
+import time
+import heapq
+import argparse
+
+import torch
+import simple_ctc
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--median-frames', type=int, default=200)
+    parser.add_argument('--sigma', type=float, default=1.0,
+                        help='The standard deviation of the log of the lengths.')
+    parser.add_argument('--num-labels', type=int, default=32)
+    parser.add_argument('--beam-size', type=int, default=50)
+    parser.add_argument('--num-processes', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--num-repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+
+def _generate_emission(args):
+    generator = torch.Generator().manual_seed(args.seed)
+    seq_lens = (args.median_frames * torch.empty(args.batch_size).log_normal_(
+        0, args.sigma, generator=generator)).clamp(min=1).to(torch.int32)
+    logits = 3 * torch.randn(
+        args.batch_size, int(seq_lens.max()), args.num_labels, generator=generator)
+    return logits.log_softmax(dim=-1), seq_lens
+
+
+def _decoder(args, num_processes):
+    return simple_ctc.BeamSearchDecoder(
+        [str(i) for i in range(args.num_labels)], beam_size=args.beam_size,
+        blank_id=0, is_nll=True, num_processes=num_processes)
+
+
+def _time(func, num_repeats):
+    elapsed = []
+    for _ in range(num_repeats):
+        t0 = time.monotonic()
+        func()
+        elapsed.append(time.monotonic() - t0)
+    return min(elapsed)
+
+
+def _static_makespan(costs, num_threads):
+    # contiguous chunks, as `at::parallel_for` splits the range
+    grain = max(len(costs) // num_threads, 1)
+    num_chunks = min(num_threads, -(-len(costs) // grain))
+    chunk = -(-len(costs) // num_chunks)
+    return max(sum(costs[i:i + chunk]) for i in range(0, len(costs), chunk))
+
+
+def _dynamic_makespan(costs, num_threads):
+    # each item goes to the first thread to become free, longest first
+    finish = [0.0] * num_threads
+    for cost in sorted(costs, reverse=True):
+        heapq.heapreplace(finish, finish[0] + cost)
+    return max(finish)
+
+
+def _main():
+    args = _parse_args()
+    emission, seq_lens = _generate_emission(args)
+    print(f'# {args.batch_size} items, {int(seq_lens.min())} - {int(seq_lens.max())} frames')
+
+    decoder = _decoder(args, 1)
+    costs = [
+        _time(lambda: decoder(emission[i:i + 1, :seq_lens[i]]), args.num_repeats)
+        for i in range(args.batch_size)]
+    total = sum(costs)
+
+    print('num_processes,time [sec],speedup,static balance,dynamic balance')
+    baseline = None
+    for num_processes in args.num_processes:
+        decoder = _decoder(args, num_processes)
+        elapsed = _time(lambda: decoder(emission, seq_lens), args.num_repeats)
+        baseline = baseline or elapsed
+        print(f'{num_processes},{elapsed:.4f},{baseline / elapsed:.2f},'
+              f'{total / _static_makespan(costs, num_processes):.2f},'
+              f'{total / _dynamic_makespan(costs, num_processes):.2f}')
+
+
+if __name__ == '__main__':
+    _main()
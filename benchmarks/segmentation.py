@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""Measure the accuracy and the speed of the decoding in segments
+
+Decodes the wav2vec2 sample in ``tests`` (repeated ``--num-tiles`` times, to
+make a long utterance) as a single sequence with different
+``segment_min_blank_frames``, and reports the number of segments, the
+decoding time, the fraction of the n-best transcripts identical to the ones
+of the decoding without segmentation, and the largest score difference.
+
+With ``--emission``, a saved emission (``[num_frames, num_labels]`` logits)
+is decoded instead.
+"""
+import os
+import time
+import argparse
+
+import torch
+import simple_ctc
+
+_SAMPLE = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), '..', 'tests',
+    'librispeech-test-clean-121-121726-0000-with-wav2vec_small_960h.pt')
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--emission', default=_SAMPLE,
+                        help='Path to a Tensor saved with `torch.save`.')
+    parser.add_argument('--num-tiles', type=int, default=10)
+    parser.add_argument('--beam-size', type=int, default=100)
+    parser.add_argument('--nbest', type=int, default=10)
+    parser.add_argument('--min-blank-frames', type=int, nargs='+',
+                        default=[20, 10, 5, 3])
+    parser.add_argument('--blank-threshold', type=float, default=0.999)
+    parser.add_argument('--num-processes', type=int, default=4)
+    parser.add_argument('--num-repeats', type=int, default=3)
+    return parser.parse_args()
+
+
+def _decode(args, emission, min_blank_frames):
+    decoder = simple_ctc.BeamSearchDecoder(
+        [str(i) for i in range(emission.size(-1))], beam_size=args.beam_size,
+        blank_id=0, is_nll=True, num_processes=args.num_processes, nbest=args.nbest,
+        segment_min_blank_frames=min_blank_frames,
+        segment_blank_threshold=args.blank_threshold, collect_stats=True)
+    elapsed = []
+    for _ in range(args.num_repeats):
+        t0 = time.monotonic()
+        tokens, offsets, scores, _ = decoder.forward_ragged(emission)
+        elapsed.append(time.monotonic() - t0)
+    stats = decoder.get_stats()
+    hyps = [tokens[offsets[i]:offsets[i + 1]].tolist() for i in range(offsets.numel() - 1)]
+    return hyps, scores.flatten(), min(elapsed), stats['segments'] / stats['calls']
+
+
+def _main():
+    args = _parse_args()
+    emission = torch.load(args.emission).detach()
+    emission = emission.reshape(-1, emission.size(-1)).repeat(args.num_tiles, 1)
+    emission = emission.log_softmax(dim=-1).unsqueeze(0)
+    print(f'# {emission.size(1)} frames, beam_size {args.beam_size}, nbest {args.nbest}')
+
+    print('min_blank_frames,segments,time [sec],speedup,agreement,max score diff')
+    baseline = None
+    for min_blank_frames in [None] + args.min_blank_frames:
+        hyps, scores, elapsed, segments = _decode(args, emission, min_blank_frames)
+        baseline = baseline or (hyps, scores, elapsed)
+        agreement = sum(h == b for h, b in zip(hyps, baseline[0])) / len(hyps)
+        diff = (scores - baseline[1]).abs().max().item()
+        print(f'{"-" if min_blank_frames is None else min_blank_frames},{segments:.0f},'
+              f'{elapsed:.4f},{baseline[2] / elapsed:.2f},{agreement:.3f},{diff:.2e}')
+
+
+if __name__ == '__main__':
+    _main()
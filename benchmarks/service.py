@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""Compare a shared decoding service with decoding in each process
+
+Runs ``--num-clients`` processes, each of which decodes crops of the
+wav2vec2 sample in ``tests`` one after another, like the encoder processes
+of a host would. The same number of decoder threads is used in total: either
+each process decodes with ``num_processes=num_threads / num_clients``, or
+all of them submit to one ``DecodeServer`` with ``num_processes=num_threads``.
+Reports the throughput and the latency percentiles of the requests.
+"""
+import os
+import time
+import argparse
+import tempfile
+import statistics
+import multiprocessing
+
+import torch
+import simple_ctc
+
+_SAMPLE = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), '..', 'tests',
+    'librispeech-test-clean-121-121726-0000-with-wav2vec_small_960h.pt')
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--num-clients', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--num-threads', type=int, default=4)
+    parser.add_argument('--num-requests', type=int, default=20,
+                        help='The number of requests of each client.')
+    parser.add_argument('--beam-size', type=int, default=50)
+    parser.add_argument('--max-batch-size', type=int, default=16)
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+
+def _decoder(args, num_processes):
+    labels = [str(i) for i in range(torch.load(_SAMPLE).size(-1))]
+    return simple_ctc.BeamSearchDecoder(
+        labels, beam_size=args.beam_size, blank_id=0, is_nll=True,
+        num_processes=num_processes, nbest=1)
+
+
+def _requests(args, client_id):
+    # crops between half and twice the length of the sample
+    emission = torch.load(_SAMPLE).detach().log_softmax(dim=-1)
+    emission = emission.reshape(-1, emission.size(-1)).repeat(2, 1)
+    generator = torch.Generator().manual_seed(args.seed + client_id)
+    lengths = torch.randint(
+        emission.size(0) // 4, emission.size(0), (args.num_requests,), generator=generator)
+    return [emission[:length] for length in lengths.tolist()]
+
+
+def _run_client(args, client_id, num_clients, address, barrier, results):
+    requests = _requests(args, client_id)
+    if address is None:
+        decoder = _decoder(args, max(args.num_threads // num_clients, 1))
+
+        def decode(emission):
+            return decoder.forward_ragged(emission.unsqueeze(0))
+    else:
+        client = simple_ctc.DecodeClient(address)
+        decode = client.decode
+    barrier.wait()
+    latencies = []
+    for emission in requests:
+        t0 = time.monotonic()
+        decode(emission)
+        latencies.append(time.monotonic() - t0)
+    results.put(latencies)
+    if address is not None:
+        client.close()
+
+
+def _run_server(args, address, ready):
+    with simple_ctc.DecodeServer(
+            _decoder(args, args.num_threads), address,
+            max_batch_size=args.max_batch_size) as server:
+        ready.set()
+        server.serve_forever()
+
+
+def _run(args, num_clients, address):
+    context = multiprocessing.get_context('spawn')
+    server = None
+    if address is not None:
+        ready = context.Event()
+        server = context.Process(target=_run_server, args=(args, address, ready))
+        server.start()
+        ready.wait()
+    barrier = context.Barrier(num_clients + 1)
+    results = context.Queue()
+    clients = [
+        context.Process(target=_run_client, args=(args, i, num_clients, address, barrier, results))
+        for i in range(num_clients)]
+    for client in clients:
+        client.start()
+    barrier.wait()
+    t0 = time.monotonic()
+    latencies = sum([results.get() for _ in clients], [])
+    elapsed = time.monotonic() - t0
+    for client in clients:
+        client.join()
+    if server is not None:
+        server.terminate()
+        server.join()
+    quantiles = statistics.quantiles(latencies, n=10, method='inclusive')
+    return len(latencies) / elapsed, 1000 * quantiles[4], 1000 * quantiles[8]
+
+
+def _main():
+    args = _parse_args()
+    print(f'# {args.num_threads} decoder threads in total, {os.cpu_count()} cores')
+    print('num_clients,mode,throughput [requests/sec],p50 latency [ms],p90 latency [ms]')
+    with tempfile.TemporaryDirectory() as dir_:
+        for num_clients in args.num_clients:
+            for mode, address in [
+                    ('in-process', None), ('service', os.path.join(dir_, f'{num_clients}.sock'))]:
+                throughput, p50, p90 = _run(args, num_clients, address)
+                print(f'{num_clients},{mode},{throughput:.2f},{p50:.1f},{p90:.1f}')
+
+
+if __name__ == '__main__':
+    _main()
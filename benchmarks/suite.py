@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""Measure the decoder over emissions and configurations, and compare runs
+
+``run`` decodes synthetic emissions and the wav2vec2 sample in ``tests``,
+and writes the results as JSON. Starting from a default case, one parameter
+is varied at a time, over the emission (vocabulary size, number of frames,
+fraction of blank frames and how peaky the posteriors are) and over the
+decoder (``beam_size``, ``cutoff_top_n``, ``cutoff_prob``, batch size and
+``num_processes``). For each case, the latency percentiles of decoding the
+batch, the throughput in frames per second, the peak memory used by the
+decoding (each case runs in a new process, and the peak is reset after the
+setup, on Linux) and the peak number of nodes in the prefix trie are
+reported.
+
+``compare`` lists the changes of latency, throughput and memory between two
+runs of the same cases, and exits with status 1 if any of them regressed by
+more than ``--threshold``.
+
+    python benchmarks/suite.py run --output before.json
+    python benchmarks/suite.py run --output after.json
+    python benchmarks/suite.py compare before.json after.json
+"""
+import os
+import sys
+import json
+import math
+import time
+import platform
+import argparse
+import statistics
+import multiprocessing
+
+import torch
+import simple_ctc
+
+_SAMPLE = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), '..', 'tests',
+    'librispeech-test-clean-121-121726-0000-with-wav2vec_small_960h.pt')
+
+_EMISSION_DEFAULTS = {
+    'vocab_size': 32,
+    'num_frames': 500,
+    'blank_ratio': 0.7,
+    'peakiness': 5.0,
+}
+_DECODER_DEFAULTS = {
+    'beam_size': 50,
+    'cutoff_top_n': 40,
+    'cutoff_prob': 1.0,
+    'batch_size': 8,
+    'num_processes': 4,
+}
+_AXES = {
+    'vocab_size': [32, 1000, 10000],
+    'num_frames': [200, 500, 2000],
+    'blank_ratio': [0.5, 0.7, 0.9],
+    'peakiness': [2.0, 5.0, 10.0],
+    'beam_size': [10, 50, 100],
+    'cutoff_top_n': [10, 40, 100],
+    'cutoff_prob': [0.9, 0.99, 1.0],
+    'batch_size': [1, 8, 32],
+    'num_processes': [1, 2, 4],
+}
+# (metric, whether larger is better)
+_METRICS = [
+    ('latency_ms.p50', False),
+    ('latency_ms.p90', False),
+    ('frames_per_sec', True),
+    ('peak_rss_mb', False),
+]
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run = subparsers.add_parser('run', help='Run the benchmarks.')
+    run.add_argument('--output', required=True, help='Path to the JSON file to write.')
+    run.add_argument('--axes', nargs='+', choices=list(_AXES), default=list(_AXES),
+                     help='The parameters to vary.')
+    run.add_argument('--emissions', nargs='+', choices=['synthetic', 'wav2vec2'],
+                     default=['synthetic', 'wav2vec2'])
+    run.add_argument('--num-repeats', type=int, default=10)
+    run.add_argument('--seed', type=int, default=0)
+    compare = subparsers.add_parser('compare', help='Compare two runs.')
+    compare.add_argument('baseline', help='Path to the JSON file of the reference run.')
+    compare.add_argument('current', help='Path to the JSON file of the run to check.')
+    compare.add_argument('--threshold', type=float, default=0.1,
+                         help='The relative change regarded as a regression.')
+    compare.add_argument('--min-memory-mb', type=float, default=1.0,
+                         help='Smaller changes of the peak memory are ignored.')
+    args = parser.parse_args()
+    if args.command == 'run' and args.num_repeats < 2:
+        parser.error('--num-repeats must be at least 2.')
+    return args
+
+
+def _generate_emission(params, generator):
+    """Synthesize the log posteriors of a CTC model
+
+    Each frame is blank with probability ``blank_ratio``, otherwise the frame
+    emits a label, which is held for up to 3 frames. The logit of the emitted
+    label exceeds Gaussian noise by ``peakiness``.
+    """
+    batch_size, num_frames, vocab_size = (
+        params['batch_size'], params['num_frames'], params['vocab_size'])
+    targets = torch.randint(1, vocab_size, (batch_size, num_frames), generator=generator)
+    targets = targets.repeat_interleave(3, dim=1)[:, :num_frames]
+    blank = torch.rand(batch_size, num_frames, generator=generator) < params['blank_ratio']
+    targets[blank] = 0
+    logits = torch.randn(batch_size, num_frames, vocab_size, generator=generator)
+    logits.scatter_add_(
+        2, targets.unsqueeze(-1), torch.full((batch_size, num_frames, 1), params['peakiness']))
+    return logits.log_softmax(dim=-1)
+
+
+def _load_emission(params):
+    emission = torch.load(_SAMPLE).detach().log_softmax(dim=-1)
+    return emission.expand(params['batch_size'], -1, -1).contiguous()
+
+
+def _list_cases(args):
+    cases = []
+    for emission in args.emissions:
+        defaults = dict(_DECODER_DEFAULTS)
+        if emission == 'synthetic':
+            defaults.update(_EMISSION_DEFAULTS)
+        cases.append({'name': f'{emission}/default', 'emission': emission, 'params': defaults})
+        for axis in args.axes:
+            if axis not in defaults:
+                continue
+            for value in _AXES[axis]:
+                if value != defaults[axis]:
+                    cases.append({
+                        'name': f'{emission}/{axis}={value}', 'emission': emission,
+                        'params': dict(defaults, **{axis: value})})
+    return cases
+
+
+def _reset_peak_rss():
+    """Reset the peak RSS of this process to the current one
+
+    Linux only. The setup of a case (the emission, the decoder) can peak
+    higher than the decoding, so the peak of the process is not enough.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as file_:
+            file_.write('5')
+    except OSError:
+        return False
+    return True
+
+
+def _rss_mb(field):
+    # 'VmRSS' (current) or 'VmHWM' (peak), in kilobytes
+    with open('/proc/self/status') as file_:
+        for line in file_:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) / 1024
+    raise RuntimeError(f'{field} is not reported.')
+
+
+def _run_case(case, num_repeats, seed):
+    params = case['params']
+    if case['emission'] == 'synthetic':
+        emission = _generate_emission(params, torch.Generator().manual_seed(seed))
+    else:
+        emission = _load_emission(params)
+    kwargs = {
+        'beam_size': params['beam_size'], 'cutoff_top_n': params['cutoff_top_n'],
+        'cutoff_prob': params['cutoff_prob'], 'num_processes': params['num_processes'],
+        'blank_id': 0, 'is_nll': True,
+    }
+    labels = [str(i) for i in range(emission.size(-1))]
+    decoder = simple_ctc.BeamSearchDecoder(labels, **kwargs)
+
+    rss = _rss_mb('VmRSS') if _reset_peak_rss() else None
+    latencies = []
+    for _ in range(num_repeats):
+        t0 = time.monotonic()
+        decoder(emission)
+        latencies.append(1000 * (time.monotonic() - t0))
+    peak_rss = None if rss is None else _rss_mb('VmHWM') - rss
+
+    # Counted separately, as collecting the statistics adds timing.
+    counter = simple_ctc.BeamSearchDecoder(labels, collect_stats=True, **kwargs)
+    counter(emission)
+    stats = counter.get_stats()
+
+    quantiles = statistics.quantiles(latencies, n=100, method='inclusive')
+    num_frames = emission.size(0) * emission.size(1)
+    return dict(case, **{
+        'latency_ms': {
+            'mean': statistics.mean(latencies), 'min': min(latencies),
+            'p50': quantiles[49], 'p90': quantiles[89], 'p99': quantiles[98],
+        },
+        'frames_per_sec': 1000 * num_frames / statistics.mean(latencies),
+        'peak_rss_mb': peak_rss,
+        'peak_nodes': stats['peak_nodes'],
+    })
+
+
+def _run(args):
+    cases = _list_cases(args)
+    results = []
+    # A new process for each case, so that the peak memory is its own.
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(1, maxtasksperchild=1) as pool:
+        for case in cases:
+            result = pool.apply(_run_case, (case, args.num_repeats, args.seed))
+            latency = result['latency_ms']
+            peak_rss = result['peak_rss_mb']
+            print(f'{case["name"]}: p50 {latency["p50"]:.2f} ms, p90 {latency["p90"]:.2f} ms, '
+                  f'{result["frames_per_sec"]:.0f} frames/sec, '
+                  f'{"n/a" if peak_rss is None else f"{peak_rss:.1f}"} MB', file=sys.stderr)
+            results.append(result)
+    output = {
+        'environment': {
+            'python': platform.python_version(),
+            'torch': torch.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        },
+        'num_repeats': args.num_repeats,
+        'seed': args.seed,
+        'results': results,
+    }
+    with open(args.output, 'w') as file_:
+        json.dump(output, file_, indent=2)
+
+
+def _get_metric(result, metric):
+    for key in metric.split('.'):
+        result = result[key]
+    return result
+
+
+def _compare(args):
+    with open(args.baseline) as file_:
+        baseline = {r['name']: r for r in json.load(file_)['results']}
+    with open(args.current) as file_:
+        current = {r['name']: r for r in json.load(file_)['results']}
+
+    print('case,metric,baseline,current,change,regression')
+    num_regressions = 0
+    for name in [n for n in baseline if n in current]:
+        for metric, larger_is_better in _METRICS:
+            base, value = _get_metric(baseline[name], metric), _get_metric(current[name], metric)
+            if base is None or value is None:
+                continue
+            # from zero, any increase is infinitely large, so it is only
+            # limited by `--min-memory-mb`
+            change = (value - base) / base if base else (math.inf if value > base else 0.0)
+            worse = -change if larger_is_better else change
+            regression = worse > args.threshold
+            if metric == 'peak_rss_mb':
+                regression = regression and value - base > args.min_memory_mb
+            num_regressions += regression
+            print(f'{name},{metric},{base:.2f},{value:.2f},{100 * change:+.1f}%,'
+                  f'{"yes" if regression else ""}')
+    for name in sorted(set(baseline) ^ set(current)):
+        print(f'# {name} is only in one of the runs', file=sys.stderr)
+    print(f'# {num_regressions} regressions', file=sys.stderr)
+    return 1 if num_regressions else 0
+
+
+def _main():
+    args = _parse_args()
+    if args.command == 'run':
+        _run(args)
+    else:
+        sys.exit(_compare(args))
+
+
+if __name__ == '__main__':
+    _main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""Measure the decoding time over vocabulary sizes
+
+Decodes synthetic emissions with a large ``cutoff_top_n``, which is where
+the cost of finding the children of a prefix in the trie grows with the
+vocabulary size.
+"""
+import time
+import argparse
+
+import torch
+import simple_ctc
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--vocab-sizes', type=int, nargs='+', default=[32, 1000, 10000],
+        help='Vocabulary sizes to benchmark.')
+    parser.add_argument('--num-frames', type=int, default=500)
+    parser.add_argument('--beam-size', type=int, default=100)
+    parser.add_argument('--cutoff-top-n', type=int, default=100)
+    parser.add_argument('--num-repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+
+def _generate_emission(num_frames, vocab_size, seed):
+    generator = torch.Generator().manual_seed(seed)
+    logits = 3 * torch.randn(1, num_frames, vocab_size, generator=generator)
+    return logits.log_softmax(dim=-1)
+
+
+def _main():
+    args = _parse_args()
+    print('vocab_size,num_frames,beam_size,cutoff_top_n,time [sec]')
+    for vocab_size in args.vocab_sizes:
+        emission = _generate_emission(args.num_frames, vocab_size, args.seed)
+        decoder = simple_ctc.BeamSearchDecoder(
+            [str(i) for i in range(vocab_size)],
+            beam_size=args.beam_size,
+            cutoff_top_n=args.cutoff_top_n,
+            blank_id=0,
+            is_nll=True,
+            num_processes=1,
+        )
+        elapsed = []
+        for _ in range(args.num_repeats):
+            t0 = time.monotonic()
+            decoder(emission)
+            elapsed.append(time.monotonic() - t0)
+        print(f'{vocab_size},{args.num_frames},{args.beam_size},'
+              f'{args.cutoff_top_n},{min(elapsed):.4f}')
+
+
+if __name__ == '__main__':
+    _main()
@@ -3,6 +3,11 @@
 
 Given a Librispeech directory, parse transcript files,
 transcribe the corresponding audio, and generate hypothesis files.
+
+The utterances are sorted by length and grouped into padded batches. The
+audio is loaded by background workers, and each batch is decoded on the
+decoder threads while the next one is encoded. The time spent in each stage
+is reported at the end.
 """
 import os
 import time
@@ -18,6 +23,8 @@ import simple_ctc
 
 _LG = logging.getLogger(__name__)
 
+_SAMPLE_RATE = 16000
+
 
 def _parse_args():
     def _path(path):
@@ -54,7 +61,37 @@ def _parse_args():
         '--num-threads',
         type=int,
         default=4,
-        help='Maximum number of threads .'
+        help='Maximum number of threads for encoding.'
+    )
+    parser.add_argument(
+        '--num-decoder-threads',
+        type=int,
+        default=4,
+        help='The number of threads for decoding.'
+    )
+    parser.add_argument(
+        '--num-loaders',
+        type=int,
+        default=2,
+        help='The number of background processes loading audio.'
+    )
+    parser.add_argument(
+        '--max-batch-seconds',
+        type=float,
+        default=240,
+        help='The maximum duration of a batch, including the padding.'
+    )
+    parser.add_argument(
+        '--max-batch-size',
+        type=int,
+        default=16,
+        help='The maximum number of utterances in a batch. '
+             '(With `1`, utterances are processed one by one without padding.)'
+    )
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='Skip the utterances already in the hypothesis files of the output directory.'
     )
 
     args = parser.parse_args()
@@ -90,6 +127,80 @@ def _parse_transcriptions(root_dir, output_dir):
     return audios
 
 
+def _load_hypotheses(output_dir):
+    """Keep the hypotheses written completely to both files, and drop the rest
+
+    A run interrupted while writing can leave a partial line, or an
+    utterance written to only one of the files.
+    """
+    trn, trans = output_dir / 'hyp.trn', output_dir / 'hyp.trans.txt'
+    if not trn.exists() or not trans.exists():
+        return set()
+    with open(trn) as trn_fileobj, open(trans) as txt_fileobj:
+        trn_lines = {
+            line[line.rindex('(') + 1:-2]: line
+            for line in trn_fileobj if line.endswith(')\n')}
+        txt_lines = {
+            line.split(' ', maxsplit=1)[0]: line
+            for line in txt_fileobj if line.endswith('\n')}
+    done = set(trn_lines) & set(txt_lines)
+    # written to temporary files and renamed, so they are never truncated
+    for path, lines in [(trn, trn_lines), (trans, txt_lines)]:
+        tmp = path.with_suffix('.tmp')
+        with open(tmp, 'w') as fileobj:
+            fileobj.writelines(line for id, line in lines.items() if id in done)
+        os.replace(tmp, path)
+    return done
+
+
+def _make_batches(audios, max_batch_seconds, max_batch_size):
+    """Group the utterances of similar lengths, so that batches have little padding"""
+    _LG.info('Reading the lengths of %d utterances', len(audios))
+    lengths = [torchaudio.info(str(path)).num_frames for _, path in audios]
+    order = sorted(range(len(audios)), key=lambda i: lengths[i])
+    max_samples = max_batch_seconds * _SAMPLE_RATE
+    batches, batch = [], []
+    for i in order:
+        # the longest of the batch is the last one
+        if batch and (len(batch) == max_batch_size or (len(batch) + 1) * lengths[i] > max_samples):
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    padding = sum(len(b) * lengths[b[-1]] - sum(lengths[i] for i in b) for b in batches)
+    _LG.info('%d batches, %.1f%% padding',
+             len(batches), 100 * padding / max(sum(lengths) + padding, 1))
+    # the longest first, so that running out of memory happens early
+    return batches[::-1]
+
+
+class _Dataset(torch.utils.data.Dataset):
+    def __init__(self, audios):
+        self.audios = audios
+
+    def __len__(self):
+        return len(self.audios)
+
+    def __getitem__(self, i):
+        t0 = time.monotonic()
+        id, path = self.audios[i]
+        waveform, sample_rate = torchaudio.load(path)
+        if sample_rate != _SAMPLE_RATE:
+            raise RuntimeError(f'The sample rate of {path} is {sample_rate}, not {_SAMPLE_RATE}.')
+        return id, waveform[0], time.monotonic() - t0
+
+
+def _collate(items):
+    ids = [id for id, _, _ in items]
+    lengths = torch.tensor([waveform.numel() for _, waveform, _ in items])
+    waveforms = torch.zeros(len(items), int(lengths.max()))
+    for i, (_, waveform, _) in enumerate(items):
+        waveforms[i, :waveform.numel()] = waveform
+    padding_mask = torch.arange(waveforms.size(1)) >= lengths.unsqueeze(1)
+    return ids, waveforms, padding_mask, sum(t for _, _, t in items)
+
+
 def _load_vocab(dict_file):
     tokens = ["<s>", "<pad>", "</s>", "<unk>"]
     with open(dict_file, mode='r', encoding='utf-8') as fileobj:
@@ -102,7 +213,7 @@ def _count_params(model):
     return sum(p.numel() for p in model.parameters())
 
 
-def _load_model(model_file, dict_file):
+def _load_model(model_file, dict_file, num_decoder_threads):
     _LG.info('Loading the model')
     labels = _load_vocab(dict_file)
 
@@ -120,41 +231,93 @@ def _load_model(model_file, dict_file):
         cutoff_top_n=40,
         cutoff_prob=0.8,
         beam_size=100,
-        num_processes=1,
+        num_processes=num_decoder_threads,
         blank_id=0,
         is_nll=True,
+        nbest=1,
+        max_in_flight=2,
     )
     _LG.info('#parameters: %s', _count_params(encoder))
     return encoder, decoder
 
 
-def _decode(audios, encoder, decoder, output_dir):
+def _encode(encoder, waveforms, padding_mask):
+    out = encoder(waveforms, padding_mask)
+    emission = out['encoder_out'].transpose(1, 0)
+    # The key depends on the version of fairseq.
+    output_padding = out.get('padding_mask', out.get('encoder_padding_mask'))
+    if output_padding is None:
+        seq_lens = torch.full((emission.size(0),), emission.size(1), dtype=torch.int32)
+    else:
+        seq_lens = (~output_padding).sum(dim=1).to(torch.int32)
+    return emission.contiguous(), seq_lens
+
+
+def _decode(audios, batches, encoder, decoder, output_dir, num_loaders, resume):
     trn = output_dir / 'hyp.trn'
     trans = output_dir / 'hyp.trans.txt'
-    t_enc, t_dec, num_frames = 0.0, 0.0, 0
-    with open(trn, 'w') as trn_fileobj, open(trans, 'w') as txt_fileobj:
-        for i, (id, path) in enumerate(audios):
-            waveform, _ = torchaudio.load(path)
-            mask = torch.zeros_like(waveform)
-
-            t0 = time.monotonic()
-            ir = encoder(waveform, mask)['encoder_out'].transpose(1, 0)
+    loader = torch.utils.data.DataLoader(
+        _Dataset(audios), batch_sampler=batches, collate_fn=_collate,
+        num_workers=num_loaders, prefetch_factor=2 if num_loaders > 0 else None)
+    t_load, t_wait_load, t_enc, t_dec, t_wait_dec = 0.0, 0.0, 0.0, 0.0, 0.0
+    num_samples, num_frames, num_done = 0, 0, 0
+    mode = 'a' if resume else 'w'
+    t_start = time.monotonic()
+    with open(trn, mode) as trn_fileobj, open(trans, mode) as txt_fileobj:
+        def _write(ids, future):
+            nonlocal num_done
+            beams, lengths, _, _ = future.wait()
+            for i, id in enumerate(ids):
+                trn = ''.join(decoder.labels[k] for k in beams[i, 0, :lengths[i, 0]]).replace('|', ' ')
+                trn_fileobj.write(f'{trn} ({id})\n')
+                txt_fileobj.write(f'{id} {trn}\n')
+                _LG.debug('%s: %s', id, trn)
+            # whole batches, so that a resumed run finds complete lines
+            trn_fileobj.flush()
+            txt_fileobj.flush()
+            num_done += len(ids)
+            _LG.info('%d/%d utterances', num_done, len(audios))
+
+        # The batch is decoded on the decoder threads while the next one is
+        # encoded, and the audio is loaded in the background all along.
+        pending = None
+        t0 = time.monotonic()
+        with torch.inference_mode():
+            for ids, waveforms, padding_mask, t_batch_load in loader:
+                t1 = time.monotonic()
+                emission, seq_lens = _encode(encoder, waveforms, padding_mask)
+                t2 = time.monotonic()
+                future = decoder.forward_async(emission, seq_lens)
+                t3 = time.monotonic()
+                if pending is not None:
+                    _write(*pending)
+                pending = (ids, future)
+                t4 = time.monotonic()
+
+                num_samples += int((~padding_mask).sum())
+                num_frames += int(seq_lens.sum())
+                t_load += t_batch_load
+                t_wait_load += t1 - t0
+                t_enc += t2 - t1
+                t_dec += t3 - t2
+                t_wait_dec += t4 - t3
+                t0 = time.monotonic()
+        if pending is not None:
             t1 = time.monotonic()
-            result = decoder.decode(ir)
-            t2 = time.monotonic()
-            trn = ''.join(result.label_sequences[0][0]).replace('|', ' ')
-            trn_fileobj.write(f'{trn} ({id})\n')
-            txt_fileobj.write(f'{id} {trn}\n')
-            _LG.info('%d/%d: %s: %s', i, len(audios), id, trn)
-
-            num_frames += waveform.size(1)
-            t_enc += t1 - t0
-            t_dec += t2 - t1
-    t_audio = num_frames / 16000
-    _LG.info('Audio duration:       %s [sec]', t_audio)
-    _LG.info('Encoding Time:        %s [sec]', t_enc)
-    _LG.info('Decoding Time:        %s [sec]', t_dec)
-    _LG.info('Total Inference Time: %s [sec]', t_enc + t_dec)
+            _write(*pending)
+            t_wait_dec += time.monotonic() - t1
+    t_total = time.monotonic() - t_start
+    t_audio = num_samples / _SAMPLE_RATE
+    _LG.info('Audio duration:           %s [sec]', t_audio)
+    _LG.info('Loading Time (workers):   %s [sec]', t_load)
+    _LG.info('Loading Wait Time:        %s [sec]', t_wait_load)
+    _LG.info('Encoding Time:            %s [sec]', t_enc)
+    _LG.info('Decoding Submit Time:     %s [sec]', t_dec)
+    _LG.info('Decoding Wait Time:       %s [sec]', t_wait_dec)
+    _LG.info('Total Inference Time:     %s [sec]', t_total)
+    if t_audio > 0:
+        _LG.info('RTF:                      %s', t_total / t_audio)
+        _LG.info('Emission frames / sec:    %s', num_frames / t_total)
 
 
 def _main():
@@ -164,8 +327,14 @@ def _main():
         format='%(asctime)s %(levelname)s: %(message)s',
         level=logging.INFO)
     audios = _parse_transcriptions(args.root_dir, args.output_dir)
-    encoder, decoder = _load_model(args.model_file, args.dict_file)
-    _decode(audios, encoder, decoder, args.output_dir)
+    if args.resume:
+        done = _load_hypotheses(args.output_dir)
+        _LG.info('Resuming: %d utterances already transcribed', len(done))
+        audios = [(id, path) for id, path in audios if id not in done]
+    batches = _make_batches(audios, args.max_batch_seconds, args.max_batch_size)
+    encoder, decoder = _load_model(args.model_file, args.dict_file, args.num_decoder_threads)
+    _decode(
+        audios, batches, encoder, decoder, args.output_dir, args.num_loaders, args.resume)
 
 
 if __name__ == '__main__':
@@ -26,3 +26,6 @@ del _init_extension
 
 
 from .decoder import BeamSearchDecoder
+from .language_model import compile_language_model
+from .lexicon import compile_lexicon
+from .service import DecodeClient, DecodeServer
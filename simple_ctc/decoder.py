@@ -1,4 +1,6 @@
-from typing import List, Tuple, Optional, NamedTuple
+import math
+import asyncio
+from typing import Any, Dict, List, Tuple, Optional, NamedTuple
 
 import torch
 from torch import Tensor
@@ -10,6 +12,16 @@ class _DecodeResult(NamedTuple):
     timesteps: List[List[List[int]]]
 
 
+class _TranscribeResult(NamedTuple):
+    transcripts: List[List[str]]
+    scores: List[List[float]]
+
+
+# the options which `BeamSearchDecoder.sweep` can vary
+_SWEEP_OPTIONS = {
+    'beam_size', 'cutoff_top_n', 'cutoff_prob', 'nbest', 'beam_threshold', 'alpha', 'beta'}
+
+
 class BeamSearchDecoder(torch.nn.Module):
     """Beam search decoder
 
@@ -23,9 +35,13 @@ class BeamSearchDecoder(torch.nn.Module):
             The tokens/vocabulary used in model training. It must be ordered
             in the same way as the model's output.
         beam_size (int):
-            The number of beams to retain / returned. Providing higher values
+            The number of beams to retain. Providing higher values
             could return beams with better scores, but it will make the search
-            exponentially slower.
+            exponentially slower. With ``1``, the best path (the label of the
+            highest probability in each time step, with repeats collapsed and
+            blanks removed) is computed directly, without the search, unless
+            an option of the search is set (see :py:attr:`greedy`). It is
+            checked on every call, so assigning ``beam_size`` later applies.
         cutoff_top_n (int):
             Cutoff number in pruning. Only the top ``cutoff_top_n`` labels
             with the highest probabilities will be used in the search.
@@ -40,8 +56,108 @@ class BeamSearchDecoder(torch.nn.Module):
             Indicates whether the probabilities will be given in the form of
             negative log likelihood.
         num_processes (int):
-            The number of processes to parallelize the batch.
+            The number of threads decoding the items of a batch. The threads
+            are kept between calls, and are separate from PyTorch's intra-op
+            threads. The items are handed out longest first to the threads as
+            they become free, so batches of mixed lengths are balanced.
+            There is one pool of threads per value, shared by all the
+            decoders of the process, and kept until it exits, so the
+            decoders of a process should use the same value, otherwise the
+            threads of all the values are kept idle.
+        model_path (str, optional):
+            Path to a word-level n-gram language model, either in ARPA format
+            or in the binary format created with
+            :py:func:`simple_ctc.compile_language_model`. Binary files are
+            memory-mapped, so loading is nearly instant and the memory is
+            shared between processes.
+        alpha (float):
+            The weight of the language model score.
+        beta (float):
+            The bonus added to the score for each word.
+        word_delimiter (str):
+            The label which separates words. The language model scores
+            a word when the label is emitted after it, and at the end of
+            the sequence.
+        lm_cache_size (int):
+            The maximum number of language model scores to cache. The cache
+            is kept by the decoder and shared by all the calls, batch items
+            and streaming sessions, as the same words are scored in the same
+            contexts over and over. ``0`` disables the cache.
+        lexicon_path (str, optional):
+            Path to a lexicon created with :py:func:`simple_ctc.compile_lexicon`.
+            When provided, the search only considers the label sequences
+            spelling the words of the lexicon, separated by ``word_delimiter``.
+            The file is memory-mapped.
+        blank_skip_threshold (float, optional):
+            When provided, the time steps where the probability of blank is
+            at least this value only update the blank probabilities of the
+            beams, without extending them with the other labels. Encoders
+            such as wav2vec2 emit blank in most of the time steps, so this
+            saves most of the search at a negligible accuracy loss, with a
+            threshold close to 1 (e.g. ``0.999``). Timesteps are reported in
+            the original frame indices.
+        nbest (int, optional):
+            The number of the best beams to return. Only these are sorted and
+            assembled, so the cost of the output scales with it, not with
+            ``beam_size``. Defaults to ``beam_size`` (the current one, if it
+            is assigned later).
+        beam_threshold (float, optional):
+            When provided, the beams scoring lower than the best one by more
+            than this (in natural log) are discarded in each time step, and
+            the extensions which would fall below it are not evaluated.
+            So the beam narrows down where the best beam is confident, and
+            only widens up to ``beam_size`` where it is not. ``10`` to ``20``
+            are typical values. By default, only ``beam_size`` applies.
+        fast_math (bool, optional):
+            When ``True``, the probabilities are converted to log scale in
+            single precision, and added with a table-based approximation
+            (absolute error below ``1e-5``) instead of ``exp`` and ``log``.
+            The scores differ slightly, so the order of nearly tied beams
+            may change. (Default: ``False``)
+        long_form (bool, optional):
+            When ``True``, the labels shared by all the beams are committed
+            after each time step, and their trie nodes are released. So the
+            memory of the search is bounded by the span not resolved yet,
+            instead of growing with the length of the input, for inputs of
+            hours. The results are the same. (Default: ``False``)
+        segment_min_blank_frames (int, optional):
+            When provided, each sequence is split in the middle of the runs
+            of at least this many frames where the probability of blank is
+            at least ``segment_blank_threshold``, and the segments are
+            searched independently, on ``num_processes`` threads. So a single
+            long sequence is decoded in parallel. The best ``nbest``
+            combinations of the hypotheses of the segments are returned,
+            with timesteps in the frames of the sequence. The labels are the
+            same as without splitting unless a beam of the whole sequence
+            would have been pruned in favor of one differing in another
+            segment, or a language model scores the first word of a segment
+            without its preceding words. The timestep of the last label
+            before a split may be earlier, as the frames after the split do
+            not update it. By default, sequences are not split.
+        segment_blank_threshold (float, optional):
+            The probability of blank which the frames of the runs to split
+            at have to reach. (Default: ``0.999``)
+        max_in_flight (int, optional):
+            The maximum number of asynchronous decodes (see
+            :py:meth:`forward_async`) in flight. When reached, a new call
+            waits until one of them completes. By default, there is no limit.
+        collect_stats (bool, optional):
+            When ``True``, the decoding functions add up the search counters
+            (frames, candidates, prefixes expanded, trie nodes) and the time
+            spent in pruning, expansion, selection and extraction in
+            ``stats``. See :py:meth:`get_stats`. Nothing is measured
+            otherwise. (Default: ``False``)
+
+    Attributes:
+        context (torch.classes.simple_ctc.DecoderContext):
+            The labels, the ids of blank and of ``word_delimiter``, the
+            language model and the lexicon, validated and prepared once on
+            construction, so that they are not converted on every call. It is
+            immutable, so it can be shared between decoders and threads, and
+            passed to the ``torch.ops.simple_ctc`` functions directly.
     """
+    _nbest: Optional[int]
+
     def __init__(
             self,
             labels: List[str],
@@ -51,15 +167,170 @@ class BeamSearchDecoder(torch.nn.Module):
             blank_id: int = 0,
             is_nll: bool = False,
             num_processes: int = 4,
+            model_path: Optional[str] = None,
+            alpha: float = 0.5,
+            beta: float = 1.0,
+            word_delimiter: str = " ",
+            lm_cache_size: int = 65536,
+            lexicon_path: Optional[str] = None,
+            blank_skip_threshold: Optional[float] = None,
+            nbest: Optional[int] = None,
+            beam_threshold: Optional[float] = None,
+            fast_math: bool = False,
+            long_form: bool = False,
+            segment_min_blank_frames: Optional[int] = None,
+            segment_blank_threshold: float = 0.999,
+            max_in_flight: Optional[int] = None,
+            collect_stats: bool = False,
     ):
         super().__init__()
-        self.labels = labels
         self.beam_size = beam_size
         self.cutoff_top_n = cutoff_top_n
         self.cutoff_prob = cutoff_prob
-        self.blank_id = blank_id
         self.is_nll = is_nll
         self.num_processes = num_processes
+        language_model = (
+            None if model_path is None
+            else torch.classes.simple_ctc.LanguageModel(model_path))
+        lm_cache = (
+            None if language_model is None or lm_cache_size == 0
+            else torch.classes.simple_ctc.ScoreCache(lm_cache_size))
+        lexicon = (
+            None if lexicon_path is None
+            else torch.classes.simple_ctc.Lexicon(lexicon_path))
+        # The vocabulary, the language model and the lexicon are resolved once
+        # here, and the decoding functions only take this handle. They are
+        # only kept in it, so that they are serialized once, and so that
+        # `labels`, `blank_id`, `word_delimiter`, `alpha` and `beta` cannot
+        # differ from the ones the decoding functions use.
+        self.context = torch.classes.simple_ctc.DecoderContext(
+            labels, blank_id, word_delimiter, language_model,
+            alpha, beta, lm_cache, lexicon)
+        self.blank_skip_threshold = blank_skip_threshold
+        self._nbest = nbest
+        self.beam_threshold = beam_threshold
+        self.fast_math = fast_math
+        self.long_form = long_form
+        self.segment_min_blank_frames = segment_min_blank_frames
+        self.segment_blank_threshold = segment_blank_threshold
+        self.in_flight: Optional[torch.classes.simple_ctc.Semaphore] = (
+            None if max_in_flight is None
+            else torch.classes.simple_ctc.Semaphore(max_in_flight))
+        self.stats: Optional[torch.classes.simple_ctc.DecodeStats] = (
+            torch.classes.simple_ctc.DecodeStats() if collect_stats else None)
+
+    @property
+    def nbest(self) -> int:
+        """The number of the best beams to return"""
+        nbest = self._nbest
+        return self.beam_size if nbest is None else nbest
+
+    @nbest.setter
+    def nbest(self, nbest: int) -> None:
+        self._nbest = nbest
+
+    @property
+    def greedy(self) -> bool:
+        """Whether the best path is computed instead of searching
+
+        Only with ``beam_size=1``, and none of a language model, a lexicon,
+        ``blank_skip_threshold``, ``long_form``, ``segment_min_blank_frames``
+        and ``collect_stats``, which only apply to the search.
+        """
+        return self._is_greedy(self.beam_size)
+
+    def _is_greedy(self, beam_size: int) -> bool:
+        return (
+            beam_size == 1
+            and self.context.language_model() is None
+            and self.context.lexicon() is None
+            and self.blank_skip_threshold is None
+            and not self.long_form
+            and self.segment_min_blank_frames is None
+            and self.stats is None
+        )
+
+    @property
+    def labels(self) -> List[str]:
+        """The labels (same as ``context.labels()``)"""
+        return self.context.labels()
+
+    @labels.setter
+    def labels(self, labels: List[str]) -> None:
+        self._replace_context(labels=labels)
+
+    @property
+    def blank_id(self) -> int:
+        """The index of blank (same as ``context.blank_id()``)"""
+        return self.context.blank_id()
+
+    @blank_id.setter
+    def blank_id(self, blank_id: int) -> None:
+        self._replace_context(blank_id=blank_id)
+
+    @property
+    def word_delimiter(self) -> str:
+        """The label separating words (same as ``context.word_delimiter()``)"""
+        return self.context.word_delimiter()
+
+    @word_delimiter.setter
+    def word_delimiter(self, word_delimiter: str) -> None:
+        self._replace_context(word_delimiter=word_delimiter)
+
+    @property
+    def alpha(self) -> float:
+        """The weight of the language model score (same as ``context.alpha()``)"""
+        return self.context.alpha()
+
+    @alpha.setter
+    def alpha(self, alpha: float) -> None:
+        self._replace_context(alpha=alpha)
+
+    @property
+    def beta(self) -> float:
+        """The bonus added for each word (same as ``context.beta()``)"""
+        return self.context.beta()
+
+    @beta.setter
+    def beta(self, beta: float) -> None:
+        self._replace_context(beta=beta)
+
+    def _replace_context(
+            self,
+            labels: Optional[List[str]] = None,
+            blank_id: Optional[int] = None,
+            word_delimiter: Optional[str] = None,
+            alpha: Optional[float] = None,
+            beta: Optional[float] = None,
+    ) -> None:
+        # The context is immutable, so a new one is made, with the same
+        # language model, cache and lexicon. The scores are cached without
+        # the weights, so the cache stays valid.
+        context = self.context
+        self.context = torch.classes.simple_ctc.DecoderContext(
+            context.labels() if labels is None else labels,
+            context.blank_id() if blank_id is None else blank_id,
+            context.word_delimiter() if word_delimiter is None else word_delimiter,
+            context.language_model(),
+            context.alpha() if alpha is None else alpha,
+            context.beta() if beta is None else beta,
+            context.lm_cache(), context.lexicon())
+
+    @property
+    def language_model(self) -> Optional[torch.classes.simple_ctc.LanguageModel]:
+        """The language model, if any (same as ``context.language_model()``)"""
+        return self.context.language_model()
+
+    @property
+    def lm_cache(self) -> Optional[torch.classes.simple_ctc.ScoreCache]:
+        """The cache of the language model scores, if any
+        (same as ``context.lm_cache()``)"""
+        return self.context.lm_cache()
+
+    @property
+    def lexicon(self) -> Optional[torch.classes.simple_ctc.Lexicon]:
+        """The lexicon, if any (same as ``context.lexicon()``)"""
+        return self.context.lexicon()
 
     def forward(
             self,
@@ -73,6 +344,9 @@ class BeamSearchDecoder(torch.nn.Module):
                 Sequences of probabilities (or negative log likelihood when
                 ``log_probs`` is True.) over labels. The output from encoder.
                 Shape: ``[batch, num_timesteps, num_labels]``.
+                Floating point Tensor of any precision (``float32``,
+                ``float64``, ``float16`` or ``bfloat16``). It does not need to
+                be contiguous; the values are read in place without a copy.
             seq_lens (torch.Tensor, optional):
                 The valid length of sequences in the batch.
                 Shape: ``[batch]``.
@@ -81,24 +355,275 @@ class BeamSearchDecoder(torch.nn.Module):
         Returns:
             Tuple of four torch.Tensors: Tuple of ``beams``, ``length``, ``scores`` and ``timesteps``
             beams:
-                Integer Tensor representing the top ``n`` beams.
-                Shape: ``[batch, num_beams, num_timesteps]``.
+                Integer Tensor representing the top ``nbest`` beams.
+                Shape: ``[batch, nbest, num_timesteps]``.
             beam_lengths:
                 Integer Tensor representing the length of each beam.
-                Shape: ``[batch, num_beams]``.
+                Shape: ``[batch, nbest]``.
             scores:
                 Float Tensor representing the likelihood of each beam.
-                Shape: ``[batch, num_beams]``.
+                When a language model is given, its weighted score is included.
+                When a sequence has less than ``nbest`` beams, the lengths of
+                the missing ones are ``0`` and their scores are ``inf``.
+                Shape: ``[batch, nbest]``.
             timesteps:
                 Integer Tensor representing the timesteps at which
                 the corresponding output character has peak probability.
-                Shape: ``[batch, num_beams, num_timesteps]``.
+                Shape: ``[batch, nbest, num_timesteps]``.
         """
+        if self.greedy:
+            return torch.ops.simple_ctc.greedy_search_decode(
+                probs, seq_lens, self.context, self.is_nll)
         return torch.ops.simple_ctc.beam_search_decode(
-            probs, seq_lens, self.labels, self.beam_size,
-            self.cutoff_top_n, self.cutoff_prob,
-            self.blank_id, self.is_nll,
-            self.num_processes,
+            probs, seq_lens, self.context, self.beam_size,
+            self.cutoff_top_n, self.cutoff_prob, self.is_nll,
+            self.num_processes, self.blank_skip_threshold, self.nbest,
+            self.beam_threshold, self.fast_math, self.long_form,
+            self.segment_min_blank_frames, self.segment_blank_threshold, self.stats,
+        )
+
+    @torch.jit.export
+    def forward_ragged(
+            self,
+            probs: torch.Tensor,
+            seq_lens: Optional[torch.Tensor] = None,
+    ) -> Tuple[Tensor, Tensor, Tensor, Tensor]:
+        """Same as :py:meth:`forward`, but the beams are packed back to back
+
+        The size of the output is proportional to the total length of the
+        beams, instead of ``batch * nbest * num_timesteps``.
+
+        Args:
+            probs (torch.Tensor): Same as :py:meth:`forward`.
+            seq_lens (torch.Tensor, optional): Same as :py:meth:`forward`.
+
+        Returns:
+            Tuple of four torch.Tensors: Tuple of ``tokens``, ``offsets``, ``scores`` and ``timesteps``
+            tokens:
+                Integer Tensor of the labels of all the beams, concatenated.
+                Shape: ``[num_tokens]``.
+            offsets:
+                Int64 Tensor. The ``j``-th beam of the ``i``-th sequence is
+                ``tokens[offsets[i * nbest + j]:offsets[i * nbest + j + 1]]``.
+                Shape: ``[batch * nbest + 1]``.
+            scores:
+                Same as :py:meth:`forward`. When a sequence has less than
+                ``nbest`` beams, the missing ones are empty and their scores
+                are ``inf``.
+                Shape: ``[batch, nbest]``.
+            timesteps:
+                Integer Tensor of the timesteps of ``tokens``.
+                Shape: ``[num_tokens]``.
+        """
+        if self.greedy:
+            return torch.ops.simple_ctc.greedy_search_decode_ragged(
+                probs, seq_lens, self.context, self.is_nll)
+        return torch.ops.simple_ctc.beam_search_decode_ragged(
+            probs, seq_lens, self.context, self.beam_size,
+            self.cutoff_top_n, self.cutoff_prob, self.is_nll,
+            self.num_processes, self.blank_skip_threshold, self.nbest,
+            self.beam_threshold, self.fast_math, self.long_form,
+            self.segment_min_blank_frames, self.segment_blank_threshold, self.stats,
+        )
+
+    @torch.jit.export
+    def transcribe(
+            self,
+            probs: torch.Tensor,
+            seq_lens: Optional[torch.Tensor] = None,
+            word_separator: str = " ",
+    ) -> _TranscribeResult:
+        """Performs beam search and returns the beams as strings
+
+        The labels are joined in C++, and ``word_delimiter`` is replaced with
+        ``word_separator``. The delimiters at both ends are dropped.
+
+        Args:
+            probs (torch.Tensor): Same as :py:meth:`forward`.
+            seq_lens (torch.Tensor, optional): Same as :py:meth:`forward`.
+            word_separator (str): The string to put between words.
+
+        Returns:
+            Tuple of ``transcripts`` and ``scores``, the strings of the top
+            ``nbest`` beams of each sequence and their scores.
+        """
+        if self.greedy:
+            transcripts, scores = torch.ops.simple_ctc.greedy_search_decode_text(
+                probs, seq_lens, self.context, self.is_nll, word_separator)
+            return _TranscribeResult(transcripts, scores)
+        transcripts, scores = torch.ops.simple_ctc.beam_search_decode_text(
+            probs, seq_lens, self.context, self.beam_size,
+            self.cutoff_top_n, self.cutoff_prob, self.is_nll,
+            self.num_processes, self.blank_skip_threshold, self.nbest,
+            self.beam_threshold, self.fast_math, self.long_form,
+            self.segment_min_blank_frames, self.segment_blank_threshold, self.stats,
+            word_separator,
+        )
+        return _TranscribeResult(transcripts, scores)
+
+    @torch.jit.export
+    def forward_async(
+            self,
+            probs: torch.Tensor,
+            seq_lens: Optional[torch.Tensor] = None,
+    ) -> torch.jit.Future[Tuple[Tensor, Tensor, Tensor, Tensor]]:
+        """Performs beam search on the decoder threads without waiting for it
+
+        The input is validated and pruned in the calling thread, then the
+        search runs on the decoder threads, without the GIL. So the encoder
+        can process the next input while the current one is decoded.
+        When ``max_in_flight`` decodes are running, this call waits until one
+        of them completes.
+
+        Args:
+            probs (torch.Tensor): Same as :py:meth:`forward`.
+            seq_lens (torch.Tensor, optional): Same as :py:meth:`forward`.
+
+        Returns:
+            torch.jit.Future:
+                Future of the same Tuple as :py:meth:`forward`.
+        """
+        if self.greedy:
+            return torch.ops.simple_ctc.greedy_search_decode_async(
+                probs, seq_lens, self.context, self.is_nll,
+                self.num_processes, self.in_flight)
+        return torch.ops.simple_ctc.beam_search_decode_async(
+            probs, seq_lens, self.context, self.beam_size,
+            self.cutoff_top_n, self.cutoff_prob, self.is_nll,
+            self.num_processes, self.blank_skip_threshold, self.nbest,
+            self.beam_threshold, self.fast_math, self.long_form,
+            self.segment_min_blank_frames, self.segment_blank_threshold, self.stats, self.in_flight,
+        )
+
+    def sweep(
+            self,
+            probs: torch.Tensor,
+            seq_lens: Optional[torch.Tensor] = None,
+            configs: Optional[List[Dict[str, Any]]] = None,
+    ) -> List[Tuple[Tensor, Tensor, Tensor, Tensor]]:
+        """Decodes the same input with several configurations at once
+
+        Each configuration overrides some of ``beam_size``, ``cutoff_top_n``,
+        ``cutoff_prob``, ``nbest``, ``beam_threshold``, ``alpha`` and
+        ``beta`` of this decoder. The frames are pruned only once, at the
+        loosest cutoffs, and the searches of all the configurations run on
+        the decoder threads together, so tuning these is much cheaper than
+        decoding once per configuration. The language model, its cache and
+        the lexicon are shared. (Not available in TorchScript.)
+
+        The results are the same as :py:meth:`forward_ragged` with each
+        configuration, except that the labels of equal probabilities may be
+        searched in another order, so the order of exactly tied beams may
+        differ. The configurations with ``beam_size=1`` take the best path
+        when :py:attr:`greedy` would. When ``nbest`` was given to this
+        decoder, the configurations with a smaller ``beam_size`` return that
+        many beams instead of failing.
+
+        Args:
+            probs (torch.Tensor): Same as :py:meth:`forward`.
+            seq_lens (torch.Tensor, optional): Same as :py:meth:`forward`.
+            configs (list of dict): The options of each configuration.
+
+        Returns:
+            List of the Tuples of :py:meth:`forward_ragged`, one per
+            configuration, in the same order.
+        """
+        if not configs:
+            raise ValueError("At least one configuration is required.")
+        context = self.context
+        contexts = {(context.alpha(), context.beta()): context}
+        options: Dict[str, List[Any]] = {
+            'context': [], 'beam_size': [], 'cutoff_top_n': [],
+            'cutoff_prob': [], 'nbest': [], 'beam_threshold': []}
+        greedy: Dict[int, Tuple[Tensor, Tensor, Tensor, Tensor]] = {}
+        for i, config in enumerate(configs):
+            unknown = set(config) - _SWEEP_OPTIONS
+            if unknown:
+                raise ValueError(f"Unexpected options: {sorted(unknown)}")
+            weights = (config.get('alpha', context.alpha()), config.get('beta', context.beta()))
+            if weights not in contexts:
+                contexts[weights] = torch.classes.simple_ctc.DecoderContext(
+                    context.labels(), context.blank_id(), context.word_delimiter(),
+                    context.language_model(), *weights, context.lm_cache(), context.lexicon())
+            beam_size = config.get('beam_size', self.beam_size)
+            if self._is_greedy(beam_size):
+                # as `forward_ragged` does, there is nothing to search
+                greedy[i] = torch.ops.simple_ctc.greedy_search_decode_ragged(
+                    probs, seq_lens, contexts[weights], self.is_nll)
+                continue
+            cutoff_prob = config.get('cutoff_prob', self.cutoff_prob)
+            beam_threshold = config.get('beam_threshold', self.beam_threshold)
+            options['context'].append(contexts[weights])
+            options['beam_size'].append(beam_size)
+            options['cutoff_top_n'].append(config.get('cutoff_top_n', self.cutoff_top_n))
+            options['cutoff_prob'].append(1.0 if cutoff_prob is None else cutoff_prob)
+            nbest = beam_size if self._nbest is None else min(self._nbest, beam_size)
+            options['nbest'].append(config.get('nbest', nbest))
+            options['beam_threshold'].append(
+                math.inf if beam_threshold is None else beam_threshold)
+        outputs: List[Tuple[Tensor, Tensor, Tensor, Tensor]] = []
+        if options['context']:
+            outputs = torch.ops.simple_ctc.beam_search_decode_sweep(
+                probs, seq_lens, options['context'], options['beam_size'],
+                options['cutoff_top_n'], options['cutoff_prob'], self.is_nll,
+                self.num_processes, self.blank_skip_threshold, options['nbest'],
+                options['beam_threshold'], self.fast_math, self.long_form,
+                self.segment_min_blank_frames, self.segment_blank_threshold, self.stats,
+            )
+        searched = iter(outputs)
+        return [greedy[i] if i in greedy else next(searched) for i in range(len(configs))]
+
+    @torch.jit.export
+    def get_stats(self, clear: bool = False) -> Dict[str, int]:
+        """Get the statistics added up since creation or the last clear
+
+        Requires ``collect_stats=True``. Times are in nanoseconds. The times of
+        the search phases (``expand_ns``, ``select_ns`` and ``extract_ns``)
+        are summed over the decoder threads, so they can exceed the wall
+        time. ``peak_nodes`` is the maximum over the sequences.
+
+        Args:
+            clear (bool, optional): Reset the statistics after getting them.
+
+        Returns:
+            Dict[str, int]: The counters and the times.
+        """
+        stats = self.stats
+        if stats is None:
+            raise RuntimeError("Statistics are not collected. Use `collect_stats=True`.")
+        ret = stats.get()
+        if clear:
+            stats.clear()
+        return ret
+
+    @torch.jit.export
+    def stream(self) -> torch.classes.simple_ctc.StreamingDecoder:
+        """Create a new streaming decoding session with the same configuration
+
+        The returned object keeps the search state between calls, so that
+        emissions can be fed chunk by chunk with ``next`` method, and the
+        current hypotheses can be retrieved at any point with ``decode``
+        method, without re-decoding the past chunks.
+        Sessions are independent from each other and from this decoder, and
+        share its ``context``.
+
+        Returns:
+            torch.classes.simple_ctc.StreamingDecoder:
+                ``next(probs)`` consumes a chunk of shape
+                ``[num_timesteps, num_labels]``. ``decode()`` returns the same
+                Tuple as :py:meth:`forward` without the batch dimension.
+                ``reset()`` starts a new session and ``num_frames()`` returns
+                the number of time steps processed so far.
+                ``stats()`` reports the trie nodes used and the number of
+                time steps skipped as blank. With ``long_form=True``,
+                ``committed()`` returns the ``tokens`` and ``timesteps``
+                which all the hypotheses start with and which do not change
+                anymore.
+        """
+        return torch.classes.simple_ctc.StreamingDecoder(
+            self.context, self.beam_size, self.cutoff_top_n, self.cutoff_prob,
+            self.is_nll, self.blank_skip_threshold, self.beam_threshold,
+            self.fast_math, self.long_form,
         )
 
     @torch.jit.export
@@ -107,23 +632,63 @@ class BeamSearchDecoder(torch.nn.Module):
             probs: torch.Tensor,
             seq_lens: Optional[torch.Tensor] = None,
     ) -> _DecodeResult:
-        beams, lengths, scores, timesteps = self.forward(probs, seq_lens)
+        tokens, offsets, scores, timesteps = self.forward_ragged(probs, seq_lens)
+        return self._to_result(tokens, offsets, scores, timesteps)
+
+    async def decode_async(
+            self,
+            probs: torch.Tensor,
+            seq_lens: Optional[torch.Tensor] = None,
+    ) -> _DecodeResult:
+        """Same as :py:meth:`decode`, but awaitable from ``asyncio``
 
-        batch_size = beams.size(0)
-        scores: List[List[float]] = scores.tolist()
+        The search runs on the decoder threads, and the event loop keeps
+        running in the meantime. (Not available in TorchScript.
+        Use :py:meth:`forward_async` instead.)
+        """
+        loop = asyncio.get_running_loop()
+        # submitted from a worker thread, as it blocks when ``max_in_flight``
+        # decodes are running
+        future = await loop.run_in_executor(None, self.forward_async, probs, seq_lens)
+        result = loop.create_future()
+
+        def _set_result(future):
+            if result.cancelled():
+                return
+            try:
+                result.set_result(future.value())
+            except Exception as e:
+                result.set_exception(e)
+
+        future.add_done_callback(lambda f: loop.call_soon_threadsafe(_set_result, f))
+        beams, lengths, scores, timesteps = await result
+        # pack the beams back to back, as returned by ``forward_ragged``
+        mask = torch.arange(beams.size(2)) < lengths.unsqueeze(-1)
+        offsets = torch.cat([lengths.new_zeros(1), lengths.flatten().cumsum(0)])
+        return self._to_result(beams[mask], offsets, scores, timesteps[mask])
+
+    def _to_result(
+            self,
+            tokens: Tensor,
+            offsets: Tensor,
+            scores: Tensor,
+            timesteps: Tensor,
+    ) -> _DecodeResult:
+        # converted at once, not element by element
+        tokens_: List[int] = tokens.long().tolist()
+        offsets_: List[int] = offsets.tolist()
+        scores_: List[List[float]] = scores.tolist()
+        batch_size = scores.size(0)
+        labels = self.labels
         # TODO: Add timesteps
         # Timesteps seems to have an issue in C++ side.
-        # timesteps: List[List[List[int]]] = timesteps.tolist()
         batch_texts: List[List[List[str]]] = []
         batch_ts: List[List[List[int]]] = []
         for i in range(batch_size):
             sample_texts: List[List[str]] = []
-            # sample_ts: List[List[int]] = []
-            for j in range(self.beam_size):
-                sample_texts.append([self.labels[k] for k in beams[i, j, :lengths[i, j]]])
-                # ts: List[int] = timesteps[i][j][:lengths[i, j]]
-                # sample_ts.append(ts)
+            for j in range(self.nbest):
+                k = i * self.nbest + j
+                sample_texts.append([labels[t] for t in tokens_[offsets_[k]:offsets_[k + 1]]])
             batch_texts.append(sample_texts)
-            # batch_ts.append(sample_ts)
 
-        return _DecodeResult(batch_texts, scores, batch_ts)
+        return _DecodeResult(batch_texts, scores_, batch_ts)
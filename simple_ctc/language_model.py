@@ -0,0 +1,14 @@
+import torch
+
+
+def compile_language_model(arpa_path: str, output_path: str) -> None:
+    """Convert an ARPA language model to the binary format
+
+    The binary file is memory-mapped when it is loaded, so it loads much faster
+    than the ARPA file, and one copy in memory is shared by all the processes.
+
+    Args:
+        arpa_path (str): Path to the input ARPA file.
+        output_path (str): Path to the output binary file.
+    """
+    torch.classes.simple_ctc.LanguageModel(arpa_path).save(output_path)
@@ -0,0 +1,32 @@
+from typing import List, Union
+
+import torch
+
+
+def compile_lexicon(
+        words: Union[str, List[str]],
+        labels: List[str],
+        output_path: str,
+        word_delimiter: str = " ",
+) -> None:
+    """Build a lexicon for constrained decoding and save it in the binary format
+
+    The binary file is memory-mapped when it is loaded, so it loads instantly
+    regardless of the number of words, and one copy in memory is shared by
+    all the processes.
+
+    Args:
+        words (str or list of str):
+            The words, or path to a text file listing one word per line.
+            (When a line has multiple columns, like a pronunciation
+            dictionary, only the first one is used.)
+            Each word is split into labels by longest match. The words which
+            cannot be spelled with the labels are skipped.
+        labels (list of str): The labels of the decoder.
+        output_path (str): Path to the output binary file.
+        word_delimiter (str): The label which separates words.
+    """
+    if isinstance(words, str):
+        with open(words) as file_:
+            words = [line.split()[0] for line in file_ if line.strip()]
+    torch.ops.simple_ctc.compile_lexicon(words, labels, word_delimiter, output_path)
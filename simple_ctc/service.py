@@ -0,0 +1,479 @@
+"""Decoding service shared by the processes of a host
+
+The server holds one :py:class:`BeamSearchDecoder`, so the language model,
+the lexicon and the score cache are loaded once, and the search runs on one
+pool of ``num_processes`` decoder threads, however many processes submit
+emissions. The clients copy each emission into a block of shared memory
+which the server reads directly, and the requests of all the clients are
+decoded in batches.
+"""
+import os
+import sys
+import time
+import socket
+import queue
+import itertools
+import threading
+import concurrent.futures
+from multiprocessing import AuthenticationError, resource_tracker, shared_memory
+from multiprocessing.connection import Client, Listener
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+import torch
+from torch import Tensor
+
+from .decoder import BeamSearchDecoder
+
+
+_MIN_BLOCK_SIZE = 1 << 20
+
+
+# The blocks are unlinked by the server, when the client releases them or
+# disconnects, so that the ones of a client which crashed do not remain.
+# They are not tracked by `resource_tracker`, which would unlink them when
+# any of the processes which opened them exits.
+def _open_block(name: Optional[str] = None, size: int = 0) -> shared_memory.SharedMemory:
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name, create=name is None, size=size, track=False)
+    block = shared_memory.SharedMemory(name, create=name is None, size=size)
+    resource_tracker.unregister(block._name, 'shared_memory')
+    return block
+
+
+def _unlink_block(block: shared_memory.SharedMemory) -> None:
+    if sys.version_info < (3, 13):
+        # as `unlink` unregisters it
+        resource_tracker.register(block._name, 'shared_memory')
+    try:
+        block.unlink()
+    except FileNotFoundError:
+        # unlinked by the other side already, which does not unregister it
+        if sys.version_info < (3, 13):
+            resource_tracker.unregister(block._name, 'shared_memory')
+
+
+def _shutdown(conn) -> None:
+    # Unlike `close`, this wakes up the threads blocked in `recv`, and the peer.
+    try:
+        with socket.socket(fileno=os.dup(conn.fileno())) as sock:
+            sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+def _view_block(block: shared_memory.SharedMemory, num_frames: int, num_labels: int) -> Tensor:
+    return torch.frombuffer(
+        block.buf, dtype=torch.float32, count=num_frames * num_labels,
+    ).view(num_frames, num_labels)
+
+
+class _Connection:
+    def __init__(self, conn):
+        self.conn = conn
+        self.lock = threading.Lock()
+        self.blocks: Dict[str, shared_memory.SharedMemory] = {}
+        self.closed = False
+
+    def send(self, message) -> None:
+        with self.lock:
+            if self.closed:
+                return
+            try:
+                self.conn.send(message)
+            except OSError:
+                # disconnected, the reader cleans up
+                pass
+
+    def close(self) -> None:
+        with self.lock:
+            self.closed = True
+            self.conn.close()
+        # The mappings are closed once the requests queued are dropped.
+        for block in self.blocks.values():
+            _unlink_block(block)
+        self.blocks.clear()
+
+
+class _Request(NamedTuple):
+    connection: _Connection
+    request_id: int
+    block: shared_memory.SharedMemory
+    num_frames: int
+    deadline: Optional[float]
+
+
+class DecodeServer:
+    """Decodes the emissions sent by :py:class:`DecodeClient` in batches
+
+    The requests of all the clients are queued together. When fewer than
+    ``max_in_flight`` batches are being decoded, a new batch takes the
+    requests queued (up to ``max_batch_size``), so the requests arriving
+    while the decoder threads are busy are decoded together in the next one.
+
+    The load is bounded at every stage: each client has at most its
+    ``max_in_flight`` requests in the server, and when ``max_pending``
+    requests are queued, the server stops reading requests until a batch is
+    taken, so that the clients block on submission.
+
+    Args:
+        decoder (BeamSearchDecoder): The decoder, with ``is_nll`` matching the
+            emissions of the clients.
+        address (str): Path of the Unix domain socket to listen on.
+        authkey (bytes, optional): The key the clients have to present.
+        max_batch_size (int): The maximum number of requests in a batch.
+        batch_timeout (float): Seconds the first request of a batch waits
+            for more requests to arrive. By default, a batch only takes the
+            requests already queued.
+        max_pending (int): The maximum number of requests queued.
+        max_in_flight (int): The number of batches decoded at the same time.
+            With ``2``, a batch is padded and pruned while another one is
+            searched.
+    """
+    def __init__(
+            self,
+            decoder: BeamSearchDecoder,
+            address: str,
+            authkey: Optional[bytes] = None,
+            max_batch_size: int = 16,
+            batch_timeout: float = 0.0,
+            max_pending: int = 64,
+            max_in_flight: int = 2,
+    ):
+        if max_batch_size < 1:
+            raise ValueError("`max_batch_size` must be positive.")
+        if max_in_flight < 1:
+            raise ValueError("`max_in_flight` must be positive.")
+        self.decoder = decoder
+        self.address = address
+        self.authkey = authkey
+        self.max_batch_size = max_batch_size
+        self.batch_timeout = batch_timeout
+        self._num_labels = len(decoder.labels)
+        self._listener = Listener(address, family='AF_UNIX', authkey=authkey)
+        self._pending: queue.Queue = queue.Queue(max_pending)
+        self._in_flight = threading.Semaphore(max_in_flight)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_in_flight)
+        self._closed = threading.Event()
+        # set once the batch loop took the `None` queued by `close`
+        self._stopped = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._connections_lock = threading.Lock()
+        self._connections: Set[_Connection] = set()
+
+    def __enter__(self) -> 'DecodeServer':
+        return self.start()
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def start(self) -> 'DecodeServer':
+        """Start serving in background threads"""
+        for target in [self._accept_loop, self._batch_loop]:
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def serve_forever(self) -> None:
+        """Serve until :py:meth:`close` is called from another thread"""
+        if not self._threads:
+            self.start()
+        self._closed.wait()
+
+    def close(self) -> None:
+        """Stop serving and disconnect the clients
+
+        The requests queued are decoded and replied first. The ones
+        submitted afterwards fail.
+        """
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        # Wakes up `accept`. Without the handshake, so that it does not wait
+        # if `accept` returned already, for a client which connected meanwhile.
+        try:
+            with socket.socket(socket.AF_UNIX) as sock:
+                sock.setblocking(False)
+                sock.connect(self.address)
+        except OSError:
+            pass
+        self._pending.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._executor.shutdown()
+        self._listener.close()
+        with self._connections_lock:
+            connections = list(self._connections)
+        for connection in connections:
+            _shutdown(connection.conn)
+
+    def _accept_loop(self) -> None:
+        while True:
+            try:
+                conn = self._listener.accept()
+            except (AuthenticationError, EOFError, OSError):
+                if self._closed.is_set():
+                    return
+                continue
+            if self._closed.is_set():
+                conn.close()
+                return
+            connection = _Connection(conn)
+            with self._connections_lock:
+                self._connections.add(connection)
+            threading.Thread(target=self._read_loop, args=(connection,), daemon=True).start()
+
+    def _read_loop(self, connection: _Connection) -> None:
+        try:
+            while not self._closed.is_set():
+                message = connection.conn.recv()
+                if message[0] == 'close':
+                    break
+                if message[0] == 'release':
+                    block = connection.blocks.pop(message[1], None)
+                    if block is not None:
+                        _unlink_block(block)
+                    continue
+                _, request_id, name, num_frames, num_labels, deadline = message
+                # opened even if the request is rejected, as the client reuses
+                # the block, and releases it later
+                if name not in connection.blocks:
+                    connection.blocks[name] = _open_block(name)
+                if num_labels != self._num_labels:
+                    connection.send((
+                        'error', request_id, 'RuntimeError',
+                        f'The emission has {num_labels} labels, '
+                        f'while the decoder has {self._num_labels}.'))
+                    continue
+                self._pending.put(_Request(
+                    connection, request_id, connection.blocks[name], num_frames, deadline))
+        except (EOFError, OSError):
+            pass
+        finally:
+            with self._connections_lock:
+                self._connections.discard(connection)
+            connection.close()
+
+    def _next_batch(self) -> Optional[List[_Request]]:
+        if self._stopped.is_set():
+            return None
+        request = self._pending.get()
+        if request is None:
+            self._stopped.set()
+            return None
+        batch = [request]
+        end = time.monotonic() + self.batch_timeout
+        while len(batch) < self.max_batch_size:
+            try:
+                request = self._pending.get(timeout=max(end - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if request is None:
+                # Not queued again, as the read threads blocked on the full
+                # queue could take its place, and nothing would take them.
+                self._stopped.set()
+                break
+            batch.append(request)
+        return batch
+
+    def _batch_loop(self) -> None:
+        while True:
+            # The batch is taken once it can be decoded, so that the requests
+            # arriving in the meantime join it.
+            self._in_flight.acquire()
+            batch = self._next_batch()
+            if batch is None:
+                return
+            now = time.monotonic()
+            requests = []
+            for request in batch:
+                if request.connection.closed:
+                    continue
+                if request.deadline is not None and request.deadline < now:
+                    request.connection.send((
+                        'error', request.request_id, 'TimeoutError',
+                        'The deadline passed before the decoding started.'))
+                    continue
+                requests.append(request)
+            if requests:
+                self._executor.submit(self._decode, requests)
+            else:
+                self._in_flight.release()
+
+    def _decode(self, requests: List[_Request]) -> None:
+        try:
+            probs = torch.zeros(
+                len(requests), max(r.num_frames for r in requests), self._num_labels)
+            seq_lens = torch.tensor([r.num_frames for r in requests], dtype=torch.int32)
+            for i, request in enumerate(requests):
+                if request.num_frames > 0:
+                    probs[i, :request.num_frames] = _view_block(
+                        request.block, request.num_frames, self._num_labels)
+            tokens, offsets, scores, timesteps = self.decoder.forward_ragged(probs, seq_lens)
+        except Exception as e:
+            for request in requests:
+                request.connection.send(('error', request.request_id, 'RuntimeError', str(e)))
+            return
+        finally:
+            self._in_flight.release()
+        nbest = scores.size(1)
+        offsets_: List[int] = offsets.tolist()
+        for i, request in enumerate(requests):
+            begin, end = offsets_[i * nbest], offsets_[(i + 1) * nbest]
+            request.connection.send((
+                'result', request.request_id, tokens[begin:end].tolist(),
+                offsets[i * nbest:(i + 1) * nbest + 1].diff().tolist(),
+                scores[i].tolist(), timesteps[begin:end].tolist()))
+
+
+class DecodeClient:
+    """Submits emissions to a :py:class:`DecodeServer` of the same host
+
+    Each request holds a block of shared memory until its result arrives,
+    and the blocks are reused. The client can be used from multiple threads.
+
+    Args:
+        address (str): Path of the Unix domain socket of the server.
+        authkey (bytes, optional): The key of the server.
+        max_in_flight (int): The maximum number of requests submitted and not
+            completed. Further submissions wait until one of them completes.
+    """
+    def __init__(
+            self,
+            address: str,
+            authkey: Optional[bytes] = None,
+            max_in_flight: int = 8,
+    ):
+        self._conn = Client(address, family='AF_UNIX', authkey=authkey)
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._free_blocks: List[shared_memory.SharedMemory] = []
+        self._futures: Dict[int, Tuple[concurrent.futures.Future, shared_memory.SharedMemory]] = {}
+        self._request_ids = itertools.count()
+        self._closed = False
+        self._reader = threading.Thread(target=self._read_loop, daemon=True)
+        self._reader.start()
+
+    def __enter__(self) -> 'DecodeClient':
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def submit(
+            self,
+            emission: Tensor,
+            timeout: Optional[float] = None,
+    ) -> concurrent.futures.Future:
+        """Submit an emission for decoding
+
+        Args:
+            emission (torch.Tensor): The probabilities (or log probabilities,
+                as the decoder of the server expects) of one sequence.
+                Shape: ``[num_timesteps, num_labels]``.
+            timeout (float, optional): Seconds until the decoding has to start.
+                Otherwise the request fails with ``TimeoutError``.
+
+        Returns:
+            concurrent.futures.Future:
+                Future of the same Tuple as
+                :py:meth:`BeamSearchDecoder.forward_ragged` for the batch of
+                this sequence.
+        """
+        if emission.dim() != 2:
+            raise ValueError(
+                f"The emission must be 2D ([num_timesteps, num_labels]). Found: {emission.shape}")
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self._slots.acquire()
+        block = None
+        try:
+            with self._lock:
+                self._check_open()
+                block = self._get_block(4 * emission.numel())
+            if emission.numel() > 0:
+                _view_block(block, *emission.shape).copy_(emission)
+            with self._lock:
+                self._check_open()
+                request_id = next(self._request_ids)
+                future: concurrent.futures.Future = concurrent.futures.Future()
+                self._futures[request_id] = (future, block)
+                self._conn.send(('decode', request_id, block.name, *emission.shape, deadline))
+        except BaseException:
+            if block is not None:
+                with self._lock:
+                    self._free_blocks.append(block)
+            self._slots.release()
+            raise
+        return future
+
+    def decode(
+            self,
+            emission: Tensor,
+            timeout: Optional[float] = None,
+    ) -> Tuple[Tensor, Tensor, Tensor, Tensor]:
+        """Same as :py:meth:`submit`, but waits for the result"""
+        return self.submit(emission, timeout).result()
+
+    def close(self) -> None:
+        """Disconnect from the server, failing the requests not completed"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            try:
+                self._conn.send(('close',))
+            except OSError:
+                pass
+        self._reader.join()
+        self._conn.close()
+
+    def _check_open(self) -> None:
+        if self._closed:
+            raise RuntimeError("The client is closed.")
+
+    def _get_block(self, size: int) -> shared_memory.SharedMemory:
+        # the smallest free one large enough, or a new one replacing the largest
+        self._free_blocks.sort(key=lambda b: b.size)
+        for i, block in enumerate(self._free_blocks):
+            if block.size >= size:
+                return self._free_blocks.pop(i)
+        if self._free_blocks:
+            block = self._free_blocks.pop()
+            self._conn.send(('release', block.name))
+            block.close()
+        return _open_block(size=max(_MIN_BLOCK_SIZE, 1 << max(size - 1, 0).bit_length()))
+
+    def _read_loop(self) -> None:
+        try:
+            while True:
+                message = self._conn.recv()
+                with self._lock:
+                    future, block = self._futures.pop(message[1])
+                    self._free_blocks.append(block)
+                self._slots.release()
+                if message[0] == 'error':
+                    _, _, kind, text = message
+                    error = TimeoutError if kind == 'TimeoutError' else RuntimeError
+                    future.set_exception(error(text))
+                    continue
+                _, _, tokens, lengths, scores, timesteps = message
+                offsets = torch.tensor([0] + lengths, dtype=torch.int64).cumsum(0)
+                future.set_result((
+                    torch.tensor(tokens, dtype=torch.int32), offsets,
+                    torch.tensor([scores], dtype=torch.float32),
+                    torch.tensor(timesteps, dtype=torch.int32)))
+        except (EOFError, OSError):
+            pass
+        with self._lock:
+            closed_by_server = not self._closed
+            self._closed = True
+            futures, self._futures = self._futures, {}
+        for future, block in futures.values():
+            future.set_exception(RuntimeError("The connection to the server was closed."))
+            self._free_blocks.append(block)
+        for block in self._free_blocks:
+            if closed_by_server:
+                # nobody else would
+                _unlink_block(block)
+            block.close()
+        self._free_blocks.clear()
@@ -1,115 +1,1721 @@
+#include <cmath>
+#include <algorithm>
+#include <chrono>
+#include <condition_variable>
+#include <exception>
+#include <limits>
+#include <memory>
+#include <mutex>
+#include <numeric>
 #include <utility>
 #include <vector>
 
-#include <ATen/Parallel.h>
+#include <ATen/ThreadLocalState.h>
+#include <ATen/record_function.h>
 #include <torch/script.h>
 
 #include "ctc_beam_search_decoder.h"
+#include "language_model.h"
+#include "lexicon.h"
+#include "score_cache.h"
+#include "scorer.h"
+#include "thread_pool.h"
 
 namespace ctcdecode {
 namespace {
 
-std::tuple<torch::Tensor, torch::Tensor, torch::Tensor, torch::Tensor>
-beam_decode(torch::Tensor probs, c10::optional<torch::Tensor> seq_lens_,
-            std::vector<std::string> vocabulary, int64_t beam_size,
-            int64_t cutoff_top_n, c10::optional<double> cutoff_prob_,
-            int64_t blank_id, bool is_nll, int64_t num_processes) {
+// The labels retained in each frame, in descending order of probability.
+struct Candidates {
+  // Shape: `[..., max_candidates]`. Float.
+  torch::Tensor log_probs;
+  // Shape: `[..., max_candidates]`. Int64. Undefined if all the labels are
+  // kept in order, as the candidates are then the labels themselves.
+  torch::Tensor labels;
+  // The number of valid candidates in each frame. Shape: `[...]`. Int64.
+  torch::Tensor counts;
+  // Whether each frame is dominated by blank. Shape: `[...]`. Bool.
+  // Undefined if blank frames are not skipped.
+  torch::Tensor blank_frames;
+  // The cumulative probabilities of the candidates. Shape and type: same as
+  // `log_probs`. Undefined unless requested.
+  torch::Tensor cum_probs;
+};
 
-  const double cutoff_prob = cutoff_prob_.value_or(1.1);
-  const int64_t num_classes = vocabulary.size();
+void check_beam_threshold(const c10::optional<double> &threshold) {
+  TORCH_CHECK(!threshold.has_value() || threshold.value() > 0,
+              "`beam_threshold` has to be positive.");
+}
+
+float get_beam_threshold(const c10::optional<double> &threshold) {
+  return threshold.has_value()
+             ? static_cast<float>(std::min<double>(threshold.value(), NUM_FLT_INF))
+             : NUM_FLT_INF;
+}
+
+void check_blank_skip_threshold(const c10::optional<double> &threshold) {
+  // Above 0.5, blank is always the first candidate of the frames to skip.
+  TORCH_CHECK(!threshold.has_value() ||
+                  (0.5 < threshold.value() && threshold.value() <= 1.0),
+              "`blank_skip_threshold` has to be in (0.5, 1.0].");
+}
+
+void check_segment_min_blank_frames(const c10::optional<int64_t> &min_frames,
+                                    double blank_threshold) {
+  TORCH_CHECK(!min_frames.has_value() || min_frames.value() > 0,
+              "`segment_min_blank_frames` has to be positive.");
+  TORCH_CHECK(0.5 < blank_threshold && blank_threshold <= 1.0,
+              "`segment_blank_threshold` has to be in (0.5, 1.0].");
+}
+
+// The log posterior of blank in each frame. The posterior is normalized
+// here, so that un-normalized emissions such as logits are handled as well.
+torch::Tensor get_blank_log_posteriors(const torch::Tensor &probs,
+                                       int64_t blank_id, bool is_nll) {
+  const auto probs_ = probs.to(torch::kFloat);
+  const auto blank = probs_.select(-1, blank_id);
+  return is_nll ? blank - probs_.logsumexp(-1)
+                : (blank / probs_.sum(-1) + NUM_FLT_MIN).log();
+}
+
+/* The log probabilities of all the labels, in single precision.
+ *
+ * Log probabilities in single precision are used as they are, without a
+ * copy if contiguous. Otherwise, they are computed over blocks of frames,
+ * so that the input is not converted to double precision as a whole.
+ */
+torch::Tensor get_all_log_probs(const torch::Tensor &probs, bool is_nll,
+                                bool fast_math) {
+  if (is_nll) {
+    return probs.to(torch::kFloat).contiguous();
+  }
+  auto log_probs = torch::empty(probs.sizes(), torch::kFloat);
+  const int64_t num_frames = probs.size(-2);
+  const int64_t frame_size = probs.numel() / std::max<int64_t>(num_frames, 1);
+  const int64_t step =
+      std::max<int64_t>((1 << 20) / std::max<int64_t>(frame_size, 1), 1);
+  for (int64_t t = 0; t < num_frames; t += step) {
+    const int64_t n = std::min(step, num_frames - t);
+    log_probs.narrow(-2, t, n).copy_(
+        (probs.narrow(-2, t, n).to(fast_math ? torch::kFloat : torch::kDouble) +
+         NUM_FLT_MIN)
+            .log());
+  }
+  return log_probs;
+}
+
+/* Prune the labels of all the frames at once.
+ *
+ * Same as `get_pruned_log_probs`, but vectorized over the leading
+ * dimensions: the top `cutoff_top_n` labels are selected without sorting
+ * the whole vocabulary, and the rest of the computation is done only on them.
+ * When all the labels are kept, they are not materialized, and the input is
+ * read in place if possible (see `get_all_log_probs`).
+ * When `blank_skip_threshold` is given, the frames where the posterior of
+ * blank reaches it are flagged. With `keep_cum_probs`, the candidates are
+ * sorted even if all the labels are kept, and their cumulative
+ * probabilities are kept, so that tighter cutoffs can be applied afterwards.
+ */
+Candidates prune(const torch::Tensor &probs, int64_t cutoff_top_n,
+                 double cutoff_prob, bool is_nll, int64_t blank_id = 0,
+                 c10::optional<double> blank_skip_threshold = c10::nullopt,
+                 bool fast_math = false, bool keep_cum_probs = false) {
+  const int64_t num_classes = probs.size(-1);
+  const int64_t max_candidates =
+      std::max<int64_t>(std::min(cutoff_top_n, num_classes), 0);
+  const bool use_cum_prob = cutoff_prob < 1.0;
+
+  Candidates candidates;
+  torch::Tensor cum_probs;
+  if (max_candidates < num_classes || use_cum_prob || keep_cum_probs) {
+    const auto probs_ = c10::isReducedFloatingType(probs.scalar_type())
+                            ? probs.to(torch::kFloat)
+                            : probs;
+    torch::Tensor values, labels;
+    std::tie(values, labels) = probs_.topk(max_candidates, -1);
+    // computed in double precision, as `get_pruned_log_probs` does, unless
+    // `fast_math`, as the search is in single precision anyway
+    values = values.to(fast_math ? torch::kFloat : torch::kDouble);
+    candidates.log_probs =
+        (is_nll ? values : (values + NUM_FLT_MIN).log())
+            .to(torch::kFloat)
+            .contiguous();
+    candidates.labels = labels.contiguous();
+    if (use_cum_prob || keep_cum_probs) {
+      cum_probs = (is_nll ? values.exp() : values).cumsum(-1);
+    }
+  } else {
+    candidates.log_probs = get_all_log_probs(probs, is_nll, fast_math);
+  }
+  if (keep_cum_probs) {
+    candidates.cum_probs = cum_probs;
+  }
+  if (use_cum_prob) {
+    // keep the labels until the cumulative probability reaches the cutoff
+    candidates.counts = ((cum_probs < cutoff_prob).sum(-1) + 1)
+                            .clamp_max(max_candidates)
+                            .contiguous();
+  } else {
+    candidates.counts =
+        torch::full(probs.sizes().slice(0, probs.dim() - 1), max_candidates,
+                    torch::kLong);
+  }
+  if (blank_skip_threshold.has_value()) {
+    candidates.blank_frames =
+        (get_blank_log_posteriors(probs, blank_id, is_nll) >=
+         std::log(blank_skip_threshold.value()))
+            .contiguous();
+  }
+  return candidates;
+}
+
+const int64_t *get_labels(const Candidates &candidates) {
+  return candidates.labels.defined() ? candidates.labels.data_ptr<int64_t>()
+                                     : nullptr;
+}
+
+const bool *get_blank_frames(const Candidates &candidates) {
+  return candidates.blank_frames.defined()
+             ? candidates.blank_frames.data_ptr<bool>()
+             : nullptr;
+}
+
+/* N-gram language model exposed to TorchScript.
+ *
+ * The model is immutable once loaded, so one instance can be shared by any
+ * number of decoders and threads. Only the path is serialized.
+ */
+struct LanguageModelHolder : torch::CustomClassHolder {
+  explicit LanguageModelHolder(std::string path)
+      : path(std::move(path)),
+        model(std::make_shared<const LanguageModel>(this->path)) {}
+
+  // Write the model in the binary format, which is memory-mapped on loading.
+  void save(std::string output_path) { model->save(output_path); }
+
+  // The natural log probability of a sentence, starting with `<s>`.
+  double score(std::vector<std::string> words, bool eos) {
+    auto state = model->begin_state();
+    double total = 0.0;
+    for (const auto &word : words) {
+      total += model->score(
+          state, model->word_id(LanguageModel::hash_word(word)), &state);
+    }
+    if (eos) {
+      total += model->score(state, model->end_of_sentence());
+    }
+    return total;
+  }
+
+  int64_t order() { return model->order(); }
+  int64_t vocab_size() { return model->vocab_size(); }
+  int64_t size() { return model->size(); }
+  bool is_mapped() { return model->is_mapped(); }
+
+  const std::string path;
+  const std::shared_ptr<const LanguageModel> model;
+};
+
+using LanguageModelPtr = c10::intrusive_ptr<LanguageModelHolder>;
+
+/* Cache of language model scores exposed to TorchScript.
+ *
+ * It is kept by the decoder, so that the scores computed in one call are
+ * reused in the later calls. It is thread-safe, so it is shared by all the
+ * items of a batch. Only the capacity is serialized.
+ */
+struct ScoreCacheHolder : torch::CustomClassHolder {
+  explicit ScoreCacheHolder(int64_t capacity) {
+    TORCH_CHECK(capacity >= 0, "`capacity` has to be non-negative.");
+    cache = std::make_shared<ScoreCache>(capacity);
+  }
+
+  c10::Dict<std::string, int64_t> get_stats() {
+    c10::Dict<std::string, int64_t> ret;
+    ret.insert("hits", cache->num_hits());
+    ret.insert("misses", cache->num_misses());
+    ret.insert("size", cache->size());
+    ret.insert("capacity", cache->capacity());
+    return ret;
+  }
+
+  void clear() { cache->clear(); }
+
+  int64_t capacity() const { return cache->capacity(); }
+
+  std::shared_ptr<ScoreCache> cache;
+};
+
+using ScoreCachePtr = c10::intrusive_ptr<ScoreCacheHolder>;
+
+/* Lexicon exposed to TorchScript.
+ *
+ * It is immutable once loaded, so one instance can be shared by any number
+ * of decoders and threads. Only the path is serialized.
+ */
+struct LexiconHolder : torch::CustomClassHolder {
+  explicit LexiconHolder(std::string path)
+      : path(std::move(path)), lexicon(std::make_shared<const Lexicon>(this->path)) {}
+
+  int64_t num_words() { return lexicon->num_words(); }
+  int64_t num_states() { return lexicon->num_states(); }
+  int64_t size() { return lexicon->size(); }
+  bool is_mapped() { return lexicon->is_mapped(); }
+
+  const std::string path;
+  const std::shared_ptr<const Lexicon> lexicon;
+};
+
+using LexiconPtr = c10::intrusive_ptr<LexiconHolder>;
+
+// Build a lexicon from words and save it in the binary format.
+void compile_lexicon(std::vector<std::string> words,
+                     std::vector<std::string> labels,
+                     std::string word_delimiter, std::string output_path) {
+  Lexicon(words, labels, word_delimiter).save(output_path);
+}
+
+const Lexicon *get_lexicon(const c10::optional<LexiconPtr> &lexicon,
+                           const std::vector<std::string> &vocabulary,
+                           const std::string &word_delimiter) {
+  if (!lexicon.has_value()) {
+    return nullptr;
+  }
+  TORCH_CHECK(
+      lexicon.value()->lexicon->is_compatible(vocabulary, word_delimiter),
+      "`lexicon` was compiled for different labels or word delimiter.");
+  return lexicon.value()->lexicon.get();
+}
+
+std::unique_ptr<Scorer>
+make_scorer(const c10::optional<LanguageModelPtr> &language_model,
+            const c10::optional<ScoreCachePtr> &lm_cache, double alpha,
+            double beta) {
+  if (!language_model.has_value()) {
+    return nullptr;
+  }
+  return std::unique_ptr<Scorer>(
+      new Scorer(language_model.value()->model, alpha, beta,
+                 lm_cache.has_value() ? lm_cache.value()->cache : nullptr));
+}
+
+void insert_stats(c10::Dict<std::string, int64_t> &dict,
+                  const DecodeStats &stats) {
+  dict.insert("frames", stats.frames);
+  dict.insert("frames_skipped", stats.frames_skipped);
+  dict.insert("candidates", stats.candidates);
+  dict.insert("prefixes_expanded", stats.prefixes_expanded);
+  dict.insert("nodes_allocated", stats.nodes_allocated);
+  dict.insert("nodes_freed", stats.nodes_freed);
+  dict.insert("peak_nodes", stats.peak_nodes);
+  dict.insert("tokens_committed", stats.tokens_committed);
+  dict.insert("expand_ns", stats.expand_ns);
+  dict.insert("select_ns", stats.select_ns);
+  dict.insert("extract_ns", stats.extract_ns);
+}
+
+/* Statistics of batch decodes exposed to TorchScript.
+ *
+ * When given to the decoding functions, the counters and the time spent in
+ * each phase are added up over the sequences and the calls, until cleared.
+ * The times of the search phases are the sums over the decoder threads.
+ * Nothing is measured when it is not given. Only the presence is serialized.
+ */
+struct DecodeStatsHolder : torch::CustomClassHolder {
+  // Add the statistics of one sequence.
+  void add(const DecodeStats &stats) {
+    std::lock_guard<std::mutex> lock(mutex);
+    total.frames += stats.frames;
+    total.frames_skipped += stats.frames_skipped;
+    total.candidates += stats.candidates;
+    total.prefixes_expanded += stats.prefixes_expanded;
+    total.nodes_allocated += stats.nodes_allocated;
+    total.nodes_freed += stats.nodes_freed;
+    total.peak_nodes = std::max(total.peak_nodes, stats.peak_nodes);
+    total.tokens_committed += stats.tokens_committed;
+    total.expand_ns += stats.expand_ns;
+    total.select_ns += stats.select_ns;
+    total.extract_ns += stats.extract_ns;
+  }
+
+  // Add a call of the given number of sequences and segments, and its
+  // pruning time.
+  void add_call(int64_t num_sequences, int64_t num_segments,
+                int64_t prune_ns) {
+    std::lock_guard<std::mutex> lock(mutex);
+    ++calls;
+    sequences += num_sequences;
+    segments += num_segments;
+    this->prune_ns += prune_ns;
+  }
+
+  c10::Dict<std::string, int64_t> get() {
+    std::lock_guard<std::mutex> lock(mutex);
+    c10::Dict<std::string, int64_t> ret;
+    ret.insert("calls", calls);
+    ret.insert("sequences", sequences);
+    ret.insert("segments", segments);
+    insert_stats(ret, total);
+    ret.insert("prune_ns", prune_ns);
+    return ret;
+  }
 
+  void clear() {
+    std::lock_guard<std::mutex> lock(mutex);
+    total = DecodeStats();
+    calls = sequences = segments = prune_ns = 0;
+  }
+
+private:
+  std::mutex mutex;
+  DecodeStats total;
+  int64_t calls = 0, sequences = 0, segments = 0, prune_ns = 0;
+};
+
+using DecodeStatsPtr = c10::intrusive_ptr<DecodeStatsHolder>;
+
+// Copy the decoding result of one sequence into the output Tensors
+void copy_results(const std::vector<std::pair<double, Output>> &results,
+                  at::TensorAccessor<int, 2> beams,
+                  at::TensorAccessor<int, 1> lengths,
+                  at::TensorAccessor<float, 1> scores,
+                  at::TensorAccessor<int, 2> timesteps) {
+  for (size_t p = 0; p < results.size(); ++p) {
+    const auto &output = results[p].second;
+    for (size_t t = 0; t < output.tokens.size(); ++t) {
+      beams[p][t] = output.tokens[t];
+      timesteps[p][t] = output.timesteps[t];
+    }
+    scores[p] = results[p].first;
+    lengths[p] = output.tokens.size();
+  }
+}
+
+using DecodeOutputs =
+    std::tuple<torch::Tensor, torch::Tensor, torch::Tensor, torch::Tensor>;
+
+void check_probs(const torch::Tensor &probs, int64_t num_classes) {
   TORCH_CHECK(probs.ndimension() == 3, "`probs` has to be 3D Tensor.");
   TORCH_CHECK(probs.device().is_cpu(), "`probs` has to be on CPU.");
-  TORCH_CHECK(probs.dtype() == torch::kFloat,
-              "`probs` has to be float Tensor.");
-  TORCH_CHECK(
-      probs.size(2) == num_classes,
-      "The 3rd dimension of `probs` has to match the size of the vocabulary.");
+  TORCH_CHECK(probs.is_floating_point(),
+              "`probs` has to be floating point Tensor.");
+  TORCH_CHECK(probs.size(2) == num_classes,
+              "The 3rd dimension of `probs` has to match the size of the "
+              "vocabulary.");
+}
 
+// Validate `seq_lens`, and return it as a contiguous Tensor, or the full
+// length of `probs` for all the sequences if not given.
+torch::Tensor get_seq_lens(const torch::Tensor &probs,
+                           const c10::optional<torch::Tensor> &seq_lens) {
   const int64_t batch_size = probs.size(0);
   const int64_t max_seq_len = probs.size(1);
+  if (!seq_lens.has_value()) {
+    return torch::full({batch_size}, max_seq_len, torch::kInt32);
+  }
+  const auto &lens = seq_lens.value();
+  TORCH_CHECK(lens.ndimension() == 1,
+              "When provided, `seq_lens` has to be 1D Tensor.");
+  TORCH_CHECK(lens.size(0) == batch_size,
+              "When provided, `seq_lens` has to have the same batch size "
+              "as `probs`.");
+  TORCH_CHECK(lens.device().is_cpu(),
+              "When provided, `seq_lens` has to be on CPU.");
+  TORCH_CHECK(lens.dtype() == torch::kInt32,
+              "When provided, `seq_lens` has to be int32 Tensor.");
+  TORCH_CHECK((lens >= 0).all().item<bool>(),
+              "All the values in `seq_lens` must be non-negative.");
+  TORCH_CHECK((lens <= max_seq_len).all().item<bool>(),
+              "All the values in`seq_lens` must be less than or equal to "
+              "the length of `probs`.");
+  return lens.contiguous();
+}
+
+// The index of `label` in `vocabulary`, or -1.
+int find_label(const std::vector<std::string> &vocabulary,
+               const std::string &label) {
+  const auto it = std::find(vocabulary.begin(), vocabulary.end(), label);
+  return it == vocabulary.end() ? -1 : std::distance(vocabulary.begin(), it);
+}
 
-  auto seq_lens = [&]() {
-    if (seq_lens_.has_value()) {
-      auto seq_lens = seq_lens_.value();
-      TORCH_CHECK(seq_lens.ndimension() == 1,
-                  "When provided, `seq_lens` has to be 1D Tensor.");
-      TORCH_CHECK(seq_lens.size(0) == batch_size,
-                  "When provided, `seq_lens` has to have the same batch size "
-                  "as `probs`.");
-      TORCH_CHECK(seq_lens.device().is_cpu(),
-                  "When provided, `seq_lens` has to be on CPU.");
-      TORCH_CHECK(seq_lens.dtype() == torch::kInt32,
-                  "When provided, `seq_lens` has to be on CPU.");
-      TORCH_CHECK((seq_lens <= max_seq_len).all().item<bool>(),
-                  "All the values in`seq_lens` must be less than or equal to "
-                  "the length of `probs`.");
-      return seq_lens;
+// Join the labels into a string, replacing the word delimiter with
+// `word_separator`. The delimiters at both ends are dropped.
+std::string join_labels(const int *begin, const int *end,
+                        const std::vector<std::string> &vocabulary,
+                        int delimiter_id, const std::string &word_separator) {
+  while (begin != end && *begin == delimiter_id) {
+    ++begin;
+  }
+  while (begin != end && *(end - 1) == delimiter_id) {
+    --end;
+  }
+  std::string text;
+  for (auto token = begin; token != end; ++token) {
+    text += *token == delimiter_id ? word_separator : vocabulary[*token];
+  }
+  return text;
+}
+
+/* The configuration of the decoder which does not depend on the input,
+ * exposed to TorchScript.
+ *
+ * The vocabulary, the ids of blank and of the word delimiter, the scorer
+ * and the lexicon are resolved and validated once on construction, so that
+ * the decoding functions only take a handle, instead of converting the
+ * vocabulary and building them on every call. It is immutable, so one
+ * instance can be shared by any number of decoders and threads. The
+ * arguments are serialized.
+ */
+struct DecoderContext : torch::CustomClassHolder {
+  using Config =
+      std::tuple<std::vector<std::string>, int64_t, std::string,
+                 c10::optional<LanguageModelPtr>, double, double,
+                 c10::optional<ScoreCachePtr>, c10::optional<LexiconPtr>>;
+
+  DecoderContext(std::vector<std::string> vocabulary_, int64_t blank_id,
+                 std::string word_delimiter_,
+                 c10::optional<LanguageModelPtr> language_model_, double alpha,
+                 double beta, c10::optional<ScoreCachePtr> lm_cache_,
+                 c10::optional<LexiconPtr> lexicon_)
+      : vocabulary(std::move(vocabulary_)), blank_id(blank_id),
+        word_delimiter(std::move(word_delimiter_)),
+        delimiter_id(find_label(vocabulary, word_delimiter)),
+        language_model(std::move(language_model_)), alpha(alpha), beta(beta),
+        lm_cache(std::move(lm_cache_)), lexicon_holder(std::move(lexicon_)),
+        scorer(make_scorer(language_model, lm_cache, alpha, beta)),
+        lexicon(get_lexicon(lexicon_holder, vocabulary, word_delimiter)) {
+    TORCH_CHECK(0 <= blank_id &&
+                    blank_id < static_cast<int64_t>(vocabulary.size()),
+                "`blank_id` has to be a valid label.");
+  }
+
+  int64_t num_labels() const { return vocabulary.size(); }
+
+  Config get_config() const {
+    return std::make_tuple(vocabulary, blank_id, word_delimiter,
+                           language_model, alpha, beta, lm_cache,
+                           lexicon_holder);
+  }
+
+  const std::vector<std::string> vocabulary;
+  const int64_t blank_id;
+  const std::string word_delimiter;
+  // the index of `word_delimiter` in `vocabulary`, or -1
+  const int delimiter_id;
+  const c10::optional<LanguageModelPtr> language_model;
+  const double alpha;
+  const double beta;
+  const c10::optional<ScoreCachePtr> lm_cache;
+  const c10::optional<LexiconPtr> lexicon_holder;
+  // read-only during decoding, so shared by all the decoder states
+  const std::unique_ptr<Scorer> scorer;
+  const Lexicon *const lexicon;
+};
+
+using DecoderContextPtr = c10::intrusive_ptr<DecoderContext>;
+
+/* Split a sequence in the middle of the runs of at least `min_frames`
+ * frames flagged in `blank_frames`.
+ *
+ * Returns the boundaries of the segments, from 0 to `length`. The runs at
+ * both ends are not split, as they would only make segments of blank.
+ */
+std::vector<int> find_segment_bounds(const bool *blank_frames, int length,
+                                     int64_t min_frames) {
+  std::vector<int> bounds{0};
+  int run_begin = 0;
+  for (int t = 0; t <= length; ++t) {
+    if (t < length && blank_frames[t]) {
+      continue;
     }
-    return torch::full({batch_size}, max_seq_len, torch::kInt32);
-  }();
+    if (run_begin > 0 && t < length && t - run_begin >= min_frames) {
+      bounds.push_back((run_begin + t) / 2);
+    }
+    run_begin = t + 1;
+  }
+  bounds.push_back(length);
+  return bounds;
+}
 
-  // Copy data into the format ctc beam search expects
-  std::vector<std::vector<std::vector<double>>> inputs;
-  auto prob_accessor = probs.accessor<float, 3>();
-  auto seq_len_accessor = seq_lens.accessor<int, 1>();
+/* Combine the hypotheses of the consecutive segments of a sequence into the
+ * best `nbest` hypotheses of the whole sequence.
+ *
+ * A hypothesis of the sequence is one hypothesis of each segment, and its
+ * score is the sum of theirs. The lists are merged one segment at a time,
+ * keeping the best `nbest` combinations, which are only assembled at the
+ * end. Timesteps are shifted by the first frame of the segment.
+ */
+std::vector<std::pair<double, Output>>
+stitch_results(std::vector<std::vector<std::pair<double, Output>>> &segments,
+               const std::vector<int> &bounds, size_t nbest) {
+  if (segments.size() == 1) {
+    return std::move(segments[0]);
+  }
+  // the combinations kept after each merge, as the index of the combination
+  // of the previous segments and the index of the hypothesis of the segment
+  struct Combination {
+    double score;
+    size_t prev;
+    size_t index;
+  };
+  std::vector<std::vector<Combination>> merged(segments.size());
+  for (size_t j = 0; j < segments[0].size(); ++j) {
+    merged[0].push_back({segments[0][j].first, 0, j});
+  }
+  for (size_t s = 1; s < segments.size(); ++s) {
+    auto &combinations = merged[s];
+    for (size_t i = 0; i < merged[s - 1].size(); ++i) {
+      for (size_t j = 0; j < segments[s].size(); ++j) {
+        combinations.push_back(
+            {merged[s - 1][i].score + segments[s][j].first, i, j});
+      }
+    }
+    const size_t num_kept = std::min(nbest, combinations.size());
+    std::partial_sort(combinations.begin(), combinations.begin() + num_kept,
+                      combinations.end(),
+                      [](const Combination &a, const Combination &b) {
+                        return a.score < b.score ||
+                               (a.score == b.score &&
+                                (a.prev < b.prev ||
+                                 (a.prev == b.prev && a.index < b.index)));
+                      });
+    combinations.resize(num_kept);
+  }
 
-  // TODO: use slicing and memcpy OR pass Tensor directly to ctc_beam_search_decoder
-  for (int64_t b = 0; b < batch_size; ++b) {
-    int seq_len = (int)seq_len_accessor[b];
-    std::vector<std::vector<double>> temp(seq_len,
-                                          std::vector<double>(num_classes));
-    for (int t = 0; t < seq_len; ++t) {
-      for (int n = 0; n < num_classes; ++n) {
-        float val = prob_accessor[b][t][n];
-        temp[t][n] = val;
+  std::vector<std::pair<double, Output>> results;
+  std::vector<size_t> indices(segments.size());
+  for (const auto &last : merged.back()) {
+    // trace back the hypothesis of each segment
+    size_t k = &last - merged.back().data();
+    for (size_t s = segments.size(); s-- > 0;) {
+      indices[s] = merged[s][k].index;
+      k = merged[s][k].prev;
+    }
+    Output output;
+    for (size_t s = 0; s < segments.size(); ++s) {
+      const auto &part = segments[s][indices[s]].second;
+      output.tokens.insert(output.tokens.end(), part.tokens.begin(),
+                           part.tokens.end());
+      for (int timestep : part.timesteps) {
+        output.timesteps.push_back(timestep + bounds[s]);
       }
     }
-    inputs.push_back(temp);
-  }
-
-  std::vector<std::vector<std::pair<double, Output>>> batch_results(batch_size);
-  auto grain_size = batch_size / num_processes;
-  at::parallel_for(0, batch_size, grain_size, [&](int64_t begin, int64_t end) {
-    for (auto i = begin; i < end; ++i) {
-      batch_results[i] =
-          ctc_beam_search_decoder(inputs[i], vocabulary, beam_size, cutoff_prob,
-                                  cutoff_top_n, blank_id, is_nll);
-    }
-  });
-
-  auto beams =
-      torch::empty({batch_size, beam_size, max_seq_len}, torch::kInt32);
-  auto output_lengths = torch::zeros({batch_size, beam_size}, torch::kInt32);
-  auto scores = torch::empty({batch_size, beam_size}, torch::kFloat);
-  auto timesteps =
-      torch::empty({batch_size, beam_size, max_seq_len}, torch::kInt32);
-
-  auto outputs_accessor = beams.accessor<int, 3>();
-  auto output_lengths_accessor = output_lengths.accessor<int, 2>();
-  auto scores_accessor = scores.accessor<float, 2>();
-  auto timesteps_accessor = timesteps.accessor<int, 3>();
-
-  // TODO: use slice and memcpy
-  for (size_t b = 0; b < batch_results.size(); ++b) {
-    std::vector<std::pair<double, Output>> results = batch_results[b];
-    for (size_t p = 0; p < results.size(); ++p) {
-      std::pair<double, Output> n_path_result = results[p];
-      Output output = n_path_result.second;
-      std::vector<int> output_tokens = output.tokens;
-      std::vector<int> output_timesteps = output.timesteps;
-      for (size_t t = 0; t < output_tokens.size(); ++t) {
-        outputs_accessor[b][p][t] = output_tokens[t]; // fill output tokens
-        timesteps_accessor[b][p][t] = output_timesteps[t];
+    results.emplace_back(last.score, std::move(output));
+  }
+  return results;
+}
+
+void check_search_options(int64_t num_processes, int64_t beam_size,
+                          int64_t nbest,
+                          const c10::optional<double> &beam_threshold) {
+  TORCH_CHECK(num_processes > 0, "`num_processes` has to be positive.");
+  TORCH_CHECK(0 < nbest && nbest <= beam_size,
+              "`nbest` has to be positive and not greater than `beam_size`.");
+  check_beam_threshold(beam_threshold);
+}
+
+/* The frames of a batch, pruned and split into segments.
+ *
+ * The frames of all the sequences are pruned at once. Sequences are only
+ * split at long runs of blank when `segment_min_blank_frames` is given, so
+ * that a long sequence is not searched by a single thread. Read-only once
+ * constructed, so the searches of different configurations can share it.
+ */
+struct PrunedBatch {
+  PrunedBatch(const torch::Tensor &probs,
+              const c10::optional<torch::Tensor> &seq_lens_,
+              const DecoderContext &context, int64_t cutoff_top_n,
+              double cutoff_prob, bool is_nll,
+              c10::optional<double> blank_skip_threshold, bool fast_math,
+              c10::optional<int64_t> segment_min_blank_frames,
+              double segment_blank_threshold, bool timing,
+              bool keep_cum_probs = false) {
+    check_probs(probs, context.num_labels());
+    check_blank_skip_threshold(blank_skip_threshold);
+    check_segment_min_blank_frames(segment_min_blank_frames,
+                                   segment_blank_threshold);
+
+    const int64_t batch_size = probs.size(0);
+    max_seq_len = probs.size(1);
+    seq_lens = get_seq_lens(probs, seq_lens_);
+    const int *seq_lens_data = seq_lens.data_ptr<int>();
+    num_frames = batch_size == 0 ? 0 : seq_lens.max().item<int>();
+
+    // Frames are pruned directly from the Tensor, so neither contiguity nor
+    // a copy of the whole input is required. The padding after the longest
+    // sequence is not read.
+    const auto frames = probs.narrow(1, 0, num_frames);
+    torch::Tensor segment_frames;
+    {
+      RECORD_FUNCTION("simple_ctc::prune", std::vector<c10::IValue>());
+      std::chrono::steady_clock::time_point prune_start;
+      if (timing) {
+        prune_start = std::chrono::steady_clock::now();
+      }
+      candidates =
+          prune(frames, cutoff_top_n, cutoff_prob, is_nll, context.blank_id,
+                blank_skip_threshold, fast_math, keep_cum_probs);
+      if (segment_min_blank_frames.has_value()) {
+        segment_frames = (get_blank_log_posteriors(frames, context.blank_id,
+                                                   is_nll) >=
+                          std::log(segment_blank_threshold))
+                             .contiguous();
       }
-      scores_accessor[b][p] = n_path_result.first;
-      output_lengths_accessor[b][p] = output_tokens.size();
+      if (timing) {
+        prune_ns = std::chrono::duration_cast<std::chrono::nanoseconds>(
+                       std::chrono::steady_clock::now() - prune_start)
+                       .count();
+      }
+    }
+
+    bounds.resize(batch_size);
+    segment_offsets.push_back(0);
+    for (int64_t i = 0; i < batch_size; ++i) {
+      if (segment_frames.defined()) {
+        bounds[i] = find_segment_bounds(
+            segment_frames.data_ptr<bool>() + i * num_frames,
+            seq_lens_data[i], segment_min_blank_frames.value());
+      } else {
+        bounds[i] = {0, seq_lens_data[i]};
+      }
+      for (size_t s = 0; s + 1 < bounds[i].size(); ++s) {
+        segments.push_back({i, bounds[i][s], bounds[i][s + 1]});
+      }
+      segment_offsets.push_back(segments.size());
+    }
+
+    // The segments are handed out longest first to the threads as they
+    // become free, so that the long ones are not stuck behind each other in
+    // one thread.
+    order.resize(segments.size());
+    std::iota(order.begin(), order.end(), 0);
+    std::stable_sort(order.begin(), order.end(), [&](size_t a, size_t b) {
+      return segments[a].end - segments[a].begin >
+             segments[b].end - segments[b].begin;
+    });
+  }
+
+  int64_t batch_size() const { return bounds.size(); }
+
+  /* The number of candidates of each frame at tighter cutoffs.
+   *
+   * The candidates are in descending order of probability, so the ones at
+   * tighter cutoffs are the first ones, and only their number changes.
+   * Requires `keep_cum_probs` if `cutoff_prob < 1.0`.
+   */
+  torch::Tensor get_counts(int64_t cutoff_top_n, double cutoff_prob) const {
+    const int64_t max_candidates = std::max<int64_t>(
+        std::min(cutoff_top_n, candidates.log_probs.size(2)), 0);
+    if (cutoff_prob < 1.0) {
+      const auto cum_probs =
+          candidates.cum_probs.narrow(-1, 0, max_candidates);
+      return ((cum_probs < cutoff_prob).sum(-1) + 1)
+          .clamp_max(max_candidates)
+          .contiguous();
+    }
+    return torch::full(candidates.counts.sizes(), max_candidates,
+                       torch::kLong);
+  }
+
+  struct Segment {
+    int64_t sequence;
+    int begin;
+    int end;
+  };
+
+  int64_t max_seq_len;
+  torch::Tensor seq_lens;
+  // the frames of each sequence in `candidates`, the longest `seq_lens`
+  int64_t num_frames;
+  Candidates candidates;
+  // the time spent pruning, only measured with `timing`
+  int64_t prune_ns = 0;
+  // the boundaries of the segments of each sequence
+  std::vector<std::vector<int>> bounds;
+  // the segments of all the sequences, in order. The ones of the `i`-th
+  // sequence are in `[segment_offsets[i], segment_offsets[i + 1])`.
+  std::vector<Segment> segments;
+  std::vector<size_t> segment_offsets;
+  // the indices of the segments, longest first
+  std::vector<size_t> order;
+};
+
+/* The search over a batch, which outlives the call when run asynchronously.
+ *
+ * `decode` searches over the candidates of one segment of a sequence, and
+ * can be called for different segments from different threads. The
+ * segments are searched independently, and the last one completed of each
+ * sequence stitches their hypotheses.
+ */
+struct BatchJob {
+  // `counts`: the number of candidates of each frame to search over, which
+  // can be less than the ones of `batch`.
+  BatchJob(std::shared_ptr<const PrunedBatch> batch_, torch::Tensor counts_,
+           DecoderContextPtr context_, int64_t beam_size, int64_t cutoff_top_n,
+           double cutoff_prob, bool is_nll, int64_t nbest,
+           float beam_threshold, bool fast_math, bool long_form,
+           c10::optional<DecodeStatsPtr> stats_)
+      : batch(std::move(batch_)), counts(std::move(counts_)),
+        context(std::move(context_)), beam_size(beam_size),
+        cutoff_top_n(cutoff_top_n), cutoff_prob(cutoff_prob), is_nll(is_nll),
+        nbest(nbest), beam_threshold(beam_threshold), fast_math(fast_math),
+        long_form(long_form), stats(std::move(stats_)) {
+    const int64_t batch_size = batch->batch_size();
+    segment_results.resize(batch->segments.size());
+    num_pending.reset(new std::atomic<int64_t>[batch_size]);
+    for (int64_t i = 0; i < batch_size; ++i) {
+      num_pending[i] =
+          batch->segment_offsets[i + 1] - batch->segment_offsets[i];
     }
+    results.resize(batch_size);
   }
-  return std::make_tuple(beams, output_lengths, scores, timesteps);
+
+  size_t size() const { return batch->order.size(); }
+
+  // Search over the `k`-th longest segment.
+  void decode(size_t k) {
+    // so that the ranges are recorded by the profiler of the calling thread
+    at::ThreadLocalStateGuard state_guard(thread_local_state);
+    RECORD_FUNCTION("simple_ctc::search", std::vector<c10::IValue>());
+    const auto &candidates = batch->candidates;
+    const size_t index = batch->order[k];
+    const auto &segment = batch->segments[index];
+    const int64_t i = segment.sequence;
+    const int64_t max_candidates = candidates.log_probs.size(2);
+    const int64_t frame = i * batch->num_frames + segment.begin;
+    const int64_t *labels = get_labels(candidates);
+    const bool *blank_frames = get_blank_frames(candidates);
+    DecoderState state(context->vocabulary, beam_size, cutoff_prob,
+                       cutoff_top_n, context->blank_id, is_nll,
+                       context->scorer.get(), context->delimiter_id,
+                       context->lexicon, beam_threshold, fast_math, long_form);
+    state.enable_timing(stats.has_value());
+    state.next_candidates(
+        candidates.log_probs.data_ptr<float>() + frame * max_candidates,
+        labels == nullptr ? nullptr : labels + frame * max_candidates,
+        counts.data_ptr<int64_t>() + frame, segment.end - segment.begin,
+        max_candidates,
+        blank_frames == nullptr ? nullptr : blank_frames + frame);
+    segment_results[index] = state.decode(nbest);
+    if (stats.has_value()) {
+      stats.value()->add(state.stats());
+    }
+
+    // the last segment of the sequence stitches the results
+    if (--num_pending[i] == 0) {
+      const size_t begin = batch->segment_offsets[i];
+      const size_t end = batch->segment_offsets[i + 1];
+      std::vector<std::vector<std::pair<double, Output>>> parts(
+          std::make_move_iterator(segment_results.begin() + begin),
+          std::make_move_iterator(segment_results.begin() + end));
+      results[i] = stitch_results(parts, batch->bounds[i], nbest);
+    }
+  }
+
+  // Gather the results into Tensors, once all the sequences are decoded.
+  // The missing hypotheses are empty, and their scores are `inf`.
+  DecodeOutputs outputs() const {
+    const int64_t batch_size = results.size();
+    const int64_t max_seq_len = batch->max_seq_len;
+    auto beams = torch::empty({batch_size, nbest, max_seq_len}, torch::kInt32);
+    auto output_lengths = torch::zeros({batch_size, nbest}, torch::kInt32);
+    auto scores = torch::full({batch_size, nbest},
+                              std::numeric_limits<float>::infinity(),
+                              torch::kFloat);
+    auto timesteps =
+        torch::empty({batch_size, nbest, max_seq_len}, torch::kInt32);
+
+    auto outputs_accessor = beams.accessor<int, 3>();
+    auto output_lengths_accessor = output_lengths.accessor<int, 2>();
+    auto scores_accessor = scores.accessor<float, 2>();
+    auto timesteps_accessor = timesteps.accessor<int, 3>();
+
+    for (size_t b = 0; b < results.size(); ++b) {
+      copy_results(results[b], outputs_accessor[b], output_lengths_accessor[b],
+                   scores_accessor[b], timesteps_accessor[b]);
+    }
+    return std::make_tuple(beams, output_lengths, scores, timesteps);
+  }
+
+  // Gather the results into flat Tensors of the tokens and the timesteps of
+  // all the hypotheses, back to back. The ones of the `j`-th hypothesis of
+  // the `i`-th sequence are in `[offsets[i * nbest + j], offsets[i * nbest +
+  // j + 1])`. The missing hypotheses are empty, and their scores are `inf`.
+  DecodeOutputs ragged_outputs() const {
+    const int64_t batch_size = results.size();
+    auto offsets = torch::empty({batch_size * nbest + 1}, torch::kLong);
+    auto scores = torch::full({batch_size, nbest},
+                              std::numeric_limits<float>::infinity(),
+                              torch::kFloat);
+    auto offsets_data = offsets.data_ptr<int64_t>();
+    auto scores_data = scores.data_ptr<float>();
+    offsets_data[0] = 0;
+    for (int64_t b = 0; b < batch_size; ++b) {
+      for (int64_t j = 0; j < nbest; ++j) {
+        const int64_t k = b * nbest + j;
+        int64_t length = 0;
+        if (j < static_cast<int64_t>(results[b].size())) {
+          length = results[b][j].second.tokens.size();
+          scores_data[k] = results[b][j].first;
+        }
+        offsets_data[k + 1] = offsets_data[k] + length;
+      }
+    }
+
+    const int64_t num_tokens = offsets_data[batch_size * nbest];
+    auto tokens = torch::empty({num_tokens}, torch::kInt32);
+    auto timesteps = torch::empty({num_tokens}, torch::kInt32);
+    auto tokens_data = tokens.data_ptr<int>();
+    auto timesteps_data = timesteps.data_ptr<int>();
+    for (int64_t b = 0; b < batch_size; ++b) {
+      for (size_t j = 0; j < results[b].size(); ++j) {
+        const auto &output = results[b][j].second;
+        const int64_t offset = offsets_data[b * nbest + j];
+        std::copy(output.tokens.begin(), output.tokens.end(),
+                  tokens_data + offset);
+        std::copy(output.timesteps.begin(), output.timesteps.end(),
+                  timesteps_data + offset);
+      }
+    }
+    return std::make_tuple(tokens, offsets, scores, timesteps);
+  }
+
+  // Join the labels of the hypotheses into strings, replacing the word
+  // delimiter with `word_separator`. The delimiters at both ends are dropped.
+  std::tuple<std::vector<std::vector<std::string>>,
+             std::vector<std::vector<double>>>
+  transcripts(const std::string &word_separator) const {
+    std::vector<std::vector<std::string>> texts(results.size());
+    std::vector<std::vector<double>> scores(results.size());
+    for (size_t b = 0; b < results.size(); ++b) {
+      for (const auto &result : results[b]) {
+        const auto &tokens = result.second.tokens;
+        texts[b].push_back(join_labels(
+            tokens.data(), tokens.data() + tokens.size(), context->vocabulary,
+            context->delimiter_id, word_separator));
+        scores[b].push_back(result.first);
+      }
+    }
+    return std::make_tuple(std::move(texts), std::move(scores));
+  }
+
+  const std::shared_ptr<const PrunedBatch> batch;
+  const torch::Tensor counts;
+  const DecoderContextPtr context;
+  const int64_t beam_size;
+  const int64_t cutoff_top_n;
+  const double cutoff_prob;
+  const bool is_nll;
+  const int64_t nbest;
+  const float beam_threshold;
+  const bool fast_math;
+  const bool long_form;
+  const c10::optional<DecodeStatsPtr> stats;
+  const at::ThreadLocalState thread_local_state;
+
+  std::vector<std::vector<std::pair<double, Output>>> segment_results;
+  // the number of segments of each sequence not searched yet
+  std::unique_ptr<std::atomic<int64_t>[]> num_pending;
+  std::vector<std::vector<std::pair<double, Output>>> results;
+};
+
+/* Validate the options, and prune the frames of a batch to search over.
+ *
+ * The candidates may be the input itself (see `prune`). With `own_frames`,
+ * they are copied then, so that the caller can reuse the input before the
+ * search is over.
+ */
+std::shared_ptr<BatchJob> make_batch_job(
+    const torch::Tensor &probs, const c10::optional<torch::Tensor> &seq_lens,
+    DecoderContextPtr context, int64_t beam_size, int64_t cutoff_top_n,
+    c10::optional<double> cutoff_prob, bool is_nll, int64_t num_processes,
+    c10::optional<double> blank_skip_threshold, int64_t nbest,
+    c10::optional<double> beam_threshold, bool fast_math, bool long_form,
+    c10::optional<int64_t> segment_min_blank_frames,
+    double segment_blank_threshold, c10::optional<DecodeStatsPtr> stats,
+    bool own_frames = false) {
+  check_search_options(num_processes, beam_size, nbest, beam_threshold);
+  auto batch = std::make_shared<PrunedBatch>(
+      probs, seq_lens, *context, cutoff_top_n, cutoff_prob.value_or(1.1),
+      is_nll, blank_skip_threshold, fast_math, segment_min_blank_frames,
+      segment_blank_threshold, stats.has_value());
+  auto &log_probs = batch->candidates.log_probs;
+  if (own_frames && log_probs.is_alias_of(probs)) {
+    log_probs = log_probs.clone();
+  }
+  if (stats.has_value()) {
+    stats.value()->add_call(batch->batch_size(), batch->segments.size(),
+                            batch->prune_ns);
+  }
+  auto counts = batch->candidates.counts;
+  return std::make_shared<BatchJob>(
+      std::move(batch), std::move(counts), std::move(context), beam_size,
+      cutoff_top_n, cutoff_prob.value_or(1.1), is_nll, nbest,
+      get_beam_threshold(beam_threshold), fast_math, long_form,
+      std::move(stats));
+}
+
+// Decode a batch on the decoder threads, and wait for it.
+std::shared_ptr<BatchJob>
+run_batch(torch::Tensor probs, c10::optional<torch::Tensor> seq_lens,
+          DecoderContextPtr context, int64_t beam_size, int64_t cutoff_top_n,
+          c10::optional<double> cutoff_prob, bool is_nll,
+          int64_t num_processes, c10::optional<double> blank_skip_threshold,
+          int64_t nbest, c10::optional<double> beam_threshold, bool fast_math,
+          bool long_form, c10::optional<int64_t> segment_min_blank_frames,
+          double segment_blank_threshold, c10::optional<DecodeStatsPtr> stats) {
+  auto job = make_batch_job(
+      probs, seq_lens, std::move(context), beam_size, cutoff_top_n,
+      cutoff_prob, is_nll, num_processes, blank_skip_threshold, nbest,
+      beam_threshold, fast_math, long_form, segment_min_blank_frames,
+      segment_blank_threshold, std::move(stats));
+  ThreadPool::get(num_processes).run(job->size(),
+                                     [&](size_t k) { job->decode(k); });
+  return job;
+}
+
+DecodeOutputs
+beam_decode(torch::Tensor probs, c10::optional<torch::Tensor> seq_lens,
+            DecoderContextPtr context, int64_t beam_size,
+            int64_t cutoff_top_n, c10::optional<double> cutoff_prob,
+            bool is_nll, int64_t num_processes,
+            c10::optional<double> blank_skip_threshold, int64_t nbest,
+            c10::optional<double> beam_threshold, bool fast_math,
+            bool long_form, c10::optional<int64_t> segment_min_blank_frames,
+            double segment_blank_threshold,
+            c10::optional<DecodeStatsPtr> stats) {
+  return run_batch(probs, seq_lens, std::move(context), beam_size,
+                   cutoff_top_n, cutoff_prob, is_nll, num_processes,
+                   blank_skip_threshold, nbest, beam_threshold, fast_math,
+                   long_form, segment_min_blank_frames,
+                   segment_blank_threshold, std::move(stats))
+      ->outputs();
 }
 
-TORCH_LIBRARY(simple_ctc, m) { m.def("beam_search_decode", &beam_decode); }
+// Same as `beam_decode`, but the hypotheses are returned back to back.
+DecodeOutputs
+beam_decode_ragged(torch::Tensor probs, c10::optional<torch::Tensor> seq_lens,
+                   DecoderContextPtr context, int64_t beam_size,
+                   int64_t cutoff_top_n, c10::optional<double> cutoff_prob,
+                   bool is_nll, int64_t num_processes,
+                   c10::optional<double> blank_skip_threshold, int64_t nbest,
+                   c10::optional<double> beam_threshold, bool fast_math,
+                   bool long_form,
+                   c10::optional<int64_t> segment_min_blank_frames,
+                   double segment_blank_threshold,
+                   c10::optional<DecodeStatsPtr> stats) {
+  return run_batch(probs, seq_lens, std::move(context), beam_size,
+                   cutoff_top_n, cutoff_prob, is_nll, num_processes,
+                   blank_skip_threshold, nbest, beam_threshold, fast_math,
+                   long_form, segment_min_blank_frames,
+                   segment_blank_threshold, std::move(stats))
+      ->ragged_outputs();
+}
+
+// Same as `beam_decode`, but the hypotheses are returned as strings.
+std::tuple<std::vector<std::vector<std::string>>,
+           std::vector<std::vector<double>>>
+beam_decode_text(torch::Tensor probs, c10::optional<torch::Tensor> seq_lens,
+                 DecoderContextPtr context, int64_t beam_size,
+                 int64_t cutoff_top_n, c10::optional<double> cutoff_prob,
+                 bool is_nll, int64_t num_processes,
+                 c10::optional<double> blank_skip_threshold, int64_t nbest,
+                 c10::optional<double> beam_threshold, bool fast_math,
+                 bool long_form,
+                 c10::optional<int64_t> segment_min_blank_frames,
+                 double segment_blank_threshold,
+                 c10::optional<DecodeStatsPtr> stats,
+                 std::string word_separator) {
+  return run_batch(probs, seq_lens, std::move(context), beam_size,
+                   cutoff_top_n, cutoff_prob, is_nll, num_processes,
+                   blank_skip_threshold, nbest, beam_threshold, fast_math,
+                   long_form, segment_min_blank_frames,
+                   segment_blank_threshold, std::move(stats))
+      ->transcripts(word_separator);
+}
+
+/* Decode a batch with several configurations, in the format of
+ * `beam_decode_ragged`, one per configuration.
+ *
+ * The `i`-th configuration is given by the `i`-th item of each list. The
+ * frames are pruned once, at the loosest of the cutoffs, and the
+ * configurations with tighter cutoffs only search over fewer of the
+ * candidates. The segments of all the configurations are searched on the
+ * decoder threads together, longest first. A `cutoff_prob` of `1.0` or
+ * more, and a `beam_threshold` of `inf`, disable them. The contexts can
+ * differ in the language model weights, but not in the labels.
+ */
+std::vector<DecodeOutputs>
+beam_decode_sweep(torch::Tensor probs, c10::optional<torch::Tensor> seq_lens,
+                  std::vector<DecoderContextPtr> contexts,
+                  std::vector<int64_t> beam_sizes,
+                  std::vector<int64_t> cutoff_top_ns,
+                  std::vector<double> cutoff_probs, bool is_nll,
+                  int64_t num_processes,
+                  c10::optional<double> blank_skip_threshold,
+                  std::vector<int64_t> nbests,
+                  std::vector<double> beam_thresholds, bool fast_math,
+                  bool long_form,
+                  c10::optional<int64_t> segment_min_blank_frames,
+                  double segment_blank_threshold,
+                  c10::optional<DecodeStatsPtr> stats) {
+  const size_t num_configs = contexts.size();
+  TORCH_CHECK(num_configs > 0, "At least one configuration is required.");
+  TORCH_CHECK(beam_sizes.size() == num_configs &&
+                  cutoff_top_ns.size() == num_configs &&
+                  cutoff_probs.size() == num_configs &&
+                  nbests.size() == num_configs &&
+                  beam_thresholds.size() == num_configs,
+              "The lists of the options have to be of the same length.");
+  int64_t max_top_n = cutoff_top_ns[0];
+  double max_prob = cutoff_probs[0];
+  for (size_t c = 0; c < num_configs; ++c) {
+    TORCH_CHECK(contexts[c]->vocabulary == contexts[0]->vocabulary &&
+                    contexts[c]->blank_id == contexts[0]->blank_id,
+                "The contexts have to have the same labels and blank.");
+    check_search_options(num_processes, beam_sizes[c], nbests[c],
+                         beam_thresholds[c]);
+    max_top_n = std::max(max_top_n, cutoff_top_ns[c]);
+    max_prob = std::max(max_prob, cutoff_probs[c]);
+  }
+  // The candidates are only sorted and their cumulative probabilities kept
+  // if a configuration has tighter cutoffs than the loosest ones.
+  const int64_t num_labels = contexts[0]->num_labels();
+  bool keep_cum_probs = false;
+  for (size_t c = 0; c < num_configs; ++c) {
+    keep_cum_probs |=
+        std::min(cutoff_top_ns[c], num_labels) <
+            std::min(max_top_n, num_labels) ||
+        (cutoff_probs[c] < 1.0 && cutoff_probs[c] < max_prob);
+  }
+
+  auto batch = std::make_shared<const PrunedBatch>(
+      probs, seq_lens, *contexts[0], max_top_n, max_prob, is_nll,
+      blank_skip_threshold, fast_math, segment_min_blank_frames,
+      segment_blank_threshold, stats.has_value(), keep_cum_probs);
+  if (stats.has_value()) {
+    stats.value()->add_call(batch->batch_size(), batch->segments.size(),
+                            batch->prune_ns);
+  }
+  std::vector<std::shared_ptr<BatchJob>> jobs;
+  for (size_t c = 0; c < num_configs; ++c) {
+    auto counts = keep_cum_probs
+                      ? batch->get_counts(cutoff_top_ns[c], cutoff_probs[c])
+                      : batch->candidates.counts;
+    jobs.push_back(std::make_shared<BatchJob>(
+        batch, std::move(counts), contexts[c], beam_sizes[c],
+        cutoff_top_ns[c], cutoff_probs[c], is_nll, nbests[c],
+        get_beam_threshold(beam_thresholds[c]), fast_math, long_form,
+        stats));
+  }
+
+  // the `k`-th longest segments of all the configurations, then the next
+  const size_t num_segments = batch->order.size();
+  ThreadPool::get(num_processes)
+      .run(num_segments * num_configs, [&](size_t item) {
+        jobs[item % num_configs]->decode(item / num_configs);
+      });
+  std::vector<DecodeOutputs> outputs;
+  for (const auto &job : jobs) {
+    outputs.push_back(job->ragged_outputs());
+  }
+  return outputs;
+}
+
+/* Best path decoding, in the same format as `beam_decode_ragged` with
+ * `nbest=1` (`greedy_decode_ragged`).
+ *
+ * The label of the highest probability is taken in each time step, then
+ * repeats are collapsed and blanks removed. The argmax over the labels,
+ * which reads the whole input, is vectorized and parallelized by ATen, and
+ * the collapse is a single pass over the `[batch, num_timesteps]` labels.
+ * The score is the negative log probability of the path, and the timestep
+ * of a token is the one of its highest probability, as in the beam search.
+ */
+struct BestPath {
+  // Shape: `[batch]`. Int32.
+  torch::Tensor seq_lens;
+  // The highest probability of each time step. Shape: `[batch,
+  // num_timesteps]`. Float.
+  torch::Tensor values;
+  // The label of it. Shape: `[batch, num_timesteps]`. Int64.
+  torch::Tensor labels;
+  // The negative log probabilities of the paths. Shape: `[batch, 1]`. Float.
+  torch::Tensor scores;
+};
+
+// Validate the input, and take the label of the highest probability in each
+// time step. Only this reads the input.
+BestPath find_best_path(const torch::Tensor &probs,
+                        const c10::optional<torch::Tensor> &seq_lens,
+                        const DecoderContext &context, bool is_nll) {
+  check_probs(probs, context.num_labels());
+  BestPath path;
+  path.seq_lens = get_seq_lens(probs, seq_lens);
+  const int64_t max_seq_len = probs.size(1);
+
+  std::tie(path.values, path.labels) = probs.max(-1);
+  path.values = path.values.to(torch::kFloat).contiguous();
+  path.labels = path.labels.contiguous();
+
+  const auto valid =
+      torch::arange(max_seq_len, torch::kInt).lt(path.seq_lens.unsqueeze(1));
+  const auto log_values =
+      is_nll ? path.values.to(torch::kDouble)
+             : (path.values.to(torch::kDouble) + NUM_FLT_MIN).log();
+  path.scores =
+      log_values.masked_fill(valid.logical_not(), 0).sum(-1, true).neg().to(
+          torch::kFloat);
+  return path;
+}
+
+// Collapse the repeats and remove the blanks of the best paths, in the same
+// format as `beam_decode_ragged` with `nbest=1`.
+DecodeOutputs collapse_best_path(const BestPath &path, int64_t blank_id) {
+  const int64_t batch_size = path.labels.size(0);
+  const int64_t max_seq_len = path.labels.size(1);
+  const int *seq_lens_data = path.seq_lens.data_ptr<int>();
+  const float *values_data = path.values.data_ptr<float>();
+  const int64_t *labels_data = path.labels.data_ptr<int64_t>();
+  auto offsets = torch::empty({batch_size + 1}, torch::kLong);
+  auto offsets_data = offsets.data_ptr<int64_t>();
+  std::vector<int> tokens, timesteps;
+  offsets_data[0] = 0;
+  for (int64_t b = 0; b < batch_size; ++b) {
+    const int64_t *labels_b = labels_data + b * max_seq_len;
+    const float *values_b = values_data + b * max_seq_len;
+    int64_t prev = -1;
+    float peak = 0;
+    for (int t = 0; t < seq_lens_data[b]; ++t) {
+      const int64_t label = labels_b[t];
+      if (label != prev) {
+        if (label != blank_id) {
+          tokens.push_back(label);
+          timesteps.push_back(t);
+          peak = values_b[t];
+        }
+        prev = label;
+      } else if (label != blank_id && values_b[t] > peak) {
+        timesteps.back() = t;
+        peak = values_b[t];
+      }
+    }
+    offsets_data[b + 1] = tokens.size();
+  }
+  const int64_t num_tokens = tokens.size();
+  auto tokens_ = torch::empty({num_tokens}, torch::kInt32);
+  auto timesteps_ = torch::empty({num_tokens}, torch::kInt32);
+  std::copy(tokens.begin(), tokens.end(), tokens_.data_ptr<int>());
+  std::copy(timesteps.begin(), timesteps.end(), timesteps_.data_ptr<int>());
+  return std::make_tuple(tokens_, offsets, path.scores, timesteps_);
+}
+
+DecodeOutputs greedy_decode_ragged(torch::Tensor probs,
+                                   c10::optional<torch::Tensor> seq_lens,
+                                   DecoderContextPtr context, bool is_nll) {
+  return collapse_best_path(find_best_path(probs, seq_lens, *context, is_nll),
+                            context->blank_id);
+}
+
+// The outputs of `greedy_decode_ragged` in the format of `beam_decode` with
+// `nbest=1`.
+DecodeOutputs to_dense_outputs(const DecodeOutputs &ragged,
+                               int64_t max_seq_len) {
+  torch::Tensor tokens, offsets, scores, timesteps;
+  std::tie(tokens, offsets, scores, timesteps) = ragged;
+  const int64_t batch_size = scores.size(0);
+  auto beams = torch::empty({batch_size, 1, max_seq_len}, torch::kInt32);
+  auto lengths = torch::empty({batch_size, 1}, torch::kInt32);
+  auto timesteps_ = torch::empty({batch_size, 1, max_seq_len}, torch::kInt32);
+  const int64_t *offsets_data = offsets.data_ptr<int64_t>();
+  const int *tokens_data = tokens.data_ptr<int>();
+  const int *timesteps_data = timesteps.data_ptr<int>();
+  for (int64_t b = 0; b < batch_size; ++b) {
+    const int64_t begin = offsets_data[b], end = offsets_data[b + 1];
+    lengths.data_ptr<int>()[b] = end - begin;
+    std::copy(tokens_data + begin, tokens_data + end,
+              beams.data_ptr<int>() + b * max_seq_len);
+    std::copy(timesteps_data + begin, timesteps_data + end,
+              timesteps_.data_ptr<int>() + b * max_seq_len);
+  }
+  return std::make_tuple(beams, lengths, scores, timesteps_);
+}
+
+// Same as `greedy_decode_ragged`, in the same format as `beam_decode` with
+// `nbest=1`.
+DecodeOutputs greedy_decode(torch::Tensor probs,
+                            c10::optional<torch::Tensor> seq_lens,
+                            DecoderContextPtr context, bool is_nll) {
+  return to_dense_outputs(
+      greedy_decode_ragged(probs, seq_lens, std::move(context), is_nll),
+      probs.size(1));
+}
+
+// Same as `greedy_decode_ragged`, but the hypotheses are returned as strings,
+// as `beam_decode_text` does.
+std::tuple<std::vector<std::vector<std::string>>,
+           std::vector<std::vector<double>>>
+greedy_decode_text(torch::Tensor probs, c10::optional<torch::Tensor> seq_lens,
+                   DecoderContextPtr context, bool is_nll,
+                   std::string word_separator) {
+  torch::Tensor tokens, offsets, scores, timesteps;
+  std::tie(tokens, offsets, scores, timesteps) =
+      greedy_decode_ragged(probs, seq_lens, context, is_nll);
+  const int64_t batch_size = probs.size(0);
+  const int64_t *offsets_data = offsets.data_ptr<int64_t>();
+  const int *tokens_data = tokens.data_ptr<int>();
+  std::vector<std::vector<std::string>> texts(batch_size);
+  std::vector<std::vector<double>> scores_(batch_size);
+  for (int64_t b = 0; b < batch_size; ++b) {
+    texts[b].push_back(join_labels(
+        tokens_data + offsets_data[b], tokens_data + offsets_data[b + 1],
+        context->vocabulary, context->delimiter_id, word_separator));
+    scores_[b].push_back(scores.data_ptr<float>()[b]);
+  }
+  return std::make_tuple(std::move(texts), std::move(scores_));
+}
+
+/* Counting semaphore exposed to TorchScript.
+ *
+ * Bounds the number of asynchronous decodes in flight: a new one waits
+ * until one of them completes. Only the initial count is serialized.
+ */
+struct Semaphore : torch::CustomClassHolder {
+  explicit Semaphore(int64_t value) : value(value), count(value) {
+    TORCH_CHECK(value > 0, "The value of a semaphore has to be positive.");
+  }
+
+  void acquire() {
+    std::unique_lock<std::mutex> lock(mutex);
+    cond.wait(lock, [this] { return count > 0; });
+    --count;
+  }
+
+  void release() {
+    {
+      std::lock_guard<std::mutex> lock(mutex);
+      ++count;
+    }
+    cond.notify_one();
+  }
+
+  int64_t available() {
+    std::lock_guard<std::mutex> lock(mutex);
+    return count;
+  }
+
+  const int64_t value;
+
+private:
+  std::mutex mutex;
+  std::condition_variable cond;
+  int64_t count;
+};
+
+using SemaphorePtr = c10::intrusive_ptr<Semaphore>;
+
+/* Run `decode(k)` for `k` in `[0, num_items)` on the decoder threads, and
+ * return a Future completed with `outputs()` once all of them have finished.
+ *
+ * When `in_flight` is given, one count is held until then, so the call
+ * blocks while the count is zero.
+ */
+c10::intrusive_ptr<c10::ivalue::Future>
+run_decode_async(int64_t num_processes, size_t num_items,
+                 std::function<void(size_t)> decode,
+                 std::function<DecodeOutputs()> outputs,
+                 c10::optional<SemaphorePtr> in_flight) {
+  auto future = c10::make_intrusive<c10::ivalue::Future>(
+      c10::getTypePtr<DecodeOutputs>());
+
+  if (in_flight.has_value()) {
+    in_flight.value()->acquire();
+  }
+  ThreadPool::get(num_processes)
+      .run_async(
+          num_items, std::move(decode),
+          [outputs, future, in_flight](std::exception_ptr error) {
+            c10::IValue result;
+            if (!error) {
+              try {
+                result = outputs();
+              } catch (...) {
+                error = std::current_exception();
+              }
+            }
+            // released first, so that a callback of the future can start
+            // another decode
+            if (in_flight.has_value()) {
+              in_flight.value()->release();
+            }
+            if (error) {
+              future->setError(error);
+            } else {
+              future->markCompleted(std::move(result));
+            }
+          });
+  return future;
+}
+
+/* Same as `beam_decode`, but returns a Future of the outputs without
+ * waiting for the search.
+ *
+ * The inputs are validated and pruned in the calling thread, then the search
+ * runs on the decoder threads. When `in_flight` is given, one count is held
+ * until the search completes, so the call blocks while the count is zero.
+ */
+c10::intrusive_ptr<c10::ivalue::Future>
+beam_decode_async(torch::Tensor probs, c10::optional<torch::Tensor> seq_lens,
+                  DecoderContextPtr context, int64_t beam_size,
+                  int64_t cutoff_top_n, c10::optional<double> cutoff_prob,
+                  bool is_nll, int64_t num_processes,
+                  c10::optional<double> blank_skip_threshold, int64_t nbest,
+                  c10::optional<double> beam_threshold, bool fast_math,
+                  bool long_form,
+                  c10::optional<int64_t> segment_min_blank_frames,
+                  double segment_blank_threshold,
+                  c10::optional<DecodeStatsPtr> stats,
+                  c10::optional<SemaphorePtr> in_flight) {
+  auto job = make_batch_job(
+      probs, seq_lens, std::move(context), beam_size, cutoff_top_n,
+      cutoff_prob, is_nll, num_processes, blank_skip_threshold, nbest,
+      beam_threshold, fast_math, long_form, segment_min_blank_frames,
+      segment_blank_threshold, std::move(stats), true);
+  return run_decode_async(
+      num_processes, job->size(), [job](size_t k) { job->decode(k); },
+      [job] { return job->outputs(); }, std::move(in_flight));
+}
+
+/* Same as `greedy_decode`, but returns a Future of the outputs without
+ * waiting for the collapse of the paths, which runs on one of the decoder
+ * threads, as `beam_decode_async` does. The argmax over the labels is taken
+ * in the calling thread, as the pruning of `beam_decode_async` is, so the
+ * input can be reused once this returns.
+ */
+c10::intrusive_ptr<c10::ivalue::Future>
+greedy_decode_async(torch::Tensor probs, c10::optional<torch::Tensor> seq_lens,
+                    DecoderContextPtr context, bool is_nll,
+                    int64_t num_processes,
+                    c10::optional<SemaphorePtr> in_flight) {
+  TORCH_CHECK(num_processes > 0, "`num_processes` has to be positive.");
+  auto path = std::make_shared<const BestPath>(
+      find_best_path(probs, seq_lens, *context, is_nll));
+  const int64_t blank_id = context->blank_id;
+  const int64_t max_seq_len = probs.size(1);
+  auto outputs = std::make_shared<DecodeOutputs>();
+  return run_decode_async(
+      num_processes, 1,
+      [=](size_t) {
+        *outputs = to_dense_outputs(collapse_best_path(*path, blank_id),
+                                    max_seq_len);
+      },
+      [outputs] { return *outputs; }, std::move(in_flight));
+}
+
+// Boxed version of `beam_decode_async`, as the schema of a Future-returning
+// function cannot be inferred.
+void beam_decode_async_boxed(const c10::OperatorHandle &,
+                             torch::jit::Stack *stack) {
+  constexpr size_t num_args = 17;
+  auto args = torch::jit::last(*stack, num_args);
+  auto future = beam_decode_async(
+      args[0].toTensor(), args[1].to<c10::optional<torch::Tensor>>(),
+      args[2].toCustomClass<DecoderContext>(), args[3].toInt(),
+      args[4].toInt(), args[5].to<c10::optional<double>>(), args[6].toBool(),
+      args[7].toInt(), args[8].to<c10::optional<double>>(), args[9].toInt(),
+      args[10].to<c10::optional<double>>(), args[11].toBool(),
+      args[12].toBool(), args[13].to<c10::optional<int64_t>>(),
+      args[14].toDouble(), args[15].to<c10::optional<DecodeStatsPtr>>(),
+      args[16].to<c10::optional<SemaphorePtr>>());
+  torch::jit::drop(*stack, num_args);
+  torch::jit::push(*stack, std::move(future));
+}
+
+// Boxed version of `greedy_decode_async`.
+void greedy_decode_async_boxed(const c10::OperatorHandle &,
+                               torch::jit::Stack *stack) {
+  constexpr size_t num_args = 6;
+  auto args = torch::jit::last(*stack, num_args);
+  auto future = greedy_decode_async(
+      args[0].toTensor(), args[1].to<c10::optional<torch::Tensor>>(),
+      args[2].toCustomClass<DecoderContext>(), args[3].toBool(),
+      args[4].toInt(), args[5].to<c10::optional<SemaphorePtr>>());
+  torch::jit::drop(*stack, num_args);
+  torch::jit::push(*stack, std::move(future));
+}
+
+/* Stateful decoder that processes emissions chunk by chunk.
+ *
+ * Each instance owns its own DecoderState, so any number of sessions can
+ * run concurrently and independently, sharing the context. Only the
+ * configuration is serialized; a deserialized instance starts a new session.
+ */
+struct StreamingDecoder : torch::CustomClassHolder {
+  using Config =
+      std::tuple<DecoderContextPtr, int64_t, int64_t, c10::optional<double>,
+                 bool, c10::optional<double>, c10::optional<double>, bool,
+                 bool>;
+
+  StreamingDecoder(DecoderContextPtr context, int64_t beam_size,
+                   int64_t cutoff_top_n, c10::optional<double> cutoff_prob,
+                   bool is_nll, c10::optional<double> blank_skip_threshold,
+                   c10::optional<double> beam_threshold, bool fast_math,
+                   bool long_form)
+      : context(std::move(context)), beam_size(beam_size),
+        cutoff_top_n(cutoff_top_n), cutoff_prob(cutoff_prob), is_nll(is_nll),
+        blank_skip_threshold(blank_skip_threshold),
+        beam_threshold(beam_threshold), fast_math(fast_math),
+        long_form(long_form) {
+    TORCH_CHECK(beam_size > 0, "`beam_size` has to be positive.");
+    check_blank_skip_threshold(this->blank_skip_threshold);
+    check_beam_threshold(this->beam_threshold);
+    reset();
+  }
+
+  // Discard the current session and start a new one.
+  void reset() {
+    std::lock_guard<std::mutex> lock(mutex);
+    num_frames = 0;
+    state.reset(new DecoderState(
+        context->vocabulary, beam_size, cutoff_prob.value_or(1.1),
+        cutoff_top_n, context->blank_id, is_nll, context->scorer.get(),
+        context->delimiter_id, context->lexicon,
+        get_beam_threshold(beam_threshold), fast_math, long_form));
+  }
+
+  // Feed a chunk of emission. Shape: `[num_timesteps, num_labels]`.
+  void next(torch::Tensor probs) {
+    TORCH_CHECK(probs.ndimension() == 2, "`probs` has to be 2D Tensor.");
+    TORCH_CHECK(probs.device().is_cpu(), "`probs` has to be on CPU.");
+    TORCH_CHECK(probs.is_floating_point(),
+                "`probs` has to be floating point Tensor.");
+    TORCH_CHECK(probs.size(1) == context->num_labels(),
+                "The 2nd dimension of `probs` has to match the size of the "
+                "vocabulary.");
+    std::lock_guard<std::mutex> lock(mutex);
+    const auto candidates =
+        prune(probs, cutoff_top_n, cutoff_prob.value_or(1.1), is_nll,
+              context->blank_id, blank_skip_threshold, fast_math);
+    state->next_candidates(candidates.log_probs.data_ptr<float>(),
+                           get_labels(candidates),
+                           candidates.counts.data_ptr<int64_t>(),
+                           probs.size(0), candidates.log_probs.size(1),
+                           get_blank_frames(candidates));
+    num_frames += probs.size(0);
+  }
+
+  // Get the current hypotheses, in the same format as `beam_search_decode`
+  // without the batch dimension.
+  std::tuple<torch::Tensor, torch::Tensor, torch::Tensor, torch::Tensor>
+  decode() {
+    std::vector<std::pair<double, Output>> results;
+    {
+      std::lock_guard<std::mutex> lock(mutex);
+      results = state->decode();
+    }
+    size_t max_len = 0;
+    for (auto &result : results) {
+      max_len = std::max(max_len, result.second.tokens.size());
+    }
+    auto beams = torch::empty({beam_size, int64_t(max_len)}, torch::kInt32);
+    auto lengths = torch::zeros({beam_size}, torch::kInt32);
+    auto scores = torch::empty({beam_size}, torch::kFloat);
+    auto timesteps =
+        torch::empty({beam_size, int64_t(max_len)}, torch::kInt32);
+    copy_results(results, beams.accessor<int, 2>(), lengths.accessor<int, 1>(),
+                 scores.accessor<float, 1>(), timesteps.accessor<int, 2>());
+    return std::make_tuple(beams, lengths, scores, timesteps);
+  }
+
+  // The statistics of the current session.
+  c10::Dict<std::string, int64_t> get_stats() {
+    DecodeStats stats;
+    {
+      std::lock_guard<std::mutex> lock(mutex);
+      stats = state->stats();
+    }
+    c10::Dict<std::string, int64_t> ret;
+    insert_stats(ret, stats);
+    return ret;
+  }
+
+  // The labels and the timesteps committed in the current session, which all
+  // the hypotheses start with. Empty unless `long_form`.
+  std::tuple<torch::Tensor, torch::Tensor> get_committed() {
+    Output committed;
+    {
+      std::lock_guard<std::mutex> lock(mutex);
+      committed = state->committed_output();
+    }
+    const int64_t size = committed.tokens.size();
+    auto tokens = torch::empty({size}, torch::kInt32);
+    auto timesteps = torch::empty({size}, torch::kInt32);
+    std::copy(committed.tokens.begin(), committed.tokens.end(),
+              tokens.data_ptr<int>());
+    std::copy(committed.timesteps.begin(), committed.timesteps.end(),
+              timesteps.data_ptr<int>());
+    return std::make_tuple(tokens, timesteps);
+  }
+
+  // The number of time steps processed in the current session.
+  int64_t get_num_frames() {
+    std::lock_guard<std::mutex> lock(mutex);
+    return num_frames;
+  }
+
+  Config get_config() const {
+    return std::make_tuple(context, beam_size, cutoff_top_n, cutoff_prob,
+                           is_nll, blank_skip_threshold, beam_threshold,
+                           fast_math, long_form);
+  }
+
+private:
+  const DecoderContextPtr context;
+  const int64_t beam_size;
+  const int64_t cutoff_top_n;
+  const c10::optional<double> cutoff_prob;
+  const bool is_nll;
+  const c10::optional<double> blank_skip_threshold;
+  const c10::optional<double> beam_threshold;
+  const bool fast_math;
+  const bool long_form;
+
+  std::mutex mutex;
+  std::unique_ptr<DecoderState> state;
+  int64_t num_frames;
+};
+
+TORCH_LIBRARY(simple_ctc, m) {
+  m.class_<LanguageModelHolder>("LanguageModel")
+      .def(torch::init<std::string>())
+      .def("save", &LanguageModelHolder::save)
+      .def("score", &LanguageModelHolder::score)
+      .def("order", &LanguageModelHolder::order)
+      .def("vocab_size", &LanguageModelHolder::vocab_size)
+      .def("size", &LanguageModelHolder::size)
+      .def("is_mapped", &LanguageModelHolder::is_mapped)
+      .def_pickle(
+          [](const LanguageModelPtr &self) -> std::string { return self->path; },
+          [](std::string path) {
+            return c10::make_intrusive<LanguageModelHolder>(std::move(path));
+          });
+
+  m.class_<ScoreCacheHolder>("ScoreCache")
+      .def(torch::init<int64_t>())
+      .def("stats", &ScoreCacheHolder::get_stats)
+      .def("clear", &ScoreCacheHolder::clear)
+      .def_pickle(
+          [](const ScoreCachePtr &self) -> int64_t { return self->capacity(); },
+          [](int64_t capacity) {
+            return c10::make_intrusive<ScoreCacheHolder>(capacity);
+          });
+
+  m.class_<LexiconHolder>("Lexicon")
+      .def(torch::init<std::string>())
+      .def("num_words", &LexiconHolder::num_words)
+      .def("num_states", &LexiconHolder::num_states)
+      .def("size", &LexiconHolder::size)
+      .def("is_mapped", &LexiconHolder::is_mapped)
+      .def_pickle(
+          [](const LexiconPtr &self) -> std::string { return self->path; },
+          [](std::string path) {
+            return c10::make_intrusive<LexiconHolder>(std::move(path));
+          });
+
+  m.class_<DecodeStatsHolder>("DecodeStats")
+      .def(torch::init<>())
+      .def("get", &DecodeStatsHolder::get)
+      .def("clear", &DecodeStatsHolder::clear)
+      .def_pickle(
+          [](const DecodeStatsPtr &self) -> bool { return true; },
+          [](bool) { return c10::make_intrusive<DecodeStatsHolder>(); });
+
+  m.class_<DecoderContext>("DecoderContext")
+      .def(torch::init<std::vector<std::string>, int64_t, std::string,
+                       c10::optional<LanguageModelPtr>, double, double,
+                       c10::optional<ScoreCachePtr>,
+                       c10::optional<LexiconPtr>>())
+      .def("num_labels", &DecoderContext::num_labels)
+      .def("labels",
+           [](const DecoderContextPtr &self) { return self->vocabulary; })
+      .def("blank_id",
+           [](const DecoderContextPtr &self) { return self->blank_id; })
+      .def("word_delimiter",
+           [](const DecoderContextPtr &self) { return self->word_delimiter; })
+      .def("alpha", [](const DecoderContextPtr &self) { return self->alpha; })
+      .def("beta", [](const DecoderContextPtr &self) { return self->beta; })
+      .def("language_model",
+           [](const DecoderContextPtr &self) { return self->language_model; })
+      .def("lm_cache",
+           [](const DecoderContextPtr &self) { return self->lm_cache; })
+      .def("lexicon",
+           [](const DecoderContextPtr &self) { return self->lexicon_holder; })
+      .def_pickle(
+          [](const DecoderContextPtr &self) -> DecoderContext::Config {
+            return self->get_config();
+          },
+          [](DecoderContext::Config config) {
+            return c10::make_intrusive<DecoderContext>(
+                std::get<0>(config), std::get<1>(config), std::get<2>(config),
+                std::get<3>(config), std::get<4>(config), std::get<5>(config),
+                std::get<6>(config), std::get<7>(config));
+          });
+
+  m.def("compile_lexicon", &compile_lexicon);
+  m.def("beam_search_decode", &beam_decode);
+  m.def("beam_search_decode_ragged", &beam_decode_ragged);
+  m.def("beam_search_decode_text", &beam_decode_text);
+  m.def("beam_search_decode_sweep", &beam_decode_sweep);
+  m.def("greedy_search_decode", &greedy_decode);
+  m.def("greedy_search_decode_ragged", &greedy_decode_ragged);
+  m.def("greedy_search_decode_text", &greedy_decode_text);
+
+  m.class_<Semaphore>("Semaphore")
+      .def(torch::init<int64_t>())
+      .def("available", &Semaphore::available)
+      .def_pickle(
+          [](const SemaphorePtr &self) -> int64_t { return self->value; },
+          [](int64_t value) { return c10::make_intrusive<Semaphore>(value); });
+  m.def("beam_search_decode_async("
+        "Tensor probs, Tensor? seq_lens, "
+        "__torch__.torch.classes.simple_ctc.DecoderContext context, "
+        "int beam_size, int cutoff_top_n, float? cutoff_prob, bool is_nll, "
+        "int num_processes, float? blank_skip_threshold, int nbest, "
+        "float? beam_threshold, "
+        "bool fast_math, bool long_form, int? segment_min_blank_frames, "
+        "float segment_blank_threshold, "
+        "__torch__.torch.classes.simple_ctc.DecodeStats? stats, "
+        "__torch__.torch.classes.simple_ctc.Semaphore? in_flight"
+        ") -> Future((Tensor, Tensor, Tensor, Tensor))",
+        torch::CppFunction::makeFromBoxedFunction<&beam_decode_async_boxed>());
+  m.def("greedy_search_decode_async("
+        "Tensor probs, Tensor? seq_lens, "
+        "__torch__.torch.classes.simple_ctc.DecoderContext context, "
+        "bool is_nll, int num_processes, "
+        "__torch__.torch.classes.simple_ctc.Semaphore? in_flight"
+        ") -> Future((Tensor, Tensor, Tensor, Tensor))",
+        torch::CppFunction::makeFromBoxedFunction<&greedy_decode_async_boxed>());
+
+  m.class_<StreamingDecoder>("StreamingDecoder")
+      .def(torch::init<DecoderContextPtr, int64_t, int64_t,
+                       c10::optional<double>, bool, c10::optional<double>,
+                       c10::optional<double>, bool, bool>())
+      .def("next", &StreamingDecoder::next)
+      .def("decode", &StreamingDecoder::decode)
+      .def("reset", &StreamingDecoder::reset)
+      .def("num_frames", &StreamingDecoder::get_num_frames)
+      .def("stats", &StreamingDecoder::get_stats)
+      .def("committed", &StreamingDecoder::get_committed)
+      .def_pickle(
+          [](const c10::intrusive_ptr<StreamingDecoder> &self)
+              -> StreamingDecoder::Config { return self->get_config(); },
+          [](StreamingDecoder::Config config) {
+            return c10::make_intrusive<StreamingDecoder>(
+                std::get<0>(config), std::get<1>(config), std::get<2>(config),
+                std::get<3>(config), std::get<4>(config), std::get<5>(config),
+                std::get<6>(config), std::get<7>(config),
+                std::get<8>(config));
+          });
+}
 
 } // namespace
 } // namespace ctcdecode
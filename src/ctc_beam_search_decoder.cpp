@@ -1,127 +1,374 @@
+#include <chrono>
+#include <functional>
+
 #include "ctc_beam_search_decoder.h"
 #include "decoder_utils.h"
 #include "path_trie.h"
 
 namespace ctcdecode {
 
+namespace {
+
+using Clock = std::chrono::steady_clock;
+
+int64_t elapsed_ns(Clock::time_point since, Clock::time_point until) {
+  return std::chrono::duration_cast<std::chrono::nanoseconds>(until - since)
+      .count();
+}
+
+int find_word_delimiter(const std::vector<std::string> &vocabulary,
+                        const std::string &word_delimiter) {
+  auto it = std::find(vocabulary.begin(), vocabulary.end(), word_delimiter);
+  return it == vocabulary.end() ? -1 : std::distance(vocabulary.begin(), it);
+}
+
+} // namespace
+
+DecoderState::DecoderState(const std::vector<std::string> &vocabulary,
+                           size_t beam_size, double cutoff_prob,
+                           size_t cutoff_top_n, size_t blank_id, int log_input,
+                           const Scorer *ext_scorer,
+                           const std::string &word_delimiter,
+                           const Lexicon *lexicon, float beam_threshold,
+                           bool fast_math, bool long_form)
+    : DecoderState(vocabulary, beam_size, cutoff_prob, cutoff_top_n, blank_id,
+                   log_input, ext_scorer,
+                   find_word_delimiter(vocabulary, word_delimiter), lexicon,
+                   beam_threshold, fast_math, long_form) {}
+
 DecoderState::DecoderState(const std::vector<std::string> &vocabulary,
                            size_t beam_size, double cutoff_prob,
-                           size_t cutoff_top_n, size_t blank_id, int log_input)
+                           size_t cutoff_top_n, size_t blank_id, int log_input,
+                           const Scorer *ext_scorer, int word_delimiter_id,
+                           const Lexicon *lexicon, float beam_threshold,
+                           bool fast_math, bool long_form)
     : abs_time_step(0), beam_size(beam_size), cutoff_prob(cutoff_prob),
       cutoff_top_n(cutoff_top_n), blank_id(blank_id), log_input(log_input),
-      vocabulary(vocabulary) {
-  // assign space id
-  auto it = std::find(vocabulary.begin(), vocabulary.end(), " ");
-  // if no space in vocabulary
-  if (it == vocabulary.end()) {
-    space_id = -2;
-  } else {
-    space_id = std::distance(vocabulary.begin(), it);
-  }
+      vocabulary(vocabulary), ext_scorer(ext_scorer),
+      beam_threshold(beam_threshold), long_form(long_form),
+      pending_blank_log_prob(0),
+      num_pending_blank_frames(0), timing_enabled(false), extract_ns(0),
+      root(&trie_context) {
+  // if no space in vocabulary, -2 so that it never matches the character of
+  // the root, -1
+  space_id = word_delimiter_id < 0 ? -2 : word_delimiter_id;
+
+  trie_context.lexicon = lexicon;
+  trie_context.fast_math = fast_math;
 
   // init prefixes' root
   root.score = root.log_prob_b_prev = 0.0;
+  if (ext_scorer != nullptr) {
+    root.lm_state = get_lm_state_id(ext_scorer->language_model().begin_state());
+    root.word_hash = LanguageModel::hash_word("");
+  }
   prefixes.push_back(&root);
 }
 
+int DecoderState::get_lm_state_id(const LanguageModel::State &state) {
+  auto inserted = lm_state_ids.emplace(state, lm_states.size());
+  if (inserted.second) {
+    lm_states.push_back(state);
+  }
+  return inserted.first->second;
+}
+
+void DecoderState::set_lm_context(const PathTrie *prefix, PathTrie *child) {
+  const int c = child->character;
+  if (c == space_id && !prefix->is_empty() && prefix->character != space_id) {
+    // the word is completed
+    const uint32_t word =
+        ext_scorer->language_model().word_id(prefix->word_hash);
+    const uint64_t key =
+        static_cast<uint64_t>(prefix->lm_state) << 32 | word;
+    auto inserted = word_scores.emplace(key, WordScore());
+    auto &word_score = inserted.first->second;
+    if (inserted.second) {
+      LanguageModel::State next_state;
+      word_score.score =
+          ext_scorer->score(lm_states[prefix->lm_state], word, &next_state);
+      word_score.next_state = get_lm_state_id(next_state);
+    }
+    child->lm_score = word_score.score;
+    child->lm_state = word_score.next_state;
+    child->word_hash = LanguageModel::hash_word("");
+  } else {
+    const auto &label = vocabulary[c];
+    child->lm_score = 0;
+    child->lm_state = prefix->lm_state;
+    child->word_hash = c == space_id
+                           ? LanguageModel::hash_word("")
+                           : LanguageModel::hash_word(label.data(), label.size(),
+                                                      prefix->word_hash);
+  }
+}
+
 void DecoderState::next(const std::vector<std::vector<double>> &probs_seq) {
   // prefix search over time
-  size_t num_time_steps = probs_seq.size();
-  for (size_t time_step = 0; time_step < num_time_steps;
-       ++time_step, ++abs_time_step) {
-    auto &prob = probs_seq[time_step];
-
-    float min_cutoff = -NUM_FLT_INF;
-    bool full_beam = false;
-
-    std::vector<std::pair<size_t, float>> log_prob_idx =
-        get_pruned_log_probs(prob, cutoff_prob, cutoff_top_n, log_input);
-    // loop over chars
-    for (size_t index = 0; index < log_prob_idx.size(); index++) {
-      auto c = log_prob_idx[index].first;
-      auto log_prob_c = log_prob_idx[index].second;
-
-      for (size_t i = 0; i < prefixes.size() && i < beam_size; ++i) {
-        auto prefix = prefixes[i];
-        if (full_beam && log_prob_c + prefix->score < min_cutoff) {
-          break;
-        }
-        // blank
-        if (c == blank_id) {
-          prefix->log_prob_b_cur =
-              log_sum_exp(prefix->log_prob_b_cur, log_prob_c + prefix->score);
-          continue;
-        }
-        // repeated character
-        if (static_cast<int>(c) == prefix->character) {
-          prefix->log_prob_nb_cur = log_sum_exp(
-              prefix->log_prob_nb_cur, log_prob_c + prefix->log_prob_nb_prev);
+  for (auto &prob : probs_seq) {
+    next_frame(
+        get_pruned_log_probs(prob, cutoff_prob, cutoff_top_n, log_input));
+  }
+}
+
+void DecoderState::next_candidates(const float *log_probs,
+                                   const int64_t *labels,
+                                   const int64_t *num_candidates,
+                                   size_t num_time_steps,
+                                   size_t max_candidates,
+                                   const bool *blank_frames) {
+  std::vector<std::pair<size_t, float>> log_prob_idx;
+  log_prob_idx.reserve(max_candidates);
+  for (size_t t = 0; t < num_time_steps; ++t) {
+    const size_t offset = t * max_candidates;
+    const int64_t first = labels == nullptr ? 0 : labels[offset];
+    if (blank_frames != nullptr && blank_frames[t] && num_candidates[t] > 0 &&
+        static_cast<size_t>(first) == blank_id) {
+      // No prefix gains a meaningful probability by extension, so only the
+      // blank probabilities are updated, once for the whole run.
+      pending_blank_log_prob += log_probs[offset];
+      ++num_pending_blank_frames;
+      continue;
+    }
+    log_prob_idx.clear();
+    for (int64_t i = 0; i < num_candidates[t]; ++i) {
+      log_prob_idx.emplace_back(labels == nullptr ? i : labels[offset + i],
+                                log_probs[offset + i]);
+    }
+    next_frame(log_prob_idx);
+  }
+  flush_blank_frames();
+}
+
+void DecoderState::next_frame(
+    const std::vector<std::pair<size_t, float>> &log_prob_idx) {
+  flush_blank_frames();
+
+  Clock::time_point expand_start;
+  if (timing_enabled) {
+    expand_start = Clock::now();
+  }
+  size_t num_expanded = 0;
+  const bool fast_math = trie_context.fast_math;
+
+  // With a beam threshold, the prefixes are sorted by score, so the
+  // extensions of a label can stop at the first prefix which falls below
+  // the threshold relative to the best extension.
+  const bool prune_by_score = beam_threshold < NUM_FLT_INF;
+  float min_cutoff = -NUM_FLT_INF;
+  if (prune_by_score) {
+    float max_log_prob = -NUM_FLT_INF;
+    for (const auto &candidate : log_prob_idx) {
+      max_log_prob = std::max(max_log_prob, candidate.second);
+    }
+    min_cutoff = prefixes.front()->score + max_log_prob - beam_threshold;
+  }
+
+  // The prefixes extended in this time step are appended to `prefixes`,
+  // after the ones from the previous time step.
+  const size_t num_prefixes = prefixes.size();
+
+  // loop over chars
+  for (size_t index = 0; index < log_prob_idx.size(); index++) {
+    auto c = log_prob_idx[index].first;
+    auto log_prob_c = log_prob_idx[index].second;
+
+    for (size_t i = 0; i < num_prefixes; ++i) {
+      auto prefix = prefixes[i];
+      if (log_prob_c + prefix->score < min_cutoff) {
+        break;
+      }
+      // blank
+      if (c == blank_id) {
+        prefix->log_prob_b_cur =
+            log_sum_exp(prefix->log_prob_b_cur, log_prob_c + prefix->score,
+                        fast_math);
+        continue;
+      }
+      // repeated character
+      if (static_cast<int>(c) == prefix->character) {
+        prefix->log_prob_nb_cur =
+            log_sum_exp(prefix->log_prob_nb_cur,
+                        log_prob_c + prefix->log_prob_nb_prev, fast_math);
+      }
+      // get new prefix
+      ++num_expanded;
+      bool activated;
+      auto prefix_new =
+          prefix->get_path_trie(c, abs_time_step, log_prob_c, &activated);
+
+      if (prefix_new != nullptr) {
+        if (activated) {
+          prefixes.push_back(prefix_new);
         }
-        // get new prefix
-        auto prefix_new = prefix->get_path_trie(c, abs_time_step, log_prob_c);
+        float log_p = -NUM_FLT_INF;
 
-        if (prefix_new != nullptr) {
-          float log_p = -NUM_FLT_INF;
+        if (static_cast<int>(c) == prefix->character &&
+            prefix->log_prob_b_prev > -NUM_FLT_INF) {
+          log_p = log_prob_c + prefix->log_prob_b_prev;
+        } else if (static_cast<int>(c) != prefix->character) {
+          log_p = log_prob_c + prefix->score;
+        }
 
-          if (static_cast<int>(c) == prefix->character &&
-              prefix->log_prob_b_prev > -NUM_FLT_INF) {
-            log_p = log_prob_c + prefix->log_prob_b_prev;
-          } else if (static_cast<int>(c) != prefix->character) {
-            log_p = log_prob_c + prefix->score;
+        // language model scoring. The context of a node only depends on its
+        // parent, so it is computed once when the node is created, and reused
+        // while the node stays in the trie.
+        if (ext_scorer != nullptr) {
+          if (prefix_new->lm_state < 0) {
+            set_lm_context(prefix, prefix_new);
           }
-
-          prefix_new->log_prob_nb_cur =
-              log_sum_exp(prefix_new->log_prob_nb_cur, log_p);
+          log_p += prefix_new->lm_score;
         }
-      } // end of loop over prefix
-    }   // end of loop over vocabulary
-
-    prefixes.clear();
-    // update log probs
-    root.iterate_to_vec(prefixes);
-
-    // only preserve top beam_size prefixes
-    if (prefixes.size() >= beam_size) {
-      std::nth_element(prefixes.begin(), prefixes.begin() + beam_size,
-                       prefixes.end(), prefix_compare);
-      for (size_t i = beam_size; i < prefixes.size(); ++i) {
-        prefixes[i]->remove();
+
+        prefix_new->log_prob_nb_cur =
+            log_sum_exp(prefix_new->log_prob_nb_cur, log_p, fast_math);
       }
+    } // end of loop over prefix
+  }   // end of loop over vocabulary
+
+  Clock::time_point select_start;
+  if (timing_enabled) {
+    select_start = Clock::now();
+    counters.expand_ns += elapsed_ns(expand_start, select_start);
+  }
+
+  // update log probs. Only the prefixes alive in this time step are
+  // visited, so the cost is bounded by the beam, not by the size of the trie.
+  for (auto prefix : prefixes) {
+    prefix->update_score();
+  }
+
+  // only preserve the prefixes within the threshold from the best one
+  if (prune_by_score) {
+    float max_score = -NUM_FLT_INF;
+    for (auto prefix : prefixes) {
+      max_score = std::max(max_score, prefix->score);
+    }
+    const float threshold = max_score - beam_threshold;
+    auto end = std::partition(
+        prefixes.begin(), prefixes.end(),
+        [threshold](const PathTrie *prefix) { return prefix->score >= threshold; });
+    for (auto it = end; it != prefixes.end(); ++it) {
+      (*it)->remove();
+    }
+    prefixes.erase(end, prefixes.end());
+  }
 
-      prefixes.resize(beam_size);
+  // only preserve top beam_size prefixes
+  if (prefixes.size() >= beam_size) {
+    std::nth_element(prefixes.begin(), prefixes.begin() + beam_size,
+                     prefixes.end(), prefix_compare);
+    for (size_t i = beam_size; i < prefixes.size(); ++i) {
+      prefixes[i]->remove();
     }
-  } // end of loop over time
+
+    prefixes.resize(beam_size);
+  }
+  if (prune_by_score) {
+    std::sort(prefixes.begin(), prefixes.end(), prefix_compare);
+  }
+
+  // release the path which no beam can diverge from anymore
+  if (long_form) {
+    counters.tokens_committed +=
+        root.commit_common_prefix(committed.tokens, committed.timesteps);
+  }
+
+  if (timing_enabled) {
+    counters.select_ns += elapsed_ns(select_start, Clock::now());
+  }
+  ++counters.frames;
+  counters.candidates += log_prob_idx.size();
+  counters.prefixes_expanded += num_expanded;
+  ++abs_time_step;
+}
+
+void DecoderState::flush_blank_frames() {
+  if (num_pending_blank_frames == 0) {
+    return;
+  }
+  // Every path ends with blank afterwards, so the next label starts a new
+  // token even if it repeats the last label of the prefix.
+  for (auto prefix : prefixes) {
+    prefix->log_prob_b_cur = prefix->score + pending_blank_log_prob;
+    prefix->log_prob_nb_cur = -NUM_FLT_INF;
+    prefix->update_score();
+  }
+  abs_time_step += num_pending_blank_frames;
+  counters.frames += num_pending_blank_frames;
+  counters.frames_skipped += num_pending_blank_frames;
+  pending_blank_log_prob = 0;
+  num_pending_blank_frames = 0;
 }
 
 std::vector<std::pair<double, Output>> DecoderState::decode() const {
+  return decode(beam_size);
+}
+
+std::vector<std::pair<double, Output>>
+DecoderState::decode(size_t num_results) const {
+  Clock::time_point extract_start;
+  if (timing_enabled) {
+    extract_start = Clock::now();
+  }
   std::vector<PathTrie *> prefixes_copy = prefixes;
   std::unordered_map<const PathTrie *, float> scores;
   for (PathTrie *prefix : prefixes_copy) {
     scores[prefix] = prefix->score;
   }
 
+  // score the last word of each prefix that doesn't end with space
+  if (ext_scorer != nullptr) {
+    for (PathTrie *prefix : prefixes_copy) {
+      if (!prefix->is_empty() && prefix->character != space_id) {
+        const auto &lm = ext_scorer->language_model();
+        scores[prefix] += ext_scorer->score(lm_states[prefix->lm_state],
+                                            lm.word_id(prefix->word_hash));
+      }
+    }
+  }
+
   using namespace std::placeholders;
   size_t num_prefixes = std::min(prefixes_copy.size(), beam_size);
-  std::sort(prefixes_copy.begin(), prefixes_copy.begin() + num_prefixes,
-            std::bind(prefix_compare_external_scores, _1, _2, scores));
+  num_results = std::min(num_results, num_prefixes);
+  std::partial_sort(prefixes_copy.begin(), prefixes_copy.begin() + num_results,
+                    prefixes_copy.begin() + num_prefixes,
+                    std::bind(prefix_compare_external_scores, _1, _2, scores));
 
   // compute aproximate ctc score as the return score, without affecting the
   // return order of decoding result. To delete when decoder gets stable.
-  for (size_t i = 0; i < beam_size && i < prefixes_copy.size(); ++i) {
+  for (size_t i = 0; i < num_results; ++i) {
     double approx_ctc = scores[prefixes_copy[i]];
     prefixes_copy[i]->approx_ctc = approx_ctc;
   }
 
-  return get_beam_search_result(prefixes_copy, beam_size);
+  auto results = get_beam_search_result(prefixes_copy, num_results, &committed);
+  if (timing_enabled) {
+    extract_ns += elapsed_ns(extract_start, Clock::now());
+  }
+  return results;
+}
+
+DecodeStats DecoderState::stats() const {
+  const auto &pool = trie_context.pool;
+  DecodeStats stats = counters;
+  stats.nodes_allocated = pool.num_allocated();
+  stats.nodes_freed = pool.num_released();
+  stats.peak_nodes = pool.peak_live();
+  stats.extract_ns = extract_ns;
+  return stats;
 }
 
 std::vector<std::pair<double, Output>>
 ctc_beam_search_decoder(const std::vector<std::vector<double>> &probs_seq,
                         const std::vector<std::string> &vocabulary,
                         size_t beam_size, double cutoff_prob,
-                        size_t cutoff_top_n, size_t blank_id, int log_input) {
+                        size_t cutoff_top_n, size_t blank_id, int log_input,
+                        const Scorer *ext_scorer,
+                        const std::string &word_delimiter,
+                        const Lexicon *lexicon) {
   DecoderState state(vocabulary, beam_size, cutoff_prob, cutoff_top_n, blank_id,
-                     log_input);
+                     log_input, ext_scorer, word_delimiter, lexicon);
   state.next(probs_seq);
   return state.decode();
 }
@@ -1,11 +1,15 @@
 #pragma once
 
+#include <cstdint>
 #include <string>
+#include <unordered_map>
 #include <utility>
 #include <vector>
 
+#include "decoder_utils.h"
 #include "output.h"
 #include "path_trie.h"
+#include "scorer.h"
 
 namespace ctcdecode {
 
@@ -18,6 +22,11 @@ namespace ctcdecode {
  *     beam_size: The width of beam search.
  *     cutoff_prob: Cutoff probability for pruning.
  *     cutoff_top_n: Cutoff number for pruning.
+ *     blank_id: The index of the CTC blank label.
+ *     log_input: Whether the probabilities are given in log scale.
+ *     ext_scorer: External scorer for the language model fusion, or nullptr.
+ *     word_delimiter: The label which separates words.
+ *     lexicon: The words to constrain the search to, or nullptr.
  * Return:
  *     A vector that each element is a pair of score  and decoding result,
  *     in desending order.
@@ -28,7 +37,35 @@ ctc_beam_search_decoder(const std::vector<std::vector<double>> &probs_seq,
                         const std::vector<std::string> &vocabulary,
                         size_t beam_size, double cutoff_prob = 1.0,
                         size_t cutoff_top_n = 40, size_t blank_id = 0,
-                        int log_input = 0);
+                        int log_input = 0, const Scorer *ext_scorer = nullptr,
+                        const std::string &word_delimiter = " ",
+                        const Lexicon *lexicon = nullptr);
+
+/* CTC Beam Search Decoder, reading probabilities from a strided buffer
+
+ * Parameters:
+ *     probs: Pointer to the probability of the first label at the first
+ *            time step.
+ *     num_time_steps: The number of time steps to decode.
+ *     time_stride: The distance between two consecutive time steps,
+ *                  in number of elements.
+ *     class_stride: The distance between two consecutive labels,
+ *                   in number of elements.
+ *     (The rest is the same as above.)
+ * Return:
+ *     A vector that each element is a pair of score  and decoding result,
+ *     in desending order.
+*/
+template <typename T>
+std::vector<std::pair<double, Output>>
+ctc_beam_search_decoder(const T *probs, size_t num_time_steps,
+                        int64_t time_stride, int64_t class_stride,
+                        const std::vector<std::string> &vocabulary,
+                        size_t beam_size, double cutoff_prob = 1.0,
+                        size_t cutoff_top_n = 40, size_t blank_id = 0,
+                        int log_input = 0, const Scorer *ext_scorer = nullptr,
+                        const std::string &word_delimiter = " ",
+                        const Lexicon *lexicon = nullptr);
 
 class DecoderState {
   int abs_time_step;
@@ -38,23 +75,84 @@ class DecoderState {
   size_t cutoff_top_n;
   size_t blank_id;
   int log_input;
-  std::vector<std::string> vocabulary;
+  const std::vector<std::string> &vocabulary;
+  const Scorer *ext_scorer;
+  float beam_threshold;
+
+  // Whether the prefix shared by all the beams is detached from the trie,
+  // and the labels committed so far.
+  bool long_form;
+  Output committed;
+
+  // The language model states which the prefixes refer to.
+  std::vector<LanguageModel::State> lm_states;
+  std::unordered_map<LanguageModel::State, int, LanguageModel::State::Hash>
+      lm_state_ids;
+  // The words scored in this session, keyed by state id and word id.
+  // Only the new ones are queried to the scorer, which may be shared.
+  struct WordScore {
+    float score;
+    int next_state;
+  };
+  std::unordered_map<uint64_t, WordScore> word_scores;
+
+  // The blank time steps not applied to the prefixes yet. Consecutive ones
+  // are collapsed into one update.
+  float pending_blank_log_prob;
+  int num_pending_blank_frames;
+
+  // statistics
+  bool timing_enabled;
+  DecodeStats counters;
+  mutable int64_t extract_ns;
 
   std::vector<PathTrie *> prefixes;
+  PathTrieContext trie_context;
   PathTrie root;
 
 public:
   /* Initialize CTC beam search decoder for streaming
    *
    * Parameters:
-   *     vocabulary: A vector of vocabulary.
+   *     vocabulary: A vector of vocabulary. It must outlive the decoder
+   *                 state.
    *     beam_size: The width of beam search.
    *     cutoff_prob: Cutoff probability for pruning.
    *     cutoff_top_n: Cutoff number for pruning.
+   *     blank_id: The index of the CTC blank label.
+   *     log_input: Whether the probabilities are given in log scale.
+   *     ext_scorer: External scorer for the language model fusion, or
+   *                 nullptr. It must outlive the decoder state.
+   *     word_delimiter: The label which separates words.
+   *     lexicon: The words to constrain the search to, or nullptr. It must
+   *              outlive the decoder state.
+   *     beam_threshold: The prefixes scoring lower than the best one by more
+   *                     than this are discarded in each time step, and the
+   *                     extensions which would fall below it are not
+   *                     evaluated. `NUM_FLT_INF` disables it.
+   *     fast_math: Whether the log probabilities are added with
+   *                `fast_log_sum_exp`.
+   *     long_form: Whether the prefix shared by all the beams is committed
+   *                after each time step. Its nodes are released, so the trie
+   *                only holds the span not resolved yet, instead of growing
+   *                with the length of the input. The results are the same.
    */
   DecoderState(const std::vector<std::string> &vocabulary, size_t beam_size,
                double cutoff_prob, size_t cutoff_top_n, size_t blank_id,
-               int log_input);
+               int log_input, const Scorer *ext_scorer = nullptr,
+               const std::string &word_delimiter = " ",
+               const Lexicon *lexicon = nullptr,
+               float beam_threshold = NUM_FLT_INF, bool fast_math = false,
+               bool long_form = false);
+
+  /* Same as above, but with the index of the word delimiter in the
+   * vocabulary resolved in advance, or negative if there is none.
+   */
+  DecoderState(const std::vector<std::string> &vocabulary, size_t beam_size,
+               double cutoff_prob, size_t cutoff_top_n, size_t blank_id,
+               int log_input, const Scorer *ext_scorer, int word_delimiter_id,
+               const Lexicon *lexicon, float beam_threshold, bool fast_math,
+               bool long_form);
   ~DecoderState() = default;
 
   /* Process logits in decoder stream
@@ -65,6 +163,49 @@ public:
    */
   void next(const std::vector<std::vector<double>> &probs_seq);
 
+  /* Process logits in decoder stream, reading them from a strided buffer
+   *
+   * Parameters:
+   *     probs: Pointer to the probability of the first label at the first
+   *            time step.
+   *     num_time_steps: The number of time steps to process.
+   *     time_stride: The distance between two consecutive time steps,
+   *                  in number of elements.
+   *     class_stride: The distance between two consecutive labels,
+   *                   in number of elements.
+   */
+  template <typename T>
+  void next(const T *probs, size_t num_time_steps, int64_t time_stride,
+            int64_t class_stride) {
+    for (size_t time_step = 0; time_step < num_time_steps; ++time_step) {
+      next_frame(get_pruned_log_probs(probs + time_step * time_stride,
+                                      vocabulary.size(), class_stride,
+                                      cutoff_prob, cutoff_top_n, log_input));
+    }
+  }
+
+  /* Process the candidates of time steps pruned in advance
+   *
+   * Parameters:
+   *     log_probs: The log probabilities of the candidates.
+   *                Shape: `[num_time_steps, max_candidates]`, contiguous.
+   *     labels: The labels of the candidates, in the same shape, or
+   *             nullptr if the candidates are all the labels, in order.
+   *     num_candidates: The number of valid candidates of each time step,
+   *                     at the beginning of each row.
+   *     num_time_steps: The number of time steps to process.
+   *     max_candidates: The size of a row.
+   *     blank_frames: Optional flags of the time steps dominated by blank.
+   *                   Such a time step only updates the blank probabilities
+   *                   of the prefixes, with the log probability of the first
+   *                   candidate, which has to be blank, without expanding
+   *                   them. Timesteps still count them.
+   */
+  void next_candidates(const float *log_probs, const int64_t *labels,
+                       const int64_t *num_candidates, size_t num_time_steps,
+                       size_t max_candidates,
+                       const bool *blank_frames = nullptr);
+
   /* Get current transcription from the decoder stream state
    *
    * Return:
@@ -72,6 +213,59 @@ public:
    *     in descending order.
    */
   std::vector<std::pair<double, Output>> decode() const;
+
+  /* Get the best `num_results` transcriptions of the decoder stream state
+   *
+   * Same as above, but only the best ones are sorted and assembled.
+   */
+  std::vector<std::pair<double, Output>> decode(size_t num_results) const;
+
+  /* Get the labels committed so far in long-form decoding
+   *
+   * All the results of `decode` start with them, and they do not change
+   * anymore.
+   */
+  const Output &committed_output() const { return committed; }
+
+  /* Get the statistics of the decoder stream
+   */
+  DecodeStats stats() const;
+
+  /* Measure the time spent in each phase of the search
+   *
+   * Disabled by default, so that the clock is not read in each time step.
+   */
+  void enable_timing(bool enabled = true) { timing_enabled = enabled; }
+
+private:
+  // Extend the prefixes with the pruned log probabilities of one time step
+  void next_frame(const std::vector<std::pair<size_t, float>> &log_prob_idx);
+
+  // Apply the pending blank time steps to the prefixes
+  void flush_blank_frames();
+
+  // Get the id of a language model state, registering it if it is new
+  int get_lm_state_id(const LanguageModel::State &state);
+
+  // Set the language model context of a new node and score the word it
+  // completes, if any
+  void set_lm_context(const PathTrie *prefix, PathTrie *child);
 };
 
+template <typename T>
+std::vector<std::pair<double, Output>>
+ctc_beam_search_decoder(const T *probs, size_t num_time_steps,
+                        int64_t time_stride, int64_t class_stride,
+                        const std::vector<std::string> &vocabulary,
+                        size_t beam_size, double cutoff_prob,
+                        size_t cutoff_top_n, size_t blank_id, int log_input,
+                        const Scorer *ext_scorer,
+                        const std::string &word_delimiter,
+                        const Lexicon *lexicon) {
+  DecoderState state(vocabulary, beam_size, cutoff_prob, cutoff_top_n, blank_id,
+                     log_input, ext_scorer, word_delimiter, lexicon);
+  state.next(probs, num_time_steps, time_stride, class_stride);
+  return state.decode();
+}
+
 } // namespace ctcdecode
@@ -2,6 +2,7 @@
 
 #include <algorithm>
 #include <cmath>
+#include <cstdint>
 #include <limits>
 #include <unordered_map>
 #include <utility>
@@ -25,7 +26,7 @@ bool pair_comp_second_rev(const std::pair<T1, T2> &a,
 
 // Return the sum of two probabilities in log scale
 template <typename T> T log_sum_exp(const T &x, const T &y) {
-  static T num_min = -std::numeric_limits<T>::max();
+  const T num_min = -std::numeric_limits<T>::max();
   if (x <= num_min)
     return y;
   if (y <= num_min)
@@ -34,15 +35,91 @@ template <typename T> T log_sum_exp(const T &x, const T &y) {
   return std::log(std::exp(x - xmax) + std::exp(y - xmax)) + xmax;
 }
 
+// `log(1 + exp(-d))` sampled at `d = i / LOG_ADD_TABLE_RESOLUTION` for
+// `d < LOG_ADD_TABLE_MAX_DIFF`. Beyond that, it is below float epsilon
+// relative to the larger operand.
+const int LOG_ADD_TABLE_RESOLUTION = 64;
+const int LOG_ADD_TABLE_MAX_DIFF = 16;
+
+struct LogAddTable {
+  float values[LOG_ADD_TABLE_RESOLUTION * LOG_ADD_TABLE_MAX_DIFF + 1];
+  LogAddTable();
+};
+
+extern const LogAddTable log_add_table;
+
+// Same as `log_sum_exp`, but interpolates the correction term linearly in
+// the table, instead of calling `exp` and `log`. The absolute error is
+// below 1e-5.
+inline float fast_log_sum_exp(float x, float y) {
+  const float xmax = std::max(x, y);
+  const float d = (xmax - std::min(x, y)) * LOG_ADD_TABLE_RESOLUTION;
+  // also covers an operand of `-NUM_FLT_INF`, which overflows `d`
+  if (!(d < LOG_ADD_TABLE_RESOLUTION * LOG_ADD_TABLE_MAX_DIFF)) {
+    return xmax;
+  }
+  const int i = static_cast<int>(d);
+  const float *values = log_add_table.values;
+  return xmax + values[i] + (d - i) * (values[i + 1] - values[i]);
+}
+
+// Dispatch between the two above
+inline float log_sum_exp(float x, float y, bool fast) {
+  return fast ? fast_log_sum_exp(x, y) : log_sum_exp(x, y);
+}
+
 // Get pruned probability vector for each time step's beam search
 std::vector<std::pair<size_t, float>>
 get_pruned_log_probs(const std::vector<double> &prob_step, double cutoff_prob,
                      size_t cutoff_top_n, int log_input);
 
-// Get beam search result from prefixes in trie tree
+// Same as above, but reads the probabilities of one time step directly from
+// a (possibly strided) buffer, so that no intermediate copy is required.
+// `T` can be any type convertible to double. (float, double, c10::Half, ...)
+template <typename T>
+std::vector<std::pair<size_t, float>>
+get_pruned_log_probs(const T *prob_step, size_t num_classes, int64_t stride,
+                     double cutoff_prob, size_t cutoff_top_n, int log_input) {
+  std::vector<std::pair<int, double>> prob_idx;
+  prob_idx.reserve(num_classes);
+  for (size_t i = 0; i < num_classes; ++i) {
+    prob_idx.push_back(std::pair<int, double>(
+        i, static_cast<double>(prob_step[i * stride])));
+  }
+  // pruning of vacobulary. Only the retained labels need to be ordered.
+  size_t cutoff_len = num_classes;
+  if (cutoff_prob < 1.0 || cutoff_top_n < cutoff_len) {
+    cutoff_len = std::min(cutoff_top_n, num_classes);
+    std::partial_sort(prob_idx.begin(), prob_idx.begin() + cutoff_len,
+                      prob_idx.end(), pair_comp_second_rev<int, double>);
+    if (cutoff_prob < 1.0) {
+      double cum_prob = 0.0;
+      for (size_t i = 0; i < cutoff_len; ++i) {
+        cum_prob +=
+            log_input ? std::exp(prob_idx[i].second) : prob_idx[i].second;
+        if (cum_prob >= cutoff_prob) {
+          cutoff_len = i + 1;
+          break;
+        }
+      }
+    }
+  }
+  std::vector<std::pair<size_t, float>> log_prob_idx;
+  log_prob_idx.reserve(cutoff_len);
+  for (size_t i = 0; i < cutoff_len; ++i) {
+    log_prob_idx.push_back(std::pair<int, float>(
+        prob_idx[i].first, log_input ? prob_idx[i].second
+                                     : log(prob_idx[i].second + NUM_FLT_MIN)));
+  }
+  return log_prob_idx;
+}
+
+// Get beam search result from prefixes in trie tree, which are sorted in
+// descending order of `approx_ctc`. The labels committed before the root of
+// the trie, if any, are prepended.
 std::vector<std::pair<double, Output>>
 get_beam_search_result(const std::vector<PathTrie *> &prefixes,
-                       size_t beam_size);
+                       size_t beam_size, const Output *committed = nullptr);
 
 // Functor for prefix comparison
 bool prefix_compare(const PathTrie *x, const PathTrie *y);
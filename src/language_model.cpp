@@ -0,0 +1,372 @@
+#include "language_model.h"
+
+#include <algorithm>
+#include <cmath>
+#include <cstring>
+#include <fstream>
+#include <sstream>
+#include <stdexcept>
+#include <unordered_map>
+
+namespace ctcdecode {
+
+/* Layout of the binary format.
+ *
+ * The header is followed by the tables, each aligned to 8 bytes.
+ * - The vocabulary table maps the hash of spelling to word id.
+ * - The table of unigrams is a dense array indexed by word id.
+ * - The tables of higher orders map the hash of n-gram to its log
+ *   probability and back-off weight.
+ * Hash tables use open addressing with linear probing.
+ */
+struct LanguageModel::Header {
+  char magic[8];
+  uint32_t version;
+  uint32_t order;
+  uint32_t vocab_size;
+  uint32_t bos;
+  uint32_t eos;
+  uint32_t unk;
+  uint64_t vocab_offset;
+  uint64_t vocab_slots;
+  uint64_t ngram_offset[MAX_ORDER];
+  uint64_t ngram_slots[MAX_ORDER];
+};
+
+namespace {
+
+const char MAGIC[8] = {'S', 'C', 'T', 'C', 'N', 'G', 'R', 'M'};
+const uint32_t VERSION = 1;
+
+struct VocabEntry {
+  uint64_t hash;
+  uint32_t id; // NO_WORD if the slot is empty
+  uint32_t unused;
+};
+
+struct Unigram {
+  float prob;
+  float backoff;
+};
+
+struct NgramEntry {
+  uint64_t key; // 0 if the slot is empty
+  float prob;
+  float backoff;
+};
+
+// Hash of an n-gram, built from the last word toward the first word, so
+// that the keys of longer contexts are computed incrementally.
+inline uint64_t extend_key(uint64_t key, uint32_t word) {
+  // splitmix64 finalizer
+  uint64_t h = key ^ ((word + 1ULL) * 0x9e3779b97f4a7c15ULL);
+  h = (h ^ (h >> 30)) * 0xbf58476d1ce4e5b9ULL;
+  h = (h ^ (h >> 27)) * 0x94d049bb133111ebULL;
+  h = h ^ (h >> 31);
+  return h == 0 ? 1 : h;
+}
+
+// The number of slots of a hash table, keeping the load factor below 2/3.
+uint64_t num_slots(uint64_t num_entries) {
+  uint64_t slots = 16;
+  while (slots < num_entries + num_entries / 2) {
+    slots *= 2;
+  }
+  return slots;
+}
+
+uint64_t align(uint64_t offset) { return (offset + 7) & ~uint64_t(7); }
+
+// ARPA stores log10 probabilities.
+const float LOG_10 = std::log(10.0);
+
+} // namespace
+
+bool LanguageModel::State::operator==(const State &other) const {
+  return length == other.length &&
+         std::equal(words, words + length, other.words);
+}
+
+size_t LanguageModel::State::Hash::operator()(const State &state) const {
+  uint64_t key = 0;
+  for (uint32_t i = 0; i < state.length; ++i) {
+    key = extend_key(key, state.words[i]);
+  }
+  return key;
+}
+
+LanguageModel::LanguageModel(const std::string &path) {
+  {
+    std::ifstream file(path, std::ios::binary);
+    if (!file) {
+      throw std::runtime_error("Failed to open language model: " + path);
+    }
+    char magic[sizeof(MAGIC)] = {};
+    file.read(magic, sizeof(magic));
+    if (!file || std::memcmp(magic, MAGIC, sizeof(MAGIC)) != 0) {
+      build_from_arpa(path);
+      return;
+    }
+  }
+  file_.reset(new MappedFile(path));
+  data_ = file_->data();
+  size_ = file_->size();
+  if (size_ < sizeof(Header) || header().version != VERSION) {
+    throw std::runtime_error(
+        "The language model binary is corrupted or created with an "
+        "incompatible version: " +
+        path);
+  }
+  const auto &h = header();
+  uint64_t end = h.vocab_offset + h.vocab_slots * sizeof(VocabEntry);
+  end = std::max(end, h.ngram_offset[0] + h.vocab_size * sizeof(Unigram));
+  for (uint32_t n = 2; n <= h.order; ++n) {
+    end = std::max(end, h.ngram_offset[n - 1] +
+                            h.ngram_slots[n - 1] * sizeof(NgramEntry));
+  }
+  if (h.order < 1 || h.order > MAX_ORDER || end > size_) {
+    throw std::runtime_error("The language model binary is corrupted: " +
+                             path);
+  }
+}
+
+void LanguageModel::build_from_arpa(const std::string &path) {
+  std::ifstream file(path);
+  std::string line;
+  auto fail = [&](const std::string &message) {
+    throw std::runtime_error("Failed to parse ARPA file " + path + ": " +
+                             message);
+  };
+
+  // \data\ section
+  while (std::getline(file, line) && line != "\\data\\") {
+  }
+  if (!file) {
+    fail("\\data\\ section is not found.");
+  }
+  std::vector<uint64_t> counts;
+  while (std::getline(file, line) && line.compare(0, 6, "ngram ") == 0) {
+    auto pos = line.find('=');
+    if (pos == std::string::npos) {
+      fail("Invalid line in \\data\\ section: " + line);
+    }
+    counts.push_back(std::stoull(line.substr(pos + 1)));
+  }
+  const uint32_t order = counts.size();
+  if (order < 1 || order > MAX_ORDER) {
+    fail("Unsupported order: " + std::to_string(order));
+  }
+
+  // layout
+  Header h = {};
+  std::memcpy(h.magic, MAGIC, sizeof(MAGIC));
+  h.version = VERSION;
+  h.order = order;
+  h.vocab_size = counts[0];
+  h.bos = h.eos = h.unk = NO_WORD;
+  h.vocab_slots = num_slots(counts[0]);
+  h.vocab_offset = align(sizeof(Header));
+  h.ngram_offset[0] =
+      align(h.vocab_offset + h.vocab_slots * sizeof(VocabEntry));
+  uint64_t end = h.ngram_offset[0] + counts[0] * sizeof(Unigram);
+  for (uint32_t n = 2; n <= order; ++n) {
+    h.ngram_slots[n - 1] = num_slots(counts[n - 1]);
+    h.ngram_offset[n - 1] = align(end);
+    end = h.ngram_offset[n - 1] + h.ngram_slots[n - 1] * sizeof(NgramEntry);
+  }
+  buffer_.assign(align(end) / sizeof(uint64_t), 0);
+  data_ = reinterpret_cast<const char *>(buffer_.data());
+  size_ = buffer_.size() * sizeof(uint64_t);
+  char *data = reinterpret_cast<char *>(buffer_.data());
+
+  auto vocab = reinterpret_cast<VocabEntry *>(data + h.vocab_offset);
+  for (uint64_t i = 0; i < h.vocab_slots; ++i) {
+    vocab[i].id = NO_WORD;
+  }
+  auto unigrams = reinterpret_cast<Unigram *>(data + h.ngram_offset[0]);
+
+  // n-gram sections
+  std::unordered_map<std::string, uint32_t> word_ids;
+  std::vector<std::string> tokens;
+  for (uint32_t n = 1; n <= order; ++n) {
+    const std::string section = "\\" + std::to_string(n) + "-grams:";
+    while (std::getline(file, line) && line != section) {
+    }
+    if (!file) {
+      fail(section + " section is not found.");
+    }
+    auto table = reinterpret_cast<NgramEntry *>(data + h.ngram_offset[n - 1]);
+    const uint64_t mask = h.ngram_slots[n - 1] - 1;
+    for (uint64_t i = 0; i < counts[n - 1]; ++i) {
+      if (!std::getline(file, line)) {
+        fail(section + " section is shorter than declared.");
+      }
+      std::istringstream stream(line);
+      tokens.clear();
+      for (std::string token; stream >> token;) {
+        tokens.push_back(token);
+      }
+      if (tokens.empty()) {
+        --i;
+        continue;
+      }
+      if (tokens.size() != n + 1 && tokens.size() != n + 2) {
+        fail("Invalid line in " + section + " section: " + line);
+      }
+      const float prob = std::stof(tokens[0]) * LOG_10;
+      const float backoff =
+          tokens.size() == n + 2 ? std::stof(tokens[n + 1]) * LOG_10 : 0.0f;
+      if (n == 1) {
+        const uint32_t id = i;
+        const auto &word = tokens[1];
+        word_ids[word] = id;
+        unigrams[id] = {prob, backoff};
+        const uint64_t hash = hash_word(word);
+        uint64_t slot = hash & (h.vocab_slots - 1);
+        while (vocab[slot].id != NO_WORD) {
+          slot = (slot + 1) & (h.vocab_slots - 1);
+        }
+        vocab[slot].hash = hash;
+        vocab[slot].id = id;
+        if (word == "<s>") {
+          h.bos = id;
+        } else if (word == "</s>") {
+          h.eos = id;
+        } else if (word == "<unk>") {
+          h.unk = id;
+        }
+        continue;
+      }
+      uint64_t key = 0;
+      for (uint32_t j = n; j >= 1; --j) {
+        auto it = word_ids.find(tokens[j]);
+        if (it == word_ids.end()) {
+          fail("Word not found in unigrams: " + tokens[j]);
+        }
+        key = extend_key(key, it->second);
+      }
+      uint64_t slot = key & mask;
+      while (table[slot].key != 0) {
+        slot = (slot + 1) & mask;
+      }
+      table[slot] = {key, prob, backoff};
+    }
+  }
+  std::memcpy(data, &h, sizeof(h));
+}
+
+void LanguageModel::save(const std::string &path) const {
+  std::ofstream file(path, std::ios::binary);
+  file.write(data_, size_);
+  if (!file) {
+    throw std::runtime_error("Failed to write language model: " + path);
+  }
+}
+
+const LanguageModel::Header &LanguageModel::header() const {
+  return *reinterpret_cast<const Header *>(data_);
+}
+
+int LanguageModel::order() const { return header().order; }
+
+uint32_t LanguageModel::vocab_size() const { return header().vocab_size; }
+
+uint32_t LanguageModel::end_of_sentence() const { return header().eos; }
+
+uint32_t LanguageModel::word_id(uint64_t word_hash) const {
+  const auto &h = header();
+  auto vocab = reinterpret_cast<const VocabEntry *>(data_ + h.vocab_offset);
+  const uint64_t mask = h.vocab_slots - 1;
+  for (uint64_t slot = word_hash & mask;; slot = (slot + 1) & mask) {
+    if (vocab[slot].id == NO_WORD || vocab[slot].hash == word_hash) {
+      return vocab[slot].id;
+    }
+  }
+}
+
+LanguageModel::State LanguageModel::begin_state() const {
+  State state;
+  if (header().bos != NO_WORD && header().order > 1) {
+    state.length = 1;
+    state.words[0] = header().bos;
+  }
+  return state;
+}
+
+float LanguageModel::score(const State &state, uint32_t word,
+                           State *next) const {
+  const auto &h = header();
+  const bool is_oov = word == NO_WORD || word == h.unk;
+  if (word == NO_WORD) {
+    word = h.unk;
+  }
+  if (word == NO_WORD) {
+    // the model has no <unk>, so the context is lost.
+    if (next != nullptr) {
+      *next = State();
+    }
+    return OOV_SCORE;
+  }
+
+  auto find = [&](uint32_t n, uint64_t key) -> const NgramEntry * {
+    auto table =
+        reinterpret_cast<const NgramEntry *>(data_ + h.ngram_offset[n - 1]);
+    const uint64_t mask = h.ngram_slots[n - 1] - 1;
+    for (uint64_t slot = key & mask;; slot = (slot + 1) & mask) {
+      if (table[slot].key == key) {
+        return table + slot;
+      }
+      if (table[slot].key == 0) {
+        return nullptr;
+      }
+    }
+  };
+  auto unigrams = reinterpret_cast<const Unigram *>(data_ + h.ngram_offset[0]);
+  const uint32_t length = state.length;
+
+  // the longest n-gram ending with the word
+  float prob = unigrams[word].prob;
+  uint32_t matched = 0;
+  for (uint64_t key = extend_key(0, word); matched < length; ++matched) {
+    key = extend_key(key, state.words[length - 1 - matched]);
+    auto entry = find(matched + 2, key);
+    if (entry == nullptr) {
+      break;
+    }
+    prob = entry->prob;
+  }
+  // back-off weights of the contexts longer than the match
+  uint64_t key = 0;
+  for (uint32_t j = 1; j <= length; ++j) {
+    const uint32_t context_word = state.words[length - j];
+    key = extend_key(key, context_word);
+    if (j <= matched) {
+      continue;
+    }
+    if (j == 1) {
+      prob += unigrams[context_word].backoff;
+      continue;
+    }
+    auto entry = find(j, key);
+    if (entry == nullptr) {
+      break;
+    }
+    prob += entry->backoff;
+  }
+
+  if (next != nullptr) {
+    // Only the words in the matched n-gram can be a part of longer n-grams.
+    const uint32_t next_length =
+        std::min<uint32_t>(matched + 1, h.order - 1);
+    next->length = next_length;
+    if (next_length > 0) {
+      for (uint32_t i = 0; i + 1 < next_length; ++i) {
+        next->words[i] = state.words[length - (next_length - 1) + i];
+      }
+      next->words[next_length - 1] = word;
+    }
+  }
+  return is_oov ? OOV_SCORE : prob;
+}
+
+} // namespace ctcdecode
@@ -0,0 +1,101 @@
+#pragma once
+
+#include <cstdint>
+#include <memory>
+#include <string>
+#include <vector>
+
+#include "mapped_file.h"
+
+namespace ctcdecode {
+
+/* Word-level back-off n-gram language model.
+ *
+ * The model is loaded from an ARPA file, and can be saved in a compact binary
+ * format. The binary consists only of flat hash tables without pointers, so
+ * it is used in place after being memory-mapped, and one copy in memory is
+ * shared read-only by all the processes loading the same file.
+ *
+ * Words are identified by the 64-bit hash of their spelling (see
+ * `hash_word`), so that the decoder can compute it incrementally while
+ * appending labels. All the scores are natural log probabilities.
+ */
+class LanguageModel {
+public:
+  static constexpr int MAX_ORDER = 8;
+  static constexpr uint32_t NO_WORD = 0xffffffff;
+  // Score given to the words which are not in the vocabulary.
+  static constexpr float OOV_SCORE = -1000.0;
+
+  // The context words of an n-gram, the oldest first.
+  struct State {
+    uint32_t length = 0;
+    uint32_t words[MAX_ORDER - 1] = {};
+
+    bool operator==(const State &other) const;
+
+    struct Hash {
+      size_t operator()(const State &state) const;
+    };
+  };
+
+  /* Load a model.
+   *
+   * Parameters:
+   *     path: Path to an ARPA file, or a binary file created with `save`.
+   *           Binary files are memory-mapped.
+   */
+  explicit LanguageModel(const std::string &path);
+
+  // Write the model in the binary format.
+  void save(const std::string &path) const;
+
+  // Compute the hash of spelling incrementally. Start with `hash_word("")`.
+  static uint64_t hash_word(const char *data, size_t size,
+                            uint64_t hash = 14695981039346656037ULL) {
+    // FNV-1a
+    for (size_t i = 0; i < size; ++i) {
+      hash = (hash ^ static_cast<uint8_t>(data[i])) * 1099511628211ULL;
+    }
+    return hash;
+  }
+  static uint64_t hash_word(const std::string &word) {
+    return hash_word(word.data(), word.size());
+  }
+
+  // Get the id of the word with the given spelling hash, or NO_WORD.
+  uint32_t word_id(uint64_t word_hash) const;
+
+  // The state at the beginning of a sentence.
+  State begin_state() const;
+
+  /* Get the log probability of a word following the given context.
+   *
+   * Parameters:
+   *     state: The context.
+   *     word: The id of the word. (NO_WORD for an unknown word.)
+   *     next: When given, set to the context for the next word.
+   */
+  float score(const State &state, uint32_t word, State *next = nullptr) const;
+
+  int order() const;
+  uint32_t vocab_size() const;
+  uint32_t end_of_sentence() const;
+  // The size of the binary representation in bytes.
+  size_t size() const { return size_; }
+  // True if the binary representation is memory-mapped.
+  bool is_mapped() const { return file_ != nullptr; }
+
+  struct Header;
+
+private:
+  void build_from_arpa(const std::string &path);
+  const Header &header() const;
+
+  std::unique_ptr<MappedFile> file_;
+  std::vector<uint64_t> buffer_;
+  const char *data_ = nullptr;
+  size_t size_ = 0;
+};
+
+} // namespace ctcdecode
@@ -0,0 +1,238 @@
+#include "lexicon.h"
+
+#include <algorithm>
+#include <cstring>
+#include <fstream>
+#include <stdexcept>
+#include <unordered_map>
+
+namespace ctcdecode {
+
+/* Layout of the binary format.
+ *
+ * The header is followed by the table of transitions and the flags of the
+ * states where a word ends, each aligned to 8 bytes. The table uses open
+ * addressing with linear probing.
+ */
+struct Lexicon::Header {
+  char magic[8];
+  uint32_t version;
+  uint32_t num_labels;
+  int32_t delimiter;
+  uint32_t num_words;
+  uint64_t labels_hash;
+  uint32_t num_states;
+  uint32_t unused;
+  uint64_t table_offset;
+  uint64_t table_slots;
+  uint64_t final_offset;
+};
+
+namespace {
+
+const char MAGIC[8] = {'S', 'C', 'T', 'C', 'L', 'E', 'X', 'I'};
+const uint32_t VERSION = 1;
+
+struct Transition {
+  uint64_t key;
+  uint32_t next; // NO_STATE if the slot is empty
+  uint32_t unused;
+};
+
+inline uint64_t make_key(uint32_t state, int label) {
+  return static_cast<uint64_t>(state) << 32 | static_cast<uint32_t>(label);
+}
+
+inline uint64_t hash_key(uint64_t key) {
+  // splitmix64 finalizer
+  key = (key ^ (key >> 30)) * 0xbf58476d1ce4e5b9ULL;
+  key = (key ^ (key >> 27)) * 0x94d049bb133111ebULL;
+  return key ^ (key >> 31);
+}
+
+// The number of slots of a hash table, keeping the load factor below 1/2.
+uint64_t num_slots(uint64_t num_entries) {
+  uint64_t slots = 16;
+  while (slots < 2 * num_entries) {
+    slots *= 2;
+  }
+  return slots;
+}
+
+uint64_t align(uint64_t offset) { return (offset + 7) & ~uint64_t(7); }
+
+int find_delimiter(const std::vector<std::string> &labels,
+                   const std::string &word_delimiter) {
+  auto it = std::find(labels.begin(), labels.end(), word_delimiter);
+  return it == labels.end() ? -1 : std::distance(labels.begin(), it);
+}
+
+uint64_t hash_labels(const std::vector<std::string> &labels) {
+  // FNV-1a
+  uint64_t hash = 14695981039346656037ULL;
+  for (const auto &label : labels) {
+    for (char c : label) {
+      hash = (hash ^ static_cast<uint8_t>(c)) * 1099511628211ULL;
+    }
+    hash = (hash ^ 0xff) * 1099511628211ULL;
+  }
+  return hash;
+}
+
+} // namespace
+
+Lexicon::Lexicon(const std::vector<std::string> &words,
+                 const std::vector<std::string> &labels,
+                 const std::string &word_delimiter) {
+  const int delimiter = find_delimiter(labels, word_delimiter);
+  size_t max_label_size = 0;
+  std::unordered_map<std::string, int> label_ids;
+  for (size_t i = 0; i < labels.size(); ++i) {
+    if (static_cast<int>(i) != delimiter && !labels[i].empty()) {
+      label_ids.emplace(labels[i], i);
+      max_label_size = std::max(max_label_size, labels[i].size());
+    }
+  }
+
+  // build the trie
+  std::unordered_map<uint64_t, uint32_t> transitions;
+  std::vector<uint8_t> is_final{0};
+  uint32_t num_words = 0;
+  std::vector<int> spelling;
+  for (const auto &word : words) {
+    // split into labels, longest match first
+    spelling.clear();
+    for (size_t pos = 0; pos < word.size();) {
+      size_t size = std::min(max_label_size, word.size() - pos);
+      for (; size > 0; --size) {
+        auto it = label_ids.find(word.substr(pos, size));
+        if (it != label_ids.end()) {
+          spelling.push_back(it->second);
+          break;
+        }
+      }
+      if (size == 0) {
+        spelling.clear();
+        break;
+      }
+      pos += size;
+    }
+    if (spelling.empty()) {
+      continue;
+    }
+    uint32_t state = START;
+    for (int label : spelling) {
+      auto inserted = transitions.emplace(make_key(state, label),
+                                          static_cast<uint32_t>(is_final.size()));
+      if (inserted.second) {
+        is_final.push_back(0);
+      }
+      state = inserted.first->second;
+    }
+    num_words += !is_final[state];
+    is_final[state] = 1;
+  }
+
+  Header h = {};
+  std::memcpy(h.magic, MAGIC, sizeof(MAGIC));
+  h.version = VERSION;
+  h.num_labels = labels.size();
+  h.delimiter = delimiter;
+  h.num_words = num_words;
+  h.labels_hash = hash_labels(labels);
+  h.num_states = is_final.size();
+  h.table_offset = align(sizeof(Header));
+  h.table_slots = num_slots(transitions.size());
+  h.final_offset = align(h.table_offset + h.table_slots * sizeof(Transition));
+  size_ = h.final_offset + is_final.size();
+  buffer_.resize(align(size_) / sizeof(uint64_t));
+  char *data = reinterpret_cast<char *>(buffer_.data());
+  data_ = data;
+  std::memcpy(data, &h, sizeof(h));
+
+  auto table = reinterpret_cast<Transition *>(data + h.table_offset);
+  const uint64_t mask = h.table_slots - 1;
+  for (uint64_t slot = 0; slot < h.table_slots; ++slot) {
+    table[slot].next = NO_STATE;
+  }
+  for (const auto &transition : transitions) {
+    uint64_t slot = hash_key(transition.first) & mask;
+    while (table[slot].next != NO_STATE) {
+      slot = (slot + 1) & mask;
+    }
+    table[slot] = {transition.first, transition.second, 0};
+  }
+  std::memcpy(data + h.final_offset, is_final.data(), is_final.size());
+}
+
+Lexicon::Lexicon(const std::string &path) {
+  {
+    std::ifstream file(path, std::ios::binary);
+    if (!file) {
+      throw std::runtime_error("Failed to open lexicon: " + path);
+    }
+    char magic[sizeof(MAGIC)] = {};
+    file.read(magic, sizeof(magic));
+    if (!file || std::memcmp(magic, MAGIC, sizeof(MAGIC)) != 0) {
+      throw std::runtime_error("Not a lexicon binary: " + path);
+    }
+  }
+  file_.reset(new MappedFile(path));
+  data_ = file_->data();
+  size_ = file_->size();
+  if (size_ < sizeof(Header) || header().version != VERSION) {
+    throw std::runtime_error(
+        "The lexicon binary is corrupted or created with an incompatible "
+        "version: " +
+        path);
+  }
+  const auto &h = header();
+  if (h.table_offset + h.table_slots * sizeof(Transition) > size_ ||
+      h.final_offset + h.num_states > size_ || h.num_states == 0) {
+    throw std::runtime_error("The lexicon binary is corrupted: " + path);
+  }
+}
+
+void Lexicon::save(const std::string &path) const {
+  std::ofstream file(path, std::ios::binary);
+  file.write(data_, size_);
+  if (!file) {
+    throw std::runtime_error("Failed to write lexicon: " + path);
+  }
+}
+
+const Lexicon::Header &Lexicon::header() const {
+  return *reinterpret_cast<const Header *>(data_);
+}
+
+uint32_t Lexicon::next(uint32_t state, int label) const {
+  const auto &h = header();
+  if (label == h.delimiter) {
+    // only accepted where a word ends
+    const auto is_final =
+        reinterpret_cast<const uint8_t *>(data_ + h.final_offset);
+    return is_final[state] ? START : NO_STATE;
+  }
+  auto table = reinterpret_cast<const Transition *>(data_ + h.table_offset);
+  const uint64_t mask = h.table_slots - 1;
+  const uint64_t key = make_key(state, label);
+  for (uint64_t slot = hash_key(key) & mask;; slot = (slot + 1) & mask) {
+    if (table[slot].next == NO_STATE || table[slot].key == key) {
+      return table[slot].next;
+    }
+  }
+}
+
+bool Lexicon::is_compatible(const std::vector<std::string> &labels,
+                            const std::string &word_delimiter) const {
+  const auto &h = header();
+  return h.num_labels == labels.size() &&
+         h.labels_hash == hash_labels(labels) &&
+         h.delimiter == find_delimiter(labels, word_delimiter);
+}
+
+uint32_t Lexicon::num_words() const { return header().num_words; }
+
+uint32_t Lexicon::num_states() const { return header().num_states; }
+
+} // namespace ctcdecode
@@ -0,0 +1,72 @@
+#pragma once
+
+#include <cstdint>
+#include <memory>
+#include <string>
+#include <vector>
+
+#include "mapped_file.h"
+
+namespace ctcdecode {
+
+/* Set of words spelled with labels, for lexicon-constrained decoding.
+ *
+ * The words form a trie over labels. A prefix being decoded keeps its state
+ * in the trie, and it can only be extended with the labels which have a
+ * transition from that state. The word delimiter is only accepted where a
+ * word ends, and brings the state back to the start.
+ *
+ * The transitions are stored in one flat hash table keyed by (state, label),
+ * so that a transition is found in O(1). Like the language model, the table
+ * can be saved in a binary format, which is memory-mapped on loading.
+ */
+class Lexicon {
+public:
+  static constexpr uint32_t START = 0;
+  static constexpr uint32_t NO_STATE = 0xffffffff;
+
+  /* Build a lexicon.
+   *
+   * Parameters:
+   *     words: The words. They are split into labels by longest match, and
+   *            the ones which cannot be spelled with the labels are skipped.
+   *     labels: The labels of the decoder.
+   *     word_delimiter: The label which separates words.
+   */
+  Lexicon(const std::vector<std::string> &words,
+          const std::vector<std::string> &labels,
+          const std::string &word_delimiter);
+
+  // Load a lexicon saved with `save`. The file is memory-mapped.
+  explicit Lexicon(const std::string &path);
+
+  // Write the lexicon in the binary format.
+  void save(const std::string &path) const;
+
+  // Get the state after appending the label, or NO_STATE if no word is
+  // spelled so.
+  uint32_t next(uint32_t state, int label) const;
+
+  // True if the lexicon was built for the given labels and delimiter.
+  bool is_compatible(const std::vector<std::string> &labels,
+                     const std::string &word_delimiter) const;
+
+  uint32_t num_words() const;
+  uint32_t num_states() const;
+  // The size of the binary representation in bytes.
+  size_t size() const { return size_; }
+  // True if the binary representation is memory-mapped.
+  bool is_mapped() const { return file_ != nullptr; }
+
+  struct Header;
+
+private:
+  const Header &header() const;
+
+  std::unique_ptr<MappedFile> file_;
+  std::vector<uint64_t> buffer_;
+  const char *data_ = nullptr;
+  size_t size_ = 0;
+};
+
+} // namespace ctcdecode
@@ -0,0 +1,65 @@
+#include "mapped_file.h"
+
+#include <fstream>
+#include <stdexcept>
+
+#ifndef _WIN32
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+#endif
+
+namespace ctcdecode {
+
+#ifndef _WIN32
+
+MappedFile::MappedFile(const std::string &path) {
+  int fd = open(path.c_str(), O_RDONLY);
+  if (fd < 0) {
+    throw std::runtime_error("Failed to open file: " + path);
+  }
+  struct stat st;
+  if (fstat(fd, &st) != 0) {
+    close(fd);
+    throw std::runtime_error("Failed to get the size of file: " + path);
+  }
+  size_ = st.st_size;
+  if (size_ > 0) {
+    void *addr = mmap(nullptr, size_, PROT_READ, MAP_SHARED, fd, 0);
+    if (addr == MAP_FAILED) {
+      close(fd);
+      throw std::runtime_error("Failed to map file: " + path);
+    }
+    data_ = static_cast<const char *>(addr);
+    mapped_ = true;
+  }
+  // The mapping stays valid after closing the descriptor.
+  close(fd);
+}
+
+MappedFile::~MappedFile() {
+  if (mapped_) {
+    munmap(const_cast<char *>(data_), size_);
+  }
+}
+
+#else
+
+MappedFile::MappedFile(const std::string &path) {
+  std::ifstream file(path, std::ios::binary | std::ios::ate);
+  if (!file) {
+    throw std::runtime_error("Failed to open file: " + path);
+  }
+  buffer_.resize(file.tellg());
+  file.seekg(0);
+  file.read(buffer_.data(), buffer_.size());
+  data_ = buffer_.data();
+  size_ = buffer_.size();
+}
+
+MappedFile::~MappedFile() = default;
+
+#endif
+
+} // namespace ctcdecode
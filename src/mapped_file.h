@@ -0,0 +1,32 @@
+#pragma once
+
+#include <cstddef>
+#include <string>
+#include <vector>
+
+namespace ctcdecode {
+
+/* Read-only view of the whole content of a file.
+ *
+ * The file is memory-mapped where available, so that loading is cheap and
+ * the pages are shared by all the processes which map the same file.
+ * Otherwise the content is read into memory.
+ */
+class MappedFile {
+public:
+  explicit MappedFile(const std::string &path);
+  MappedFile(const MappedFile &) = delete;
+  MappedFile &operator=(const MappedFile &) = delete;
+  ~MappedFile();
+
+  const char *data() const { return data_; }
+  size_t size() const { return size_; }
+
+private:
+  const char *data_ = nullptr;
+  size_t size_ = 0;
+  bool mapped_ = false;
+  std::vector<char> buffer_;
+};
+
+} // namespace ctcdecode
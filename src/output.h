@@ -1,5 +1,7 @@
 #pragma once
 
+#include <cstddef>
+#include <cstdint>
 #include <vector>
 
 namespace ctcdecode {
@@ -12,4 +14,27 @@ struct Output {
   std::vector<int> tokens, timesteps;
 };
 
+/* Struct for the statistics of a decoding session
+ */
+struct DecodeStats {
+  // the number of time steps processed, including the skipped ones
+  size_t frames = 0;
+  // the number of time steps skipped as blank, without expanding the prefixes
+  size_t frames_skipped = 0;
+  // the number of labels retained by pruning, over the searched time steps
+  size_t candidates = 0;
+  // the number of times a prefix was extended with a non-blank label
+  size_t prefixes_expanded = 0;
+  // the number of trie nodes allocated / freed in total
+  size_t nodes_allocated = 0, nodes_freed = 0;
+  // the highest number of trie nodes alive at the same time
+  size_t peak_nodes = 0;
+  // the number of labels finalized and detached from the trie in long-form
+  // decoding
+  size_t tokens_committed = 0;
+  // the time spent extending the prefixes, selecting the beam, and
+  // extracting the results, in nanoseconds. Only measured when enabled.
+  int64_t expand_ns = 0, select_ns = 0, extract_ns = 0;
+};
+
 } // namespace ctcdecode
@@ -1,9 +1,116 @@
+#include <cstdint>
+#include <new>
+#include <type_traits>
+
 #include "path_trie.h"
 #include "decoder_utils.h"
 
 namespace ctcdecode {
 
-PathTrie::PathTrie() {
+// Nodes are released without calling destructor.
+static_assert(std::is_trivially_destructible<PathTrie>::value,
+              "PathTrie must be trivially destructible.");
+
+PathTriePool::~PathTriePool() {
+  for (auto block : blocks_) {
+    ::operator delete(block);
+  }
+}
+
+PathTrie *PathTriePool::allocate() {
+  PathTrie *node;
+  if (free_list_ != nullptr) {
+    node = free_list_;
+    free_list_ = node->parent;
+  } else {
+    if (num_used_in_block_ == BLOCK_SIZE) {
+      blocks_.push_back(static_cast<PathTrie *>(
+          ::operator new(sizeof(PathTrie) * BLOCK_SIZE)));
+      num_used_in_block_ = 0;
+    }
+    node = blocks_.back() + num_used_in_block_++;
+  }
+  ++num_allocated_;
+  peak_live_ = std::max(peak_live_, num_live());
+  return new (node) PathTrie();
+}
+
+void PathTriePool::release(PathTrie *node) {
+  // free nodes are chained with the `parent` pointer
+  node->parent = free_list_;
+  free_list_ = node;
+  ++num_released_;
+}
+
+PathTrieIndex::PathTrieIndex() : entries_(1024), mask_(1023) {}
+
+size_t PathTrieIndex::home(const PathTrie *parent, int character) const {
+  // splitmix64 finalizer
+  uint64_t h = reinterpret_cast<uintptr_t>(parent) ^
+               (static_cast<uint64_t>(static_cast<uint32_t>(character)) << 48);
+  h = (h ^ (h >> 30)) * 0xbf58476d1ce4e5b9ULL;
+  h = (h ^ (h >> 27)) * 0x94d049bb133111ebULL;
+  h = h ^ (h >> 31);
+  return h & mask_;
+}
+
+PathTrie *PathTrieIndex::find(const PathTrie *parent, int character) const {
+  for (size_t i = home(parent, character);; i = (i + 1) & mask_) {
+    const auto &entry = entries_[i];
+    if (entry.child == nullptr) {
+      return nullptr;
+    }
+    if (entry.parent == parent && entry.character == character) {
+      return entry.child;
+    }
+  }
+}
+
+void PathTrieIndex::insert(PathTrie *child) {
+  if (2 * (size_ + 1) > entries_.size()) {
+    grow();
+  }
+  size_t i = home(child->parent, child->character);
+  while (entries_[i].child != nullptr) {
+    i = (i + 1) & mask_;
+  }
+  entries_[i] = {child->parent, child->character, child};
+  ++size_;
+}
+
+void PathTrieIndex::erase(const PathTrie *child) {
+  size_t i = home(child->parent, child->character);
+  while (entries_[i].child != child) {
+    i = (i + 1) & mask_;
+  }
+  // shift the following entries back, so that no tombstone is needed
+  for (size_t j = (i + 1) & mask_; entries_[j].child != nullptr;
+       j = (j + 1) & mask_) {
+    size_t k = home(entries_[j].parent, entries_[j].character);
+    // move the entry at `j` to `i` unless its home is cyclically in (i, j]
+    bool in_range = (i <= j) ? (i < k && k <= j) : (i < k || k <= j);
+    if (!in_range) {
+      entries_[i] = entries_[j];
+      i = j;
+    }
+  }
+  entries_[i].child = nullptr;
+  --size_;
+}
+
+void PathTrieIndex::grow() {
+  std::vector<Entry> entries(entries_.size() * 2);
+  std::swap(entries, entries_);
+  mask_ = entries_.size() - 1;
+  size_ = 0;
+  for (auto &entry : entries) {
+    if (entry.child != nullptr) {
+      insert(entry.child);
+    }
+  }
+}
+
+PathTrie::PathTrie(PathTrieContext *context) {
   log_prob_b_prev = -NUM_FLT_INF;
   log_prob_nb_prev = -NUM_FLT_INF;
   log_prob_b_cur = -NUM_FLT_INF;
@@ -11,95 +118,73 @@ PathTrie::PathTrie() {
   log_prob_c = -NUM_FLT_INF;
   score = -NUM_FLT_INF;
 
-  ROOT_ = -1;
   character = ROOT_;
   timestep = 0;
+  lm_state = -1;
+  word_hash = 0;
+  lm_score = 0;
   exists_ = true;
   parent = nullptr;
 
-  dictionary_ = nullptr;
-  dictionary_state_ = 0;
-  has_dictionary_ = false;
-
-  matcher_ = nullptr;
-}
+  lexicon_state_ = Lexicon::START;
 
-PathTrie::~PathTrie() {
-  for (auto child : children_) {
-    delete child.second;
-  }
+  context_ = context;
+  first_child_ = nullptr;
+  prev_sibling_ = nullptr;
+  next_sibling_ = nullptr;
 }
 
 PathTrie *PathTrie::get_path_trie(int new_char, int new_timestep,
-                                  float cur_log_prob_c, bool reset) {
-  auto child = children_.begin();
-  for (child = children_.begin(); child != children_.end(); ++child) {
-    if (child->first == new_char) {
-      if (child->second->log_prob_c < cur_log_prob_c) {
-        child->second->log_prob_c = cur_log_prob_c;
-        child->second->timestep = new_timestep;
-      }
-      break;
-    }
+                                  float cur_log_prob_c, bool *activated) {
+  if (activated != nullptr) {
+    *activated = false;
   }
-  if (child != children_.end()) {
-    if (!child->second->exists_) {
-      child->second->exists_ = true;
-      child->second->log_prob_b_prev = -NUM_FLT_INF;
-      child->second->log_prob_nb_prev = -NUM_FLT_INF;
-      child->second->log_prob_b_cur = -NUM_FLT_INF;
-      child->second->log_prob_nb_cur = -NUM_FLT_INF;
+  PathTrie *child = context_->index.find(this, new_char);
+  if (child != nullptr) {
+    if (child->log_prob_c < cur_log_prob_c) {
+      child->log_prob_c = cur_log_prob_c;
+      child->timestep = new_timestep;
     }
-    return (child->second);
-  } else {
-    if (has_dictionary_) {
-      matcher_->SetState(dictionary_state_);
-      bool found = matcher_->Find(new_char + 1);
-      if (!found) {
-        // Adding this character causes word outside dictionary
-        auto FSTZERO = fst::TropicalWeight::Zero();
-        auto final_weight = dictionary_->Final(dictionary_state_);
-        bool is_final = (final_weight != FSTZERO);
-        if (is_final && reset) {
-          dictionary_state_ = dictionary_->Start();
-        }
-        return nullptr;
-      } else {
-        PathTrie *new_path = new PathTrie;
-        new_path->character = new_char;
-        new_path->timestep = new_timestep;
-        new_path->parent = this;
-        new_path->dictionary_ = dictionary_;
-        new_path->has_dictionary_ = true;
-        new_path->matcher_ = matcher_;
-        new_path->log_prob_c = cur_log_prob_c;
-
-        // set spell checker state
-        // check to see if next state is final
-        auto FSTZERO = fst::TropicalWeight::Zero();
-        auto final_weight = dictionary_->Final(matcher_->Value().nextstate);
-        bool is_final = (final_weight != FSTZERO);
-        if (is_final && reset) {
-          // restart spell checker at the start state
-          new_path->dictionary_state_ = dictionary_->Start();
-        } else {
-          // go to next state
-          new_path->dictionary_state_ = matcher_->Value().nextstate;
-        }
-
-        children_.push_back(std::make_pair(new_char, new_path));
-        return new_path;
+    if (!child->exists_) {
+      child->exists_ = true;
+      child->log_prob_b_prev = -NUM_FLT_INF;
+      child->log_prob_nb_prev = -NUM_FLT_INF;
+      child->log_prob_b_cur = -NUM_FLT_INF;
+      child->log_prob_nb_cur = -NUM_FLT_INF;
+      if (activated != nullptr) {
+        *activated = true;
       }
-    } else {
-      PathTrie *new_path = new PathTrie;
-      new_path->character = new_char;
-      new_path->timestep = new_timestep;
-      new_path->parent = this;
-      new_path->log_prob_c = cur_log_prob_c;
-      children_.push_back(std::make_pair(new_char, new_path));
-      return new_path;
     }
+    return child;
+  }
+
+  uint32_t new_lexicon_state = Lexicon::START;
+  if (context_->lexicon != nullptr) {
+    new_lexicon_state = context_->lexicon->next(lexicon_state_, new_char);
+    if (new_lexicon_state == Lexicon::NO_STATE) {
+      // adding this character causes a word outside the lexicon
+      return nullptr;
+    }
+  }
+
+  PathTrie *new_path = context_->pool.allocate();
+  new_path->character = new_char;
+  new_path->timestep = new_timestep;
+  new_path->parent = this;
+  new_path->log_prob_c = cur_log_prob_c;
+  new_path->lexicon_state_ = new_lexicon_state;
+  new_path->context_ = context_;
+
+  new_path->next_sibling_ = first_child_;
+  if (first_child_ != nullptr) {
+    first_child_->prev_sibling_ = new_path;
+  }
+  first_child_ = new_path;
+  context_->index.insert(new_path);
+  if (activated != nullptr) {
+    *activated = true;
   }
+  return new_path;
 }
 
 PathTrie *PathTrie::get_path_vec(std::vector<int> &output,
@@ -110,63 +195,102 @@ PathTrie *PathTrie::get_path_vec(std::vector<int> &output,
 PathTrie *PathTrie::get_path_vec(std::vector<int> &output,
                                  std::vector<int> &timesteps, int stop,
                                  size_t max_steps) {
-  if (character == stop || character == ROOT_ || output.size() == max_steps) {
-    std::reverse(output.begin(), output.end());
-    std::reverse(timesteps.begin(), timesteps.end());
-    return this;
-  } else {
-    output.push_back(character);
-    timesteps.push_back(timestep);
-    return parent->get_path_vec(output, timesteps, stop, max_steps);
+  // iterative, so that long paths do not exhaust the call stack
+  const size_t begin = output.size();
+  auto node = this;
+  while (node->character != stop && node->character != ROOT_ &&
+         output.size() - begin < max_steps) {
+    output.push_back(node->character);
+    timesteps.push_back(node->timestep);
+    node = node->parent;
   }
+  std::reverse(output.begin() + begin, output.end());
+  std::reverse(timesteps.begin() + begin, timesteps.end());
+  return node;
 }
 
-void PathTrie::iterate_to_vec(std::vector<PathTrie *> &output) {
-  if (exists_) {
-    log_prob_b_prev = log_prob_b_cur;
-    log_prob_nb_prev = log_prob_nb_cur;
-
-    log_prob_b_cur = -NUM_FLT_INF;
-    log_prob_nb_cur = -NUM_FLT_INF;
+size_t PathTrie::commit_common_prefix(std::vector<int> &output,
+                                      std::vector<int> &timesteps) {
+  // The nodes which do not exist and have a single child only lead to the
+  // existing prefixes below. Every future prefix extends one of them, so the
+  // path down to the first branch or existing node can no longer change.
+  auto ancestor = this;
+  while (!ancestor->exists_ && ancestor->first_child_ != nullptr &&
+         ancestor->first_child_->next_sibling_ == nullptr) {
+    ancestor = ancestor->first_child_;
+  }
+  if (ancestor == this || ancestor->parent == this) {
+    return 0;
+  }
 
-    score = log_sum_exp(log_prob_b_prev, log_prob_nb_prev);
-    output.push_back(this);
+  size_t num_committed = 0;
+  for (auto node = first_child_; node != ancestor; ++num_committed) {
+    output.push_back(node->character);
+    timesteps.push_back(node->timestep);
+    auto child = node->first_child_;
+    context_->index.erase(node);
+    context_->pool.release(node);
+    node = child;
   }
-  for (auto child : children_) {
-    child.second->iterate_to_vec(output);
+  // re-registered, as the index is keyed by the parent
+  context_->index.erase(ancestor);
+  ancestor->parent = this;
+  first_child_ = ancestor;
+  context_->index.insert(ancestor);
+  return num_committed;
+}
+
+void PathTrie::update_score() {
+  log_prob_b_prev = log_prob_b_cur;
+  log_prob_nb_prev = log_prob_nb_cur;
+
+  log_prob_b_cur = -NUM_FLT_INF;
+  log_prob_nb_cur = -NUM_FLT_INF;
+
+  score = log_sum_exp(log_prob_b_prev, log_prob_nb_prev,
+                      context_ != nullptr && context_->fast_math);
+}
+
+void PathTrie::iterate_to_vec(std::vector<PathTrie *> &output) {
+  // pre-order traversal with an explicit stack, so that deep tries do not
+  // exhaust the call stack
+  std::vector<PathTrie *> stack{this};
+  while (!stack.empty()) {
+    auto node = stack.back();
+    stack.pop_back();
+    if (node->exists_) {
+      node->update_score();
+      output.push_back(node);
+    }
+    auto num_visited = stack.size();
+    for (auto child = node->first_child_; child != nullptr;
+         child = child->next_sibling_) {
+      stack.push_back(child);
+    }
+    std::reverse(stack.begin() + num_visited, stack.end());
   }
 }
 
 void PathTrie::remove() {
   exists_ = false;
 
-  if (children_.size() == 0) {
-    auto child = parent->children_.begin();
-    for (child = parent->children_.begin(); child != parent->children_.end();
-         ++child) {
-      if (child->first == character) {
-        parent->children_.erase(child);
-        break;
-      }
+  // release the nodes which are no longer on any existing path
+  auto node = this;
+  while (node->first_child_ == nullptr && !node->exists_) {
+    auto parent = node->parent;
+    if (node->prev_sibling_ == nullptr) {
+      parent->first_child_ = node->next_sibling_;
+    } else {
+      node->prev_sibling_->next_sibling_ = node->next_sibling_;
     }
-
-    if (parent->children_.size() == 0 && !parent->exists_) {
-      parent->remove();
+    if (node->next_sibling_ != nullptr) {
+      node->next_sibling_->prev_sibling_ = node->prev_sibling_;
     }
 
-    delete this;
+    context_->index.erase(node);
+    context_->pool.release(node);
+    node = parent;
   }
 }
 
-void PathTrie::set_dictionary(fst::StdVectorFst *dictionary) {
-  dictionary_ = dictionary;
-  dictionary_state_ = dictionary->Start();
-  has_dictionary_ = true;
-}
-
-using FSTMATCH = fst::SortedMatcher<fst::StdVectorFst>;
-void PathTrie::set_matcher(std::shared_ptr<FSTMATCH> matcher) {
-  matcher_ = matcher;
-}
-
 } // namespace ctcdecode
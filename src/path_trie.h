@@ -1,43 +1,144 @@
 #pragma once
 
+#include <cstdint>
 #include <limits>
-#include <memory>
 #include <utility>
 #include <vector>
 
-#include <fst/fstlib.h>
+#include "lexicon.h"
 
 namespace ctcdecode {
 
-/* Trie tree for prefix storing and manipulating, with a dictionary in
- * finite-state transducer for spelling correction.
+class PathTrie;
+
+/* Free-list allocator for the nodes of a PathTrie.
+ *
+ * Nodes are carved out of fixed-size blocks. Removed nodes are recycled for
+ * the later expansions, and the blocks are returned to the system all at
+ * once when the pool is destroyed.
+ */
+class PathTriePool {
+public:
+  PathTriePool() = default;
+  PathTriePool(const PathTriePool &) = delete;
+  PathTriePool &operator=(const PathTriePool &) = delete;
+  ~PathTriePool();
+
+  // get a default-initialized node
+  PathTrie *allocate();
+
+  // give back a node which is no longer referenced
+  void release(PathTrie *node);
+
+  size_t num_allocated() const { return num_allocated_; }
+  size_t num_released() const { return num_released_; }
+  size_t num_live() const { return num_allocated_ - num_released_; }
+  // the highest number of nodes alive at the same time
+  size_t peak_live() const { return peak_live_; }
+
+private:
+  static constexpr size_t BLOCK_SIZE = 1024;
+
+  std::vector<PathTrie *> blocks_;
+  size_t num_used_in_block_ = BLOCK_SIZE;
+  PathTrie *free_list_ = nullptr;
+
+  size_t num_allocated_ = 0;
+  size_t num_released_ = 0;
+  size_t peak_live_ = 0;
+};
+
+/* Hash table from (parent, character) to the child node.
+ *
+ * Open addressing with linear probing, so that finding a child costs O(1)
+ * regardless of the number of children. One table is shared by all the nodes
+ * of a trie, so the lookups of a time step do not scan any child list.
+ */
+class PathTrieIndex {
+public:
+  PathTrieIndex();
+
+  // get the child of `parent` for `character`, or nullptr if there is none
+  PathTrie *find(const PathTrie *parent, int character) const;
+
+  // register a node under its parent and character
+  void insert(PathTrie *child);
+
+  // unregister a node
+  void erase(const PathTrie *child);
+
+  size_t size() const { return size_; }
+
+private:
+  struct Entry {
+    const PathTrie *parent;
+    int character;
+    PathTrie *child; // nullptr if the slot is empty
+  };
+
+  size_t home(const PathTrie *parent, int character) const;
+  void grow();
+
+  std::vector<Entry> entries_;
+  size_t mask_;
+  size_t size_ = 0;
+};
+
+/* Resources shared by all the nodes of one trie, so that nodes do not have
+ * to carry their own copies.
+ */
+struct PathTrieContext {
+  PathTriePool pool;
+  PathTrieIndex index;
+
+  // the words which prefixes are allowed to spell, or nullptr
+  const Lexicon *lexicon = nullptr;
+
+  // whether the log probabilities are added with `fast_log_sum_exp`
+  bool fast_math = false;
+};
+
+/* Trie tree for prefix storing and manipulating, optionally constrained to
+ * spell the words of a lexicon.
+ *
+ * The nodes other than the root are allocated from the pool of the context,
+ * children are found through the index of the context, and kept as an
+ * intrusive doubly-linked list for traversal, so that a node owns no memory
+ * by itself.
  */
 class PathTrie {
 public:
-  PathTrie();
-  ~PathTrie();
+  explicit PathTrie(PathTrieContext *context = nullptr);
 
-  // get new prefix after appending new char
+  // get new prefix after appending new char, or nullptr if the lexicon does
+  // not allow it. When `activated` is given, it is set to true if the
+  // returned prefix did not exist before the call.
   PathTrie *get_path_trie(int new_char, int new_timestep, float log_prob_c,
-                          bool reset = true);
+                          bool *activated = nullptr);
 
-  // get the prefix in index from root to current node
+  // append the prefix in index from root to current node
   PathTrie *get_path_vec(std::vector<int> &output, std::vector<int> &timesteps);
 
-  // get the prefix in index from some stop node to current nodel
+  // append the prefix in index from some stop node to current node
   PathTrie *get_path_vec(std::vector<int> &output, std::vector<int> &timesteps,
                          int stop,
                          size_t max_steps = std::numeric_limits<size_t>::max());
 
-  // update log probs
-  void iterate_to_vec(std::vector<PathTrie *> &output);
+  // Finalize the path shared by all the existing prefixes below this node.
+  // The labels between this node and the deepest common ancestor of the
+  // existing prefixes are appended to `output`, their nodes are released,
+  // and the ancestor becomes a child of this node. Returns the number of
+  // labels appended.
+  size_t commit_common_prefix(std::vector<int> &output,
+                              std::vector<int> &timesteps);
 
-  // set dictionary for FST
-  void set_dictionary(fst::StdVectorFst *dictionary);
+  // move the log probs of current time step to previous and update score
+  void update_score();
 
-  void set_matcher(std::shared_ptr<fst::SortedMatcher<fst::StdVectorFst>>);
+  // update log probs of all the existing prefixes in the trie
+  void iterate_to_vec(std::vector<PathTrie *> &output);
 
-  bool is_empty() { return ROOT_ == character; }
+  bool is_empty() const { return ROOT_ == character; }
 
   // remove current path from root
   void remove();
@@ -51,20 +152,25 @@ public:
   float approx_ctc;
   int character;
   int timestep;
+  // the language model state after the last completed word, or -1 until it is
+  // set by decoder
+  int lm_state;
+  // the spelling hash of the incomplete last word (set by decoder)
+  uint64_t word_hash;
+  // the score of the word completed by this node, if any (set by decoder)
+  float lm_score;
   PathTrie *parent;
 
 private:
-  int ROOT_;
-  bool exists_;
-  bool has_dictionary_;
+  static constexpr int ROOT_ = -1;
 
-  std::vector<std::pair<int, PathTrie *>> children_;
+  bool exists_;
+  uint32_t lexicon_state_;
 
-  // pointer to dictionary of FST
-  fst::StdVectorFst *dictionary_;
-  fst::StdVectorFst::StateId dictionary_state_;
-  // true if finding ars in FST
-  std::shared_ptr<fst::SortedMatcher<fst::StdVectorFst>> matcher_;
+  PathTrieContext *context_;
+  PathTrie *first_child_;
+  PathTrie *prev_sibling_;
+  PathTrie *next_sibling_;
 };
 
 } // namespace ctcdecode
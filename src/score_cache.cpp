@@ -0,0 +1,141 @@
+#include <algorithm>
+
+#include "score_cache.h"
+
+namespace ctcdecode {
+
+namespace {
+
+size_t get_num_sets(size_t capacity, size_t num_ways) {
+  // round up to a power of two, so that the set is picked with a mask
+  size_t num_sets = 0;
+  if (capacity > 0) {
+    num_sets = 1;
+    while (num_sets * num_ways < capacity) {
+      num_sets *= 2;
+    }
+  }
+  return num_sets;
+}
+
+uint64_t hash_key(const LanguageModel::State &state, uint32_t word) {
+  uint64_t h = LanguageModel::State::Hash()(state) ^
+               (static_cast<uint64_t>(word) << 32 | state.length);
+  // splitmix64 finalizer
+  h = (h ^ (h >> 30)) * 0xbf58476d1ce4e5b9ULL;
+  h = (h ^ (h >> 27)) * 0x94d049bb133111ebULL;
+  return h ^ (h >> 31);
+}
+
+} // namespace
+
+ScoreCache::ScoreCache(size_t capacity)
+    : num_sets_(get_num_sets(capacity, NUM_WAYS)),
+      capacity_(num_sets_ * NUM_WAYS), entries_(capacity_), hands_(num_sets_) {}
+
+void ScoreCache::bind(std::shared_ptr<const LanguageModel> language_model) {
+  std::vector<std::unique_lock<std::mutex>> locks;
+  for (auto &stripe : stripes_) {
+    locks.emplace_back(stripe.mutex);
+  }
+  if (language_model_ != language_model) {
+    language_model_ = std::move(language_model);
+    clear_locked();
+  }
+}
+
+float ScoreCache::score(const LanguageModel::State &state, uint32_t word,
+                        LanguageModel::State *next) {
+  if (num_sets_ == 0) {
+    return language_model_->score(state, word, next);
+  }
+  const uint64_t hash = hash_key(state, word);
+  const size_t set = hash & (num_sets_ - 1);
+  Entry *ways = &entries_[set * NUM_WAYS];
+  auto &stripe = stripes_[set % NUM_LOCKS];
+
+  {
+    std::lock_guard<std::mutex> lock(stripe.mutex);
+    for (size_t i = 0; i < NUM_WAYS; ++i) {
+      auto &entry = ways[i];
+      if (entry.used && entry.hash == hash && entry.word == word &&
+          entry.state == state) {
+        entry.referenced = true;
+        ++stripe.num_hits;
+        if (next != nullptr) {
+          *next = entry.next;
+        }
+        return entry.score;
+      }
+    }
+    ++stripe.num_misses;
+  }
+
+  // compute outside of the lock, so that the other threads are not blocked
+  LanguageModel::State next_state;
+  const float score = language_model_->score(state, word, &next_state);
+  if (next != nullptr) {
+    *next = next_state;
+  }
+
+  std::lock_guard<std::mutex> lock(stripe.mutex);
+  // give the referenced entries a second chance
+  auto &hand = hands_[set];
+  while (ways[hand].used && ways[hand].referenced) {
+    ways[hand].referenced = false;
+    hand = (hand + 1) % NUM_WAYS;
+  }
+  ways[hand] = {hash, state, word, score, next_state, true, false};
+  hand = (hand + 1) % NUM_WAYS;
+  return score;
+}
+
+void ScoreCache::clear() {
+  std::vector<std::unique_lock<std::mutex>> locks;
+  for (auto &stripe : stripes_) {
+    locks.emplace_back(stripe.mutex);
+  }
+  clear_locked();
+}
+
+void ScoreCache::clear_locked() {
+  for (auto &entry : entries_) {
+    entry.used = false;
+  }
+  std::fill(hands_.begin(), hands_.end(), 0);
+  for (auto &stripe : stripes_) {
+    stripe.num_hits = 0;
+    stripe.num_misses = 0;
+  }
+}
+
+size_t ScoreCache::size() const {
+  size_t size = 0;
+  for (size_t set = 0; set < num_sets_; ++set) {
+    std::lock_guard<std::mutex> lock(stripes_[set % NUM_LOCKS].mutex);
+    for (size_t i = 0; i < NUM_WAYS; ++i) {
+      size += entries_[set * NUM_WAYS + i].used;
+    }
+  }
+  return size;
+}
+
+uint64_t ScoreCache::num_hits() const {
+  uint64_t num_hits = 0;
+  for (auto &stripe : stripes_) {
+    std::lock_guard<std::mutex> lock(stripe.mutex);
+    num_hits += stripe.num_hits;
+  }
+  return num_hits;
+}
+
+uint64_t ScoreCache::num_misses() const {
+  uint64_t num_misses = 0;
+  for (auto &stripe : stripes_) {
+    std::lock_guard<std::mutex> lock(stripe.mutex);
+    num_misses += stripe.num_misses;
+  }
+  return num_misses;
+}
+
+} // namespace ctcdecode
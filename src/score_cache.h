@@ -0,0 +1,83 @@
+#pragma once
+
+#include <cstdint>
+#include <memory>
+#include <mutex>
+#include <vector>
+
+#include "language_model.h"
+
+namespace ctcdecode {
+
+/* Bounded cache of the language model scores, keyed by (state, word).
+ *
+ * Beams completing the same word in the same context query the model with
+ * the same arguments over and over, across time steps, batch items and calls.
+ * The cache keeps the results of these queries, so that they are computed
+ * once.
+ *
+ * The entries are organized as a set-associative table: a key can only be
+ * stored in the few ways of the set its hash points to, so a lookup touches
+ * one or two cache lines. When a set is full, an entry is evicted with the
+ * CLOCK algorithm (an approximation of LRU), which only needs to set a bit on
+ * a hit. The sets are guarded by striped mutexes, so that the threads
+ * decoding a batch rarely wait for each other.
+ *
+ * The cache is bound to the model it is used with, and the entries are
+ * dropped when it is bound to another one. So it should not be shared by
+ * decoders using different models.
+ */
+class ScoreCache {
+public:
+  // capacity: The maximum number of entries. (Rounded up to a power of two.)
+  explicit ScoreCache(size_t capacity);
+
+  // Use the cache for the given model, dropping the entries of other models.
+  void bind(std::shared_ptr<const LanguageModel> language_model);
+
+  // Same as `LanguageModel::score` of the bound model, but reuses the
+  // previous result if any.
+  float score(const LanguageModel::State &state, uint32_t word,
+              LanguageModel::State *next = nullptr);
+
+  // Drop all the entries and reset the counters.
+  void clear();
+
+  size_t capacity() const { return capacity_; }
+  size_t size() const;
+  uint64_t num_hits() const;
+  uint64_t num_misses() const;
+
+private:
+  static constexpr size_t NUM_WAYS = 4;
+  static constexpr size_t NUM_LOCKS = 64;
+
+  struct Entry {
+    uint64_t hash;
+    LanguageModel::State state;
+    uint32_t word;
+    float score;
+    LanguageModel::State next;
+    bool used;
+    bool referenced;
+  };
+
+  struct Stripe {
+    mutable std::mutex mutex;
+    uint64_t num_hits = 0;
+    uint64_t num_misses = 0;
+  };
+
+  // Drop the entries. All the stripes must be locked.
+  void clear_locked();
+
+  std::shared_ptr<const LanguageModel> language_model_;
+  const size_t num_sets_;
+  const size_t capacity_;
+  std::vector<Entry> entries_;
+  // the next way to inspect for eviction, per set
+  std::vector<uint8_t> hands_;
+  Stripe stripes_[NUM_LOCKS];
+};
+
+} // namespace ctcdecode
@@ -0,0 +1,22 @@
+#include "scorer.h"
+
+namespace ctcdecode {
+
+Scorer::Scorer(std::shared_ptr<const LanguageModel> language_model,
+               double alpha, double beta, std::shared_ptr<ScoreCache> cache)
+    : alpha(alpha), beta(beta), language_model_(std::move(language_model)),
+      cache_(std::move(cache)) {
+  if (cache_ != nullptr) {
+    cache_->bind(language_model_);
+  }
+}
+
+float Scorer::score(const LanguageModel::State &state, uint32_t word,
+                    LanguageModel::State *next) const {
+  const float score = cache_ != nullptr
+                          ? cache_->score(state, word, next)
+                          : language_model_->score(state, word, next);
+  return alpha * score + beta;
+}
+
+} // namespace ctcdecode
@@ -0,0 +1,44 @@
+#pragma once
+
+#include <cstdint>
+#include <memory>
+
+#include "language_model.h"
+#include "score_cache.h"
+
+namespace ctcdecode {
+
+/* External scorer for the shallow fusion of a word-level language model.
+ *
+ * When a prefix is extended with the word delimiter, the log probability of
+ * the completed word is weighted by `alpha` and `beta` is added as the word
+ * insertion bonus.
+ *
+ * When a cache is given, the scores are looked up from and stored to it.
+ */
+class Scorer {
+public:
+  Scorer(std::shared_ptr<const LanguageModel> language_model, double alpha,
+         double beta, std::shared_ptr<ScoreCache> cache = nullptr);
+
+  /* Get the weighted score of a word
+   *
+   * Parameters:
+   *     state: The context of the word.
+   *     word: The id of the word. (See `LanguageModel::word_id`.)
+   *     next: When given, set to the context after the word.
+   */
+  float score(const LanguageModel::State &state, uint32_t word,
+              LanguageModel::State *next = nullptr) const;
+
+  const LanguageModel &language_model() const { return *language_model_; }
+
+  const double alpha;
+  const double beta;
+
+private:
+  std::shared_ptr<const LanguageModel> language_model_;
+  std::shared_ptr<ScoreCache> cache_;
+};
+
+} // namespace ctcdecode
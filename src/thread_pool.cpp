@@ -0,0 +1,166 @@
+#include <algorithm>
+#include <atomic>
+#include <exception>
+#include <map>
+
+#include <unistd.h>
+
+#include "thread_pool.h"
+
+namespace ctcdecode {
+
+namespace {
+
+// The pool of the calling thread, if it is one of the threads of a pool.
+thread_local const ThreadPool *current_pool = nullptr;
+
+} // namespace
+
+ThreadPool::ThreadPool(size_t num_threads) {
+  threads_.reserve(num_threads);
+  for (size_t i = 0; i < num_threads; ++i) {
+    threads_.emplace_back([this] { work(); });
+  }
+}
+
+ThreadPool::~ThreadPool() {
+  {
+    std::lock_guard<std::mutex> lock(mutex_);
+    stop_ = true;
+  }
+  cond_.notify_all();
+  for (auto &thread : threads_) {
+    thread.join();
+  }
+}
+
+ThreadPool &ThreadPool::get(size_t num_threads) {
+  static std::mutex mutex;
+  // The pools are never destroyed: joining threads while the library is
+  // being unloaded at exit may deadlock.
+  static auto pools = new std::map<size_t, ThreadPool *>();
+  static pid_t pid = getpid();
+
+  std::lock_guard<std::mutex> lock(mutex);
+  if (pid != getpid()) {
+    // The threads do not survive fork. The pools of the parent process are
+    // abandoned, as they cannot be joined.
+    pools = new std::map<size_t, ThreadPool *>();
+    pid = getpid();
+  }
+  auto &pool = (*pools)[num_threads];
+  if (pool == nullptr) {
+    pool = new ThreadPool(num_threads);
+  }
+  return *pool;
+}
+
+void ThreadPool::submit(std::function<void()> task) {
+  {
+    std::lock_guard<std::mutex> lock(mutex_);
+    tasks_.push_back(std::move(task));
+  }
+  cond_.notify_one();
+}
+
+void ThreadPool::run(size_t num_items,
+                     const std::function<void(size_t)> &func) {
+  if (current_pool == this) {
+    // Called from one of the threads, e.g. by a callback of a Future
+    // completed there. It would wait for the items queued behind its own
+    // task, which may never run if all the threads wait the same way.
+    std::exception_ptr error;
+    for (size_t i = 0; i < num_items; ++i) {
+      try {
+        func(i);
+      } catch (...) {
+        if (!error) {
+          error = std::current_exception();
+        }
+      }
+    }
+    if (error) {
+      std::rethrow_exception(error);
+    }
+    return;
+  }
+
+  std::mutex mutex;
+  std::condition_variable cond;
+  bool finished = false;
+  std::exception_ptr error;
+  run_async(num_items, func, [&](std::exception_ptr e) {
+    // notified under the lock, as the caller destroys `cond` once woken
+    std::lock_guard<std::mutex> lock(mutex);
+    error = e;
+    finished = true;
+    cond.notify_one();
+  });
+
+  std::unique_lock<std::mutex> lock(mutex);
+  cond.wait(lock, [&] { return finished; });
+  if (error) {
+    std::rethrow_exception(error);
+  }
+}
+
+void ThreadPool::run_async(size_t num_items, std::function<void(size_t)> func,
+                           std::function<void(std::exception_ptr)> done) {
+  struct Job {
+    std::function<void(size_t)> func;
+    std::function<void(std::exception_ptr)> done;
+    size_t num_items;
+    std::atomic<size_t> next;
+    std::atomic<size_t> num_running;
+    std::mutex mutex;
+    std::exception_ptr error;
+  };
+  const size_t num_workers = std::min(size(), num_items);
+  if (num_workers == 0) {
+    done(nullptr);
+    return;
+  }
+  auto job = std::make_shared<Job>();
+  job->func = std::move(func);
+  job->done = std::move(done);
+  job->num_items = num_items;
+  job->next = 0;
+  job->num_running = num_workers;
+
+  for (size_t w = 0; w < num_workers; ++w) {
+    submit([job] {
+      for (size_t i = job->next++; i < job->num_items; i = job->next++) {
+        try {
+          job->func(i);
+        } catch (...) {
+          std::lock_guard<std::mutex> lock(job->mutex);
+          if (!job->error) {
+            job->error = std::current_exception();
+          }
+        }
+      }
+      if (--job->num_running == 0) {
+        job->done(job->error);
+      }
+    });
+  }
+}
+
+void ThreadPool::work() {
+  current_pool = this;
+  while (true) {
+    std::function<void()> task;
+    {
+      std::unique_lock<std::mutex> lock(mutex_);
+      cond_.wait(lock, [this] { return stop_ || !tasks_.empty(); });
+      if (tasks_.empty()) {
+        return;
+      }
+      task = std::move(tasks_.front());
+      tasks_.pop_front();
+    }
+    task();
+  }
+}
+
+} // namespace ctcdecode
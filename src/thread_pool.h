@@ -0,0 +1,71 @@
+#pragma once
+
+#include <condition_variable>
+#include <cstddef>
+#include <deque>
+#include <exception>
+#include <functional>
+#include <mutex>
+#include <thread>
+#include <vector>
+
+namespace ctcdecode {
+
+/* Fixed-size pool of decoder threads.
+ *
+ * The threads are separate from PyTorch's intra-op pool, so that decoding
+ * does not compete with the encoder for the same workers, and the number of
+ * threads is exactly the one requested.
+ *
+ * Pools are created on first use with `get` and kept for the lifetime of
+ * the process, so that threads are not spawned on every call.
+ */
+class ThreadPool {
+public:
+  explicit ThreadPool(size_t num_threads);
+  ~ThreadPool();
+
+  ThreadPool(const ThreadPool &) = delete;
+  ThreadPool &operator=(const ThreadPool &) = delete;
+
+  // Get the process-wide pool with the given number of threads. The pools
+  // are never destroyed, so each number used keeps its threads until exit.
+  static ThreadPool &get(size_t num_threads);
+
+  size_t size() const { return threads_.size(); }
+
+  // Queue a task. It is run by one of the threads as soon as one is free.
+  void submit(std::function<void()> task);
+
+  /* Call `func(i)` for `i` in `[0, num_items)`, and wait for all of them.
+   *
+   * The items are handed out one at a time, in increasing order, to
+   * whichever thread is free, so a long item does not hold back the items
+   * queued behind it. Ordering the items longest first minimizes the
+   * completion time. If some calls throw, the first exception is rethrown
+   * after all the calls have finished. When called from one of the threads
+   * of this pool, the calls are made in the calling thread instead, so that
+   * it does not wait for the pool it blocks.
+   */
+  void run(size_t num_items, const std::function<void(size_t)> &func);
+
+  /* Same as `run`, but returns without waiting.
+   *
+   * `done` is called once all the calls have finished, by the thread which
+   * finished last, with the first exception thrown, if any. `func` is kept
+   * until then.
+   */
+  void run_async(size_t num_items, std::function<void(size_t)> func,
+                 std::function<void(std::exception_ptr)> done);
+
+private:
+  void work();
+
+  std::vector<std::thread> threads_;
+  std::deque<std::function<void()>> tasks_;
+  std::mutex mutex_;
+  std::condition_variable cond_;
+  bool stop_ = false;
+};
+
+} // namespace ctcdecode
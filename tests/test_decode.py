@@ -1,10 +1,51 @@
 """Test decoders."""
+import asyncio
 import io
+import math
 import os
+import tempfile
+import threading
 import unittest
 
 import torch
-from simple_ctc import BeamSearchDecoder
+from simple_ctc import (
+    BeamSearchDecoder, DecodeClient, DecodeServer, compile_language_model, compile_lexicon)
+
+
+WAV2VEC2_ENGLISH_LABEL = [
+    '<s>',
+    '<pad>',
+    '</s>',
+    '<unk>',
+    '|',
+    'E',
+    'T',
+    'A',
+    'O',
+    'N',
+    'I',
+    'H',
+    'S',
+    'R',
+    'D',
+    'L',
+    'U',
+    'M',
+    'W',
+    'C',
+    'F',
+    'G',
+    'Y',
+    'P',
+    'B',
+    'V',
+    'K',
+    "'",
+    'X',
+    'J',
+    'Q',
+    'Z',
+]
 
 
 class TestDecoders(unittest.TestCase):
@@ -33,6 +74,17 @@ class TestDecoders(unittest.TestCase):
     def convert_to_string(self, tokens, vocab, seq_len):
         return ''.join([vocab[x] for x in tokens[0:seq_len]])
 
+    def get_arpa_words(self, path):
+        words = []
+        with open(path) as file_:
+            in_unigrams = False
+            for line in file_:
+                if line.startswith('\\'):
+                    in_unigrams = line.startswith('\\1-grams:')
+                elif in_unigrams and line.strip():
+                    words.append(line.split()[1])
+        return words
+
     def test_beam_search_decoder_1(self):
         probs_seq = torch.tensor([self.probs_seq1])
         decoder = BeamSearchDecoder(
@@ -51,17 +103,38 @@ class TestDecoders(unittest.TestCase):
         output_str = self.convert_to_string(beams[0][0], self.vocab_list, beam_lengths[0][0])
         self.assertEqual(output_str, self.beam_search_result[1])
 
-    @unittest.expectedFailure
     def test_beam_search_decoder_3(self):
         lm_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'test.arpa')
         probs_seq = torch.tensor([self.probs_seq2])
 
+        # The language model only scores the words, it does not restrict the
+        # spellings (see the lexicon test), so the beam has to be wide enough
+        # to keep a hypothesis made of its words, which then outscores the
+        # best one without the language model.
         decoder = BeamSearchDecoder(
-            self.vocab_list, beam_size=self.beam_size,
+            self.vocab_list, beam_size=100,
             blank_id=self.vocab_list.index('_'),
             model_path=lm_path)
         beams, beam_lengths, scores, timesteps = decoder(probs_seq)
         output_str = self.convert_to_string(beams[0][0], self.vocab_list, beam_lengths[0][0])
+        self.assertEqual(output_str.split(), ['a'])
+        output_str = self.convert_to_string(beams[0][1], self.vocab_list, beam_lengths[0][1])
+        self.assertEqual(output_str, self.beam_search_result[1])
+
+    def test_beam_search_decoder_lexicon_language_model(self):
+        lm_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'test.arpa')
+        probs_seq = torch.tensor([self.probs_seq2])
+
+        # the spellings are restricted to the words of the language model
+        with tempfile.TemporaryDirectory() as dir_:
+            lexicon_path = os.path.join(dir_, 'lexicon.bin')
+            compile_lexicon(self.get_arpa_words(lm_path), self.vocab_list, lexicon_path)
+            decoder = BeamSearchDecoder(
+                self.vocab_list, beam_size=self.beam_size,
+                blank_id=self.vocab_list.index('_'),
+                model_path=lm_path, alpha=0.5, beta=2.0, lexicon_path=lexicon_path)
+            beams, beam_lengths, scores, timesteps = decoder(probs_seq)
+        output_str = self.convert_to_string(beams[0][0], self.vocab_list, beam_lengths[0][0])
         self.assertEqual(output_str, self.beam_search_result[2])
 
     def test_beam_search_decoder_batch(self):
@@ -87,6 +160,221 @@ class TestDecoders(unittest.TestCase):
         self.assertEqual(output_str1, self.beam_search_result[0])
         self.assertEqual(output_str2, self.beam_search_result[1])
 
+    def test_beam_search_decoder_num_processes(self):
+        torch.manual_seed(0)
+        probs = torch.randn(5, 50, len(self.vocab_list)).log_softmax(-1)
+        seq_lens = torch.tensor([3, 50, 10, 1, 42], dtype=torch.int32)
+        outputs = []
+        # more threads than items, too
+        for num_processes in [1, 2, 8]:
+            decoder = BeamSearchDecoder(
+                self.vocab_list, beam_size=self.beam_size, blank_id=0,
+                is_nll=True, num_processes=num_processes)
+            outputs.append(decoder(probs, seq_lens))
+        for beams, beam_lengths, scores, timesteps in outputs[1:]:
+            for i in range(5):
+                for j in range(self.beam_size):
+                    self.assertEqual(
+                        self.convert_to_string(beams[i][j], self.vocab_list, beam_lengths[i][j]),
+                        self.convert_to_string(
+                            outputs[0][0][i][j], self.vocab_list, outputs[0][1][i][j]))
+        with self.assertRaises(RuntimeError):
+            BeamSearchDecoder(self.vocab_list, num_processes=0)(probs)
+
+    def test_beam_search_decoder_invalid_seq_lens(self):
+        probs = torch.rand(2, 10, len(self.vocab_list)).softmax(-1)
+        for beam_size in [4, 1]:
+            decoder = BeamSearchDecoder(self.vocab_list, beam_size=beam_size)
+            for seq_lens in [
+                    torch.tensor([-3, 10], dtype=torch.int32),
+                    torch.tensor([11, 10], dtype=torch.int32),
+                    torch.tensor([3, 10])]:
+                with self.assertRaises(RuntimeError):
+                    decoder.forward_ragged(probs, seq_lens)
+                with self.assertRaises(RuntimeError):
+                    decoder.forward_async(probs, seq_lens)
+
+    def test_beam_search_decoder_stats(self):
+        torch.manual_seed(0)
+        probs = torch.randn(3, 20, len(self.vocab_list)).log_softmax(-1)
+        seq_lens = torch.tensor([20, 5, 12], dtype=torch.int32)
+        decoder = BeamSearchDecoder(
+            self.vocab_list, beam_size=self.beam_size, blank_id=0, is_nll=True,
+            collect_stats=True)
+        with torch.profiler.profile() as prof:
+            decoder(probs, seq_lens)
+        names = {event.name for event in prof.events()}
+        for name in ['simple_ctc::prune', 'simple_ctc::search']:
+            self.assertIn(name, names)
+
+        stats = decoder.get_stats(clear=True)
+        self.assertEqual(stats['calls'], 1)
+        self.assertEqual(stats['sequences'], 3)
+        self.assertEqual(stats['frames'], 37)
+        self.assertGreater(stats['candidates'], stats['frames'])
+        self.assertGreater(stats['prefixes_expanded'], 0)
+        self.assertGreaterEqual(stats['nodes_allocated'], stats['peak_nodes'])
+        for key in ['prune_ns', 'expand_ns', 'select_ns', 'extract_ns']:
+            self.assertGreater(stats[key], 0)
+        self.assertEqual(decoder.get_stats()['frames'], 0)
+
+        scripted = torch.jit.script(decoder)
+        scripted.forward_ragged(probs, seq_lens)
+        self.assertEqual(scripted.get_stats()['sequences'], 3)
+        with self.assertRaises(RuntimeError):
+            BeamSearchDecoder(self.vocab_list).get_stats()
+
+    def test_greedy_decoder(self):
+        torch.manual_seed(0)
+        probs = torch.randn(4, 30, len(self.vocab_list)).softmax(-1)
+        seq_lens = torch.tensor([30, 0, 7, 19], dtype=torch.int32)
+        decoder = BeamSearchDecoder(self.vocab_list, beam_size=1, blank_id=0)
+        self.assertTrue(decoder.greedy)
+        tokens, offsets, scores, timesteps = decoder.forward_ragged(probs, seq_lens)
+        beams, lengths, dense_scores, dense_timesteps = decoder(probs, seq_lens)
+        for i in range(4):
+            values, labels = probs[i, :seq_lens[i]].max(-1)
+            expected, expected_timesteps = [], []
+            for t, label in enumerate(labels.tolist()):
+                if t > 0 and label == labels[t - 1]:
+                    if label != 0 and values[t] > values[expected_timesteps[-1]]:
+                        expected_timesteps[-1] = t
+                elif label != 0:
+                    expected.append(label)
+                    expected_timesteps.append(t)
+            begin, end = offsets[i], offsets[i + 1]
+            self.assertEqual(tokens[begin:end].tolist(), expected)
+            self.assertEqual(timesteps[begin:end].tolist(), expected_timesteps)
+            self.assertAlmostEqual(float(scores[i][0]), -float(values.log().sum()), places=4)
+            self.assertEqual(beams[i][0][:lengths[i][0]].tolist(), expected)
+            self.assertEqual(dense_timesteps[i][0][:lengths[i][0]].tolist(), expected_timesteps)
+        self.assertEqual(dense_scores.tolist(), scores.tolist())
+
+        scripted = torch.jit.script(decoder)
+        async_beams, async_lengths, _, _ = scripted.forward_async(probs, seq_lens).wait()
+        self.assertEqual(async_lengths.tolist(), lengths.tolist())
+        for i in range(4):
+            self.assertEqual(
+                async_beams[i][0][:lengths[i][0]].tolist(), beams[i][0][:lengths[i][0]].tolist())
+        self.assertEqual(
+            scripted.transcribe(probs, seq_lens).transcripts,
+            [[''.join(self.vocab_list[j] for j in tokens[offsets[i]:offsets[i + 1]]).strip()]
+             for i in range(4)])
+        decoder = BeamSearchDecoder(
+            self.vocab_list, beam_size=1, blank_id=self.vocab_list.index('_'))
+        beams, lengths, _, _ = decoder(torch.tensor([self.probs_seq1, self.probs_seq2]))
+        for i in range(2):
+            self.assertEqual(
+                self.convert_to_string(beams[i][0], self.vocab_list, lengths[i][0]),
+                self.greedy_result[i])
+
+        with tempfile.TemporaryDirectory() as dir_:
+            lexicon_path = os.path.join(dir_, 'lexicon.bin')
+            compile_lexicon(['ab'], self.vocab_list, lexicon_path)
+            self.assertFalse(
+                BeamSearchDecoder(self.vocab_list, beam_size=1, lexicon_path=lexicon_path).greedy)
+
+        # the options of the search keep the search
+        for kwargs in [
+                {'blank_skip_threshold': 0.999}, {'long_form': True},
+                {'segment_min_blank_frames': 3}, {'collect_stats': True}]:
+            self.assertFalse(BeamSearchDecoder(self.vocab_list, beam_size=1, **kwargs).greedy)
+        decoder = BeamSearchDecoder(self.vocab_list, beam_size=1, collect_stats=True)
+        decoder(probs, seq_lens)
+        self.assertEqual(decoder.get_stats()['sequences'], 4)
+
+        # checked on every call
+        decoder = BeamSearchDecoder(self.vocab_list, beam_size=3, nbest=1, blank_id=0)
+        self.assertFalse(decoder.greedy)
+        decoder.beam_size = 1
+        self.assertTrue(decoder.greedy)
+
+        # on the decoder threads, within `max_in_flight`
+        decoder = BeamSearchDecoder(self.vocab_list, beam_size=1, blank_id=0, max_in_flight=1)
+        futures = [decoder.forward_async(probs, seq_lens) for _ in range(3)]
+        for future in futures:
+            self.assertEqual(future.wait()[1].tolist(), async_lengths.tolist())
+        self.assertEqual(decoder.in_flight.available(), 1)
+
+    def test_beam_search_decoder_nbest(self):
+        probs_seq = torch.tensor([self.probs_seq1, self.probs_seq2])
+        decoder = BeamSearchDecoder(
+            self.vocab_list, beam_size=self.beam_size,
+            blank_id=self.vocab_list.index('_'), nbest=3)
+        beams, beam_lengths, scores, timesteps = decoder(probs_seq)
+        self.assertEqual(beams.shape[:2], (2, 3))
+        self.assertEqual(scores.shape, (2, 3))
+
+        tokens, offsets, ragged_scores, ragged_timesteps = decoder.forward_ragged(probs_seq)
+        self.assertEqual(offsets.shape, (2 * 3 + 1,))
+        self.assertEqual(int(offsets[-1]), tokens.numel())
+        for i in range(2):
+            for j in range(3):
+                begin, end = offsets[i * 3 + j], offsets[i * 3 + j + 1]
+                length = beam_lengths[i][j]
+                self.assertEqual(tokens[begin:end].tolist(), beams[i][j][:length].tolist())
+                self.assertEqual(
+                    ragged_timesteps[begin:end].tolist(), timesteps[i][j][:length].tolist())
+        self.assertTrue(torch.equal(ragged_scores, scores))
+
+        result = decoder.decode(probs_seq)
+        self.assertEqual(len(result.label_sequences[0]), 3)
+        self.assertEqual(''.join(result.label_sequences[0][0]), self.beam_search_result[0])
+        self.assertEqual(''.join(result.label_sequences[1][0]), self.beam_search_result[1])
+
+        result = decoder.transcribe(probs_seq, word_separator='_')
+        self.assertEqual(result.transcripts[0][0], self.beam_search_result[0].replace(' ', '_'))
+        self.assertEqual(result.transcripts[1][0], self.beam_search_result[1].replace(' ', '_'))
+        self.assertEqual(result.scores[1], scores[1].tolist())
+
+    def test_beam_search_decoder_cutoff_prob(self):
+        # Only the most likely label of each frame is retained, so the search
+        # reduces to the greedy decoding.
+        probs_seq = torch.tensor([self.probs_seq1, self.probs_seq2])
+        for is_nll in [False, True]:
+            decoder = BeamSearchDecoder(
+                self.vocab_list, beam_size=self.beam_size, cutoff_prob=0.01,
+                blank_id=self.vocab_list.index('_'), is_nll=is_nll)
+            beams, beam_lengths, scores, timesteps = decoder(
+                probs_seq.log() if is_nll else probs_seq)
+            for i in range(2):
+                output_str = self.convert_to_string(beams[i][0], self.vocab_list, beam_lengths[i][0])
+                self.assertEqual(output_str, self.greedy_result[i])
+
+            stream = decoder.stream()
+            stream.next(probs_seq[1].log() if is_nll else probs_seq[1])
+            beams, beam_lengths, scores, timesteps = stream.decode()
+            output_str = self.convert_to_string(beams[0], self.vocab_list, beam_lengths[0])
+            self.assertEqual(output_str, self.greedy_result[1])
+
+    def test_beam_search_decoder_non_contiguous(self):
+        probs_seq = torch.tensor([self.probs_seq1, self.probs_seq2])
+        probs_seq = probs_seq.transpose(0, 1).contiguous().transpose(0, 1)
+        self.assertFalse(probs_seq.is_contiguous())
+        decoder = BeamSearchDecoder(
+            self.vocab_list, beam_size=self.beam_size,
+            blank_id=self.vocab_list.index('_'), num_processes=24)
+        beams, beam_lengths, scores, timesteps = decoder(probs_seq)
+        output_str1 = self.convert_to_string(beams[0][0], self.vocab_list, beam_lengths[0][0])
+        output_str2 = self.convert_to_string(beams[1][0], self.vocab_list, beam_lengths[1][0])
+        self.assertEqual(output_str1, self.beam_search_result[0])
+        self.assertEqual(output_str2, self.beam_search_result[1])
+
+    def test_beam_search_decoder_dtypes(self):
+        probs_seq = torch.tensor([self.probs_seq1, self.probs_seq2])
+        decoder = BeamSearchDecoder(
+            self.vocab_list, beam_size=self.beam_size,
+            blank_id=self.vocab_list.index('_'), num_processes=24)
+        for dtype in [torch.float64, torch.float16, torch.bfloat16]:
+            # The result must match the one of the same values given in float32
+            expected = decoder(probs_seq.to(dtype).float())
+            beams, beam_lengths, scores, timesteps = decoder(probs_seq.to(dtype))
+            self.assertTrue(torch.equal(beam_lengths, expected[1]))
+            for b in range(beams.size(0)):
+                for i in range(beams.size(1)):
+                    length = beam_lengths[b, i]
+                    self.assertTrue(torch.equal(beams[b, i, :length], expected[0][b, i, :length]))
+
     def test_torchscript(self):
         probs_seq = torch.tensor([self.probs_seq1, self.probs_seq2])
 
@@ -104,41 +392,371 @@ class TestDecoders(unittest.TestCase):
         self.assertEqual(''.join(result.label_sequences[0][0]), self.beam_search_result[0])
         self.assertEqual(''.join(result.label_sequences[1][0]), self.beam_search_result[1])
 
-    def test_decode_wav2vec2_sample():
-        WAV2VEC2_ENGLISH_LABEL = [
-            '<s>',
-            '<pad>',
-            '</s>',
-            '<unk>',
-            '|',
-            'E',
-            'T',
-            'A',
-            'O',
-            'N',
-            'I',
-            'H',
-            'S',
-            'R',
-            'D',
-            'L',
-            'U',
-            'M',
-            'W',
-            'C',
-            'F',
-            'G',
-            'Y',
-            'P',
-            'B',
-            'V',
-            'K',
-            "'",
-            'X',
-            'J',
-            'Q',
-            'Z',
+    def test_decode_async(self):
+        probs_seq = torch.tensor([self.probs_seq1, self.probs_seq2])
+        decoder = BeamSearchDecoder(
+            self.vocab_list, beam_size=self.beam_size,
+            blank_id=self.vocab_list.index('_'), max_in_flight=2,
+        )
+        futures = [decoder.forward_async(probs_seq) for _ in range(4)]
+        for future in torch.futures.wait_all(futures):
+            beams, beam_lengths, scores, timesteps = future
+            for i in range(2):
+                output_str = self.convert_to_string(beams[i][0], self.vocab_list, beam_lengths[i][0])
+                self.assertEqual(output_str, self.beam_search_result[i])
+        self.assertEqual(decoder.in_flight.available(), 2)
+
+        # the input can be reused once the call returns, even if all the
+        # labels are kept, and the frames are read in place, and with the
+        # best path. The thread is kept busy, so that the decoding only
+        # starts after the reuse.
+        busy_decoder = BeamSearchDecoder(
+            self.vocab_list, beam_size=self.beam_size,
+            blank_id=self.vocab_list.index('_'), is_nll=True, num_processes=1,
+        )
+        for beam_size, expected in [
+                (self.beam_size, self.beam_search_result), (1, self.greedy_result)]:
+            nll_decoder = BeamSearchDecoder(
+                self.vocab_list, beam_size=beam_size,
+                blank_id=self.vocab_list.index('_'), is_nll=True, num_processes=1,
+            )
+            busy = busy_decoder.forward_async(torch.randn(1, 3000, len(self.vocab_list)))
+            log_probs = probs_seq.log()
+            future = nll_decoder.forward_async(log_probs)
+            log_probs.fill_(0.0)
+            busy.wait()
+            beams, beam_lengths, scores, timesteps = future.wait()
+            for i in range(2):
+                output_str = self.convert_to_string(beams[i][0], self.vocab_list, beam_lengths[i][0])
+                self.assertEqual(output_str, expected[i])
+
+        # the scores of the missing beams are `inf` in all the formats
+        # (one frame with cutoff_top_n=1 yields only two beams)
+        one_beam = BeamSearchDecoder(
+            self.vocab_list, beam_size=10, cutoff_top_n=1,
+            blank_id=self.vocab_list.index('_'))
+        one_frame = probs_seq[:, :1]
+        expected = one_beam.decode(one_frame).scores
+        self.assertTrue(all(math.isinf(score) for scores in expected for score in scores[2:]))
+        self.assertEqual(asyncio.run(one_beam.decode_async(one_frame)).scores, expected)
+        self.assertEqual(one_beam.forward_async(one_frame).wait()[2].tolist(), expected)
+        self.assertEqual(one_beam(one_frame)[2].tolist(), expected)
+
+        async def _decode():
+            return await asyncio.gather(*[decoder.decode_async(probs_seq) for _ in range(3)])
+
+        for result in asyncio.run(_decode()):
+            self.assertEqual(''.join(result.label_sequences[0][0]), self.beam_search_result[0])
+            self.assertEqual(''.join(result.label_sequences[1][0]), self.beam_search_result[1])
+
+        buffer_ = io.BytesIO()
+        torch.jit.save(torch.jit.script(decoder), buffer_)
+        buffer_.seek(0)
+        decoder = torch.jit.load(buffer_)
+        beams, beam_lengths, scores, timesteps = decoder.forward_async(probs_seq).wait()
+        output_str = self.convert_to_string(beams[1][0], self.vocab_list, beam_lengths[1][0])
+        self.assertEqual(output_str, self.beam_search_result[1])
+
+    def test_decode_async_chained(self):
+        # the callbacks run on the decoder threads, and decode there
+        probs_seq = torch.tensor([self.probs_seq1, self.probs_seq2])
+        results = []
+
+        def _decode(num_processes, num_chains):
+            decoder = BeamSearchDecoder(
+                self.vocab_list, beam_size=self.beam_size,
+                blank_id=self.vocab_list.index('_'), num_processes=num_processes)
+            futures = [
+                decoder.forward_async(probs_seq).then(lambda _: decoder(probs_seq))
+                for _ in range(num_chains)]
+            results.extend(future.wait() for future in futures)
+
+        for num_processes, num_chains in [(1, 1), (2, 4)]:
+            thread = threading.Thread(target=_decode, args=(num_processes, num_chains), daemon=True)
+            thread.start()
+            thread.join(timeout=60)
+            self.assertFalse(thread.is_alive())
+        self.assertEqual(len(results), 5)
+        for beams, beam_lengths, scores, timesteps in results:
+            for i in range(2):
+                output_str = self.convert_to_string(beams[i][0], self.vocab_list, beam_lengths[i][0])
+                self.assertEqual(output_str, self.beam_search_result[i])
+
+    def test_decode_service(self):
+        torch.manual_seed(0)
+        probs = torch.randn(6, 30, len(self.vocab_list)).log_softmax(-1)
+        seq_lens = [30, 12, 1, 25, 0, 7]
+        decoder = BeamSearchDecoder(
+            self.vocab_list, beam_size=self.beam_size, blank_id=0, is_nll=True,
+            nbest=3, max_in_flight=1, collect_stats=True)
+        with tempfile.TemporaryDirectory() as dir_:
+            address = os.path.join(dir_, 'decoder.sock')
+            with DecodeServer(decoder, address, authkey=b'key', max_batch_size=4):
+                # requests of both clients are batched together
+                with DecodeClient(address, b'key') as client1, \
+                        DecodeClient(address, b'key', max_in_flight=1) as client2:
+                    futures = [
+                        (client1 if i % 2 else client2).submit(probs[i, :seq_lens[i]])
+                        for i in range(6)]
+                    for i, future in enumerate(futures):
+                        tokens, offsets, scores, timesteps = future.result()
+                        ref = decoder.forward_ragged(probs[i:i + 1, :seq_lens[i]])
+                        self.assertTrue(torch.equal(tokens, ref[0]))
+                        self.assertTrue(torch.equal(offsets, ref[1]))
+                        self.assertTrue(torch.equal(scores, ref[2]))
+                        self.assertTrue(torch.equal(timesteps, ref[3]))
+                    stats = decoder.get_stats(clear=True)
+                    self.assertEqual(stats['sequences'], 2 * 6)
+
+                    with self.assertRaises(TimeoutError):
+                        client1.decode(probs[0], timeout=-1)
+                    # the blocks are reused, or replaced when too small, also the
+                    # one of a rejected request
+                    with DecodeClient(address, b'key') as client3:
+                        with self.assertRaises(RuntimeError):
+                            client3.decode(probs[0, :, :3])
+                        # larger than the minimum size of the blocks, 1 MB
+                        emission = probs.reshape(-1, probs.size(-1)).repeat(220, 1)
+                        self.assertGreater(4 * emission.numel(), 1 << 20)
+                        tokens, _, _, _ = client3.decode(emission)
+                        self.assertGreater(tokens.numel(), 0)
+                        tokens, _, _, _ = client3.decode(probs[0])
+                        self.assertGreater(tokens.numel(), 0)
+
+                with self.assertRaises(RuntimeError):
+                    client1.submit(probs[0])
+                with self.assertRaises(Exception):
+                    DecodeClient(address, b'wrong key')
+
+            # closed while the clients are blocked on the full queue
+            address = os.path.join(dir_, 'full.sock')
+            server = DecodeServer(
+                decoder, address, max_batch_size=2, max_pending=1, max_in_flight=1).start()
+            clients = [DecodeClient(address) for _ in range(4)]
+            futures = [client.submit(probs[0]) for client in clients for _ in range(4)]
+            server.close()
+            for future in futures:
+                try:
+                    future.result(timeout=10)
+                except RuntimeError:
+                    pass
+            for client in clients:
+                client.close()
+
+    def test_streaming(self):
+        decoder = BeamSearchDecoder(
+            self.vocab_list, beam_size=self.beam_size,
+            blank_id=self.vocab_list.index('_'))
+        for probs, expected in [(self.probs_seq1, self.beam_search_result[0]),
+                                (self.probs_seq2, self.beam_search_result[1])]:
+            probs = torch.tensor(probs)
+            ref = decoder(probs.unsqueeze(0))
+            stream = decoder.stream()
+            for chunk in probs.split(4):
+                stream.next(chunk)
+            self.assertEqual(stream.num_frames(), probs.size(0))
+            beams, beam_lengths, scores, timesteps = stream.decode()
+            output_str = self.convert_to_string(beams[0], self.vocab_list, beam_lengths[0])
+            self.assertEqual(output_str, expected)
+            self.assertTrue(torch.equal(beam_lengths, ref[1][0]))
+            self.assertTrue(torch.equal(scores, ref[2][0]))
+
+            stats = stream.stats()
+            self.assertGreater(stats['peak_nodes'], 0)
+            self.assertLessEqual(stats['peak_nodes'], stats['nodes_allocated'])
+            self.assertLessEqual(stats['nodes_freed'], stats['nodes_allocated'])
+
+            stream.reset()
+            self.assertEqual(stream.num_frames(), 0)
+
+    def test_streaming_torchscript(self):
+        decoder = BeamSearchDecoder(
+            self.vocab_list, beam_size=self.beam_size,
+            blank_id=self.vocab_list.index('_'))
+
+        buffer_ = io.BytesIO()
+        torch.jit.save(torch.jit.script(decoder), buffer_)
+        buffer_.seek(0)
+        decoder = torch.jit.load(buffer_)
+
+        stream = decoder.stream()
+        for chunk in torch.tensor(self.probs_seq1).split(1):
+            stream.next(chunk)
+        beams, beam_lengths, scores, timesteps = stream.decode()
+        output_str = self.convert_to_string(beams[0], self.vocab_list, beam_lengths[0])
+        self.assertEqual(output_str, self.beam_search_result[0])
+
+    def test_language_model_score(self):
+        lm_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'test.arpa')
+        lm = torch.classes.simple_ctc.LanguageModel(lm_path)
+        self.assertEqual(lm.order(), 5)
+        self.assertEqual(lm.vocab_size(), 37)
+        # explicit n-grams: "<s> looking" and "<s> looking on"
+        self.assertAlmostEqual(
+            lm.score(['looking', 'on'], False), (-0.4846522 - 0.3488368) * math.log(10), places=5)
+        # back-off: "<s> biarritz" and "biarritz </s>"
+        self.assertAlmostEqual(
+            lm.score(['biarritz'], True),
+            (-0.4149733 - 1.687872 - 0.30103 - 1.029493) * math.log(10), places=5)
+        self.assertEqual(lm.score(['xyz'], False), -1000)
+
+    def test_language_model_binary(self):
+        lm_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'test.arpa')
+        sentences = [
+            ['looking', 'on', 'a', 'little', 'more', 'loin'],
+            ['also', 'would', 'consider', 'higher', 'looking'],
+            ['the', 'screening', 'a', 'little', 'xyz', 'more'],
         ]
+        arpa = torch.classes.simple_ctc.LanguageModel(lm_path)
+        with tempfile.TemporaryDirectory() as dir_:
+            bin_path = os.path.join(dir_, 'test.bin')
+            compile_language_model(lm_path, bin_path)
+            binary = torch.classes.simple_ctc.LanguageModel(bin_path)
+            self.assertFalse(arpa.is_mapped())
+            self.assertTrue(binary.is_mapped())
+            self.assertEqual(binary.size(), os.path.getsize(bin_path))
+            for words in sentences:
+                self.assertEqual(arpa.score(words, True), binary.score(words, True))
+            del binary
+
+    def test_beam_search_decoder_language_model(self):
+        lm_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'test.arpa')
+        vocab_list = ['_', ' ', 'o', 'n']
+        # "no" is slightly more likely than "on", but it is not in the model.
+        probs_seq = torch.tensor([[
+            [0.05, 0.05, 0.40, 0.50],
+            [0.05, 0.05, 0.50, 0.40],
+        ]])
+        decoder = BeamSearchDecoder(vocab_list, beam_size=self.beam_size)
+        beams, beam_lengths, scores, timesteps = decoder(probs_seq)
+        self.assertEqual(self.convert_to_string(beams[0][0], vocab_list, beam_lengths[0][0]), 'no')
+
+        decoder = BeamSearchDecoder(vocab_list, beam_size=self.beam_size, model_path=lm_path)
+        beams, beam_lengths, scores, timesteps = decoder(probs_seq)
+        self.assertEqual(self.convert_to_string(beams[0][0], vocab_list, beam_lengths[0][0]), 'on')
+
+        # the weights are the ones of the context, which is replaced on assignment
+        decoder.alpha = decoder.beta = 0.0
+        self.assertEqual((decoder.context.alpha(), decoder.context.beta()), (0.0, 0.0))
+        self.assertIsNotNone(decoder.language_model)
+        beams_, beam_lengths_, _, _ = decoder(probs_seq)
+        self.assertEqual(self.convert_to_string(beams_[0][0], vocab_list, beam_lengths_[0][0]), 'no')
+        decoder.alpha, decoder.beta = 0.5, 1.0
+
+        stream = decoder.stream()
+        stream.next(probs_seq[0])
+        beams_, beam_lengths_, scores_, timesteps_ = stream.decode()
+        self.assertEqual(scores_[:3].tolist(), scores[0, :3].tolist())
+
+        buffer_ = io.BytesIO()
+        torch.jit.save(torch.jit.script(decoder), buffer_)
+        buffer_.seek(0)
+        decoder = torch.jit.load(buffer_)
+        beams_, beam_lengths_, scores_, timesteps_ = decoder(probs_seq)
+        self.assertEqual(scores_[:, :3].tolist(), scores[:, :3].tolist())
+
+    def test_beam_search_decoder_lm_cache(self):
+        lm_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'test.arpa')
+        probs_seq = torch.tensor([self.probs_seq1, self.probs_seq2])
+        decoder = BeamSearchDecoder(
+            self.vocab_list, beam_size=self.beam_size,
+            blank_id=self.vocab_list.index('_'), model_path=lm_path, lm_cache_size=0)
+        self.assertIsNone(decoder.lm_cache)
+        expected = decoder(probs_seq)
+
+        decoder = BeamSearchDecoder(
+            self.vocab_list, beam_size=self.beam_size,
+            blank_id=self.vocab_list.index('_'), model_path=lm_path, lm_cache_size=100)
+        for i in range(2):
+            beams, beam_lengths, scores, timesteps = decoder(probs_seq)
+            self.assertEqual(scores[:, :5].tolist(), expected[2][:, :5].tolist())
+            stats = decoder.lm_cache.stats()
+            self.assertEqual(stats['capacity'], 128)
+            self.assertLessEqual(stats['size'], stats['capacity'])
+            if i == 0:
+                num_misses = stats['misses']
+                self.assertGreater(num_misses, 0)
+        # the second call only reuses the scores of the first one
+        self.assertEqual(stats['misses'], num_misses)
+        self.assertGreater(stats['hits'], 0)
+
+        # entries are evicted, but the result does not change
+        decoder = BeamSearchDecoder(
+            self.vocab_list, beam_size=self.beam_size,
+            blank_id=self.vocab_list.index('_'), model_path=lm_path, lm_cache_size=1)
+        beams, beam_lengths, scores, timesteps = decoder(probs_seq)
+        self.assertEqual(scores[:, :5].tolist(), expected[2][:, :5].tolist())
+        self.assertLessEqual(decoder.lm_cache.stats()['size'], 4)
+
+    def test_beam_search_decoder_lexicon(self):
+        words = ['ab', 'abc', 'ca', "'d"]
+        probs_seq = torch.tensor([self.probs_seq1, self.probs_seq2])
+        with tempfile.TemporaryDirectory() as dir_:
+            lexicon_path = os.path.join(dir_, 'lexicon.bin')
+            compile_lexicon(words + ['xyz'], self.vocab_list, lexicon_path)
+            decoder = BeamSearchDecoder(
+                self.vocab_list, beam_size=self.beam_size,
+                blank_id=self.vocab_list.index('_'), lexicon_path=lexicon_path)
+            self.assertEqual(decoder.lexicon.num_words(), len(words))
+            self.assertTrue(decoder.lexicon.is_mapped())
+            beams, beam_lengths, scores, timesteps = decoder(probs_seq)
+            stream = decoder.stream()
+            stream.next(probs_seq[1])
+            stream_beams, stream_lengths, _, _ = stream.decode()
+
+            with self.assertRaises(RuntimeError):
+                BeamSearchDecoder(self.vocab_list[::-1], lexicon_path=lexicon_path)(probs_seq)
+
+        for i in range(2):
+            for j in range(self.beam_size):
+                output_str = self.convert_to_string(beams[i][j], self.vocab_list, beam_lengths[i][j])
+                # every completed word, and the last one partially, is in the lexicon
+                *completed, last = output_str.split(' ')
+                self.assertTrue(all(w in words for w in completed), output_str)
+                self.assertTrue(any(w.startswith(last) for w in words), output_str)
+        for j in range(self.beam_size):
+            self.assertEqual(
+                self.convert_to_string(stream_beams[j], self.vocab_list, stream_lengths[j]),
+                self.convert_to_string(beams[1][j], self.vocab_list, beam_lengths[1][j]))
+
+    def test_decoder_context(self):
+        lm_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'test.arpa')
+        probs_seq = torch.tensor([self.probs_seq1, self.probs_seq2])
+        decoder = BeamSearchDecoder(
+            self.vocab_list, beam_size=self.beam_size,
+            blank_id=self.vocab_list.index('_'), model_path=lm_path)
+        expected = decoder(probs_seq)
+        context = decoder.context
+        self.assertEqual(context.num_labels(), len(self.vocab_list))
+        self.assertGreater(context.lm_cache().stats()['size'], 0)
+
+        # shared read-only by the calls from multiple threads
+        futures = [
+            torch.jit.fork(
+                torch.ops.simple_ctc.beam_search_decode, probs_seq, None, context,
+                self.beam_size, 40, None, False, 1, None, self.beam_size, None, False, False,
+                None, 0.999, None)
+            for _ in range(4)]
+        for future in futures:
+            beams, lengths, scores, _ = future.wait()
+            self.assertEqual(lengths.tolist(), expected[1].tolist())
+            self.assertEqual(scores.tolist(), expected[2].tolist())
+
+        # serialized once, so the score cache is still shared after loading
+        file = io.BytesIO()
+        torch.jit.save(torch.jit.script(decoder), file)
+        file.seek(0)
+        scripted = torch.jit.load(file)
+        scripted.context.lm_cache().clear()
+        scores = scripted(probs_seq)[2]
+        self.assertEqual(scores.tolist(), expected[2].tolist())
+        self.assertGreater(scripted.context.lm_cache().stats()['misses'], 0)
+
+        with self.assertRaises(RuntimeError):
+            torch.classes.simple_ctc.DecoderContext(
+                self.vocab_list, len(self.vocab_list), ' ', None, 0.0, 0.0, None, None)
+
+    def test_decode_wav2vec2_sample(self):
         encoder_output = torch.load(
             os.path.join(
                 os.path.dirname(__file__),
@@ -159,6 +777,242 @@ class TestDecoders(unittest.TestCase):
         transcript = "".join(results.label_sequences[0][0])
         assert transcript == 'ALSO|A|POPULAR|CONTRIVANCE|WHEREBY|LOVE|MAKING|MAY|BE|SUSPENDED|BUT|NOT|STOPPED|DURING|THE|PICNIC|SEASON|'
 
+        decoder = BeamSearchDecoder(
+            WAV2VEC2_ENGLISH_LABEL, blank_id=0, is_nll=True, word_delimiter='|', nbest=1)
+        transcript = decoder.transcribe(encoder_output).transcripts[0][0]
+        assert transcript == 'ALSO A POPULAR CONTRIVANCE WHEREBY LOVE MAKING MAY BE SUSPENDED BUT NOT STOPPED DURING THE PICNIC SEASON'
+
+    def test_decode_wav2vec2_sample_blank_skip(self):
+        encoder_output = torch.load(
+            os.path.join(
+                os.path.dirname(__file__),
+                'librispeech-test-clean-121-121726-0000-with-wav2vec_small_960h.pt',
+            )
+        ).detach()
+        outputs = []
+        for blank_skip_threshold in [None, 0.999]:
+            decoder = BeamSearchDecoder(
+                WAV2VEC2_ENGLISH_LABEL, beam_size=100, blank_id=0, is_nll=True,
+                blank_skip_threshold=blank_skip_threshold)
+            beams, lengths, scores, timesteps = decoder(encoder_output)
+            length = lengths[0][0]
+            outputs.append((beams[0][0][:length], timesteps[0][0][:length]))
+
+        # timesteps are the indices of the original frames
+        self.assertEqual(outputs[0][0].tolist(), outputs[1][0].tolist())
+        self.assertEqual(outputs[0][1].tolist(), outputs[1][1].tolist())
+
+        stream = decoder.stream()
+        for chunk in encoder_output[0].split(100):
+            stream.next(chunk)
+        beams, lengths, scores, timesteps = stream.decode()
+        self.assertEqual(beams[0][:lengths[0]].tolist(), outputs[1][0].tolist())
+        self.assertGreater(stream.stats()['frames_skipped'], encoder_output.size(1) // 2)
+
+    def test_decode_wav2vec2_sample_beam_threshold(self):
+        encoder_output = torch.load(
+            os.path.join(
+                os.path.dirname(__file__),
+                'librispeech-test-clean-121-121726-0000-with-wav2vec_small_960h.pt',
+            )
+        ).detach().log_softmax(-1)
+        outputs = []
+        for beam_threshold in [None, 20.0]:
+            decoder = BeamSearchDecoder(
+                WAV2VEC2_ENGLISH_LABEL, beam_size=100, blank_id=0, is_nll=True,
+                beam_threshold=beam_threshold, collect_stats=True)
+            beams, lengths, scores, timesteps = decoder(encoder_output)
+            length = lengths[0][0]
+            outputs.append((beams[0][0][:length], scores[0][0], decoder.get_stats()))
+
+        self.assertEqual(outputs[0][0].tolist(), outputs[1][0].tolist())
+        self.assertAlmostEqual(float(outputs[0][1]), float(outputs[1][1]), places=4)
+        self.assertLess(
+            outputs[1][2]['prefixes_expanded'], outputs[0][2]['prefixes_expanded'] // 10)
+
+        stream = decoder.stream()
+        for chunk in encoder_output[0].split(100):
+            stream.next(chunk)
+        beams, lengths, scores, timesteps = stream.decode()
+        self.assertEqual(beams[0][:lengths[0]].tolist(), outputs[1][0].tolist())
+
+        with self.assertRaises(RuntimeError):
+            BeamSearchDecoder(WAV2VEC2_ENGLISH_LABEL, beam_threshold=0.0)(encoder_output)
+
+    def test_decode_wav2vec2_sample_long_form(self):
+        encoder_output = torch.load(
+            os.path.join(
+                os.path.dirname(__file__),
+                'librispeech-test-clean-121-121726-0000-with-wav2vec_small_960h.pt',
+            )
+        ).detach().log_softmax(-1).repeat(1, 8, 1)
+        outputs = []
+        for long_form in [False, True]:
+            decoder = BeamSearchDecoder(
+                WAV2VEC2_ENGLISH_LABEL, beam_size=16, blank_id=0, is_nll=True,
+                word_delimiter='|', long_form=long_form, collect_stats=True)
+            outputs.append((decoder(encoder_output), decoder.get_stats()))
+        (beams, lengths, scores, timesteps), stats = outputs[0]
+        (lf_beams, lf_lengths, lf_scores, lf_timesteps), lf_stats = outputs[1]
+        self.assertEqual(lengths.tolist(), lf_lengths.tolist())
+        self.assertEqual(scores.tolist(), lf_scores.tolist())
+        for j in range(16):
+            length = lengths[0][j]
+            self.assertEqual(beams[0][j][:length].tolist(), lf_beams[0][j][:length].tolist())
+            self.assertEqual(
+                timesteps[0][j][:length].tolist(), lf_timesteps[0][j][:length].tolist())
+        self.assertEqual(stats['tokens_committed'], 0)
+        self.assertGreater(lf_stats['tokens_committed'], 0)
+        self.assertLess(lf_stats['peak_nodes'], stats['peak_nodes'])
+
+        stream = decoder.stream()
+        for chunk in encoder_output[0].split(100):
+            stream.next(chunk)
+            committed, committed_timesteps = stream.committed()
+            beams, lengths, _, timesteps = stream.decode()
+            num_committed = committed.size(0)
+            self.assertLessEqual(num_committed, lengths.min())
+            self.assertEqual(beams[:, :num_committed].tolist(), [committed.tolist()] * 16)
+            self.assertEqual(
+                timesteps[:, :num_committed].tolist(), [committed_timesteps.tolist()] * 16)
+        self.assertEqual(beams[0][:lengths[0]].tolist(), lf_beams[0][0][:lf_lengths[0][0]].tolist())
+        self.assertEqual(stream.stats()['tokens_committed'], num_committed)
+
+    def test_decode_wav2vec2_sample_segments(self):
+        encoder_output = torch.load(
+            os.path.join(
+                os.path.dirname(__file__),
+                'librispeech-test-clean-121-121726-0000-with-wav2vec_small_960h.pt',
+            )
+        ).detach().log_softmax(-1).repeat(2, 1, 1)
+        seq_lens = torch.tensor([encoder_output.size(1), 200], dtype=torch.int32)
+        outputs = []
+        for segment_min_blank_frames in [None, 5]:
+            decoder = BeamSearchDecoder(
+                WAV2VEC2_ENGLISH_LABEL, beam_size=50, blank_id=0, is_nll=True,
+                word_delimiter='|', nbest=5, collect_stats=True,
+                segment_min_blank_frames=segment_min_blank_frames)
+            outputs.append((decoder.forward_ragged(encoder_output, seq_lens), decoder.get_stats()))
+        (tokens, offsets, scores, _), stats = outputs[0]
+        (seg_tokens, seg_offsets, seg_scores, seg_timesteps), seg_stats = outputs[1]
+        self.assertEqual(stats['segments'], 2)
+        self.assertGreater(seg_stats['segments'], 10)
+        # the n-best of the segments are stitched in the order of the scores
+        for k in range(10):
+            self.assertEqual(
+                tokens[offsets[k]:offsets[k + 1]].tolist(),
+                seg_tokens[seg_offsets[k]:seg_offsets[k + 1]].tolist())
+            timesteps = seg_timesteps[seg_offsets[k]:seg_offsets[k + 1]]
+            # in the frames of the sequence
+            self.assertGreaterEqual(int(timesteps.min()), 0)
+            self.assertLess(int(timesteps.max()), seq_lens[k // 5])
+        torch.testing.assert_close(scores, seg_scores, rtol=0, atol=1e-2)
+        self.assertEqual(seg_scores[0].tolist(), sorted(seg_scores[0].tolist()))
+
+        transcripts = decoder.transcribe(encoder_output[:1]).transcripts
+        self.assertEqual(
+            transcripts[0][0],
+            'ALSO A POPULAR CONTRIVANCE WHEREBY LOVE MAKING MAY BE SUSPENDED BUT NOT STOPPED '
+            'DURING THE PICNIC SEASON')
+        async_beams, async_lengths, _, _ = decoder.forward_async(encoder_output, seq_lens).wait()
+        self.assertEqual(
+            async_beams[0][0][:async_lengths[0][0]].tolist(), seg_tokens[:seg_offsets[1]].tolist())
+
+        with self.assertRaises(RuntimeError):
+            BeamSearchDecoder(WAV2VEC2_ENGLISH_LABEL, segment_min_blank_frames=0)(encoder_output)
+
+    def test_decode_wav2vec2_sample_sweep(self):
+        encoder_output = torch.load(
+            os.path.join(
+                os.path.dirname(__file__),
+                'librispeech-test-clean-121-121726-0000-with-wav2vec_small_960h.pt',
+            )
+        ).detach().log_softmax(-1).repeat(2, 1, 1)
+        seq_lens = torch.tensor([encoder_output.size(1), 200], dtype=torch.int32)
+        kwargs = {'beam_size': 20, 'cutoff_top_n': 40, 'nbest': 3}
+        configs = [
+            {},
+            {'beam_size': 5, 'nbest': 1},
+            {'cutoff_top_n': 5},
+            {'cutoff_prob': 0.9},
+            {'cutoff_top_n': 10, 'cutoff_prob': 0.99, 'beam_threshold': 10.0},
+        ]
+        decoder = BeamSearchDecoder(
+            WAV2VEC2_ENGLISH_LABEL, blank_id=0, is_nll=True, collect_stats=True, **kwargs)
+        outputs = decoder.sweep(encoder_output, seq_lens, configs)
+        self.assertEqual(len(outputs), len(configs))
+        # pruned once for all the configurations
+        self.assertEqual(decoder.get_stats()['calls'], 1)
+        for config, output in zip(configs, outputs):
+            expected = BeamSearchDecoder(
+                WAV2VEC2_ENGLISH_LABEL, blank_id=0, is_nll=True,
+                **dict(kwargs, **config)).forward_ragged(encoder_output, seq_lens)
+            for value, expected_value in zip(output, expected):
+                self.assertTrue(torch.equal(value, expected_value))
+
+        # `nbest` defaults to `beam_size`, and one beam is the best path
+        configs = [{'beam_size': 20}, {}, {'beam_size': 1}]
+        decoder = BeamSearchDecoder(WAV2VEC2_ENGLISH_LABEL, beam_size=5, blank_id=0, is_nll=True)
+        outputs = decoder.sweep(encoder_output, seq_lens, configs)
+        for config, output in zip(configs, outputs):
+            expected = BeamSearchDecoder(
+                WAV2VEC2_ENGLISH_LABEL, blank_id=0, is_nll=True,
+                **dict({'beam_size': 5}, **config)).forward_ragged(encoder_output, seq_lens)
+            for value, expected_value in zip(output, expected):
+                self.assertTrue(torch.equal(value, expected_value))
+        self.assertEqual(outputs[0][2].shape, (2, 20))
+
+        # the language model weights
+        lm_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'test.arpa')
+        vocab_list = ['_', ' ', 'o', 'n']
+        probs_seq = torch.tensor([[
+            [0.05, 0.05, 0.40, 0.50],
+            [0.05, 0.05, 0.50, 0.40],
+        ]])
+        decoder = BeamSearchDecoder(vocab_list, beam_size=self.beam_size, model_path=lm_path)
+        (tokens, offsets, _, _), (lm_tokens, lm_offsets, _, _) = decoder.sweep(
+            probs_seq, configs=[{'alpha': 0.0, 'beta': 0.0}, {}])
+        self.assertEqual(tokens[:offsets[1]].tolist(), [3, 2])  # "no"
+        self.assertEqual(lm_tokens[:lm_offsets[1]].tolist(), [2, 3])  # "on"
+        decoder.alpha = decoder.beta = 0.0
+        (tokens, offsets, _, _), (lm_tokens, lm_offsets, _, _) = decoder.sweep(
+            probs_seq, configs=[{}, {'alpha': 0.5, 'beta': 1.0}])
+        self.assertEqual(tokens[:offsets[1]].tolist(), [3, 2])
+        self.assertEqual(lm_tokens[:lm_offsets[1]].tolist(), [2, 3])
+
+        with self.assertRaises(ValueError):
+            decoder.sweep(probs_seq, configs=[{'lm_weight': 1.0}])
+        with self.assertRaises(ValueError):
+            decoder.sweep(probs_seq, configs=[])
+
+    def test_decode_wav2vec2_sample_fast_math(self):
+        encoder_output = torch.load(
+            os.path.join(
+                os.path.dirname(__file__),
+                'librispeech-test-clean-121-121726-0000-with-wav2vec_small_960h.pt',
+            )
+        ).detach()
+        for is_nll, probs in [(True, encoder_output.log_softmax(-1)),
+                              (False, encoder_output.softmax(-1))]:
+            outputs = []
+            for fast_math in [False, True]:
+                decoder = BeamSearchDecoder(
+                    WAV2VEC2_ENGLISH_LABEL, beam_size=20, blank_id=0,
+                    is_nll=is_nll, fast_math=fast_math)
+                outputs.append(decoder(probs))
+            beams, lengths, scores, _ = outputs[0]
+            fast_beams, fast_lengths, fast_scores, _ = outputs[1]
+            self.assertEqual(
+                beams[0][0][:lengths[0][0]].tolist(),
+                fast_beams[0][0][:fast_lengths[0][0]].tolist())
+            torch.testing.assert_close(scores, fast_scores, rtol=0, atol=1e-3)
+
+        stream = decoder.stream()
+        stream.next(probs[0])
+        beams, lengths, scores, _ = stream.decode()
+        self.assertEqual(
+            beams[0][:lengths[0]].tolist(), fast_beams[0][0][:fast_lengths[0][0]].tolist())
+
 
 if __name__ == '__main__':
     unittest.main()